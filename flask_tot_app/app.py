@@ -1,96 +1,66 @@
 import os
 import json
+import functools
+import hashlib
+import hmac
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from flask import Response, g, render_template, request, redirect, url_for, flash, jsonify, stream_with_context
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from dotenv import load_dotenv
-import openai
+import numpy as np
+import providers
+import geo
+import json_extract
+import limits
+import search_index
+import tot_search
+import tracing
+from factory import create_app
+from models import SavedStrategy, SearchHistory, StrategyDay, StrategyLocation, Trip, User, db
+from query_index import QueryIndex
+from cost_analytics import CostStore
+from cache import StrategyCache, TTLCache, strategy_fingerprint
+from jobs import JobQueue, QueueFullError, TransientJobError
+from migrations import backfill_saved_strategies, upgrade_schema
+from sqlalchemy import event, func, tuple_
+from sqlalchemy.orm import defer, joinedload, load_only, selectinload
 
-load_dotenv()
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
+app = create_app()
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
-
-# Configure OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# --- Models ---
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(150), unique=True, nullable=False)
-    email = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(150), nullable=False)
-    openai_key = db.Column(db.String(200), nullable=True)
-    anthropic_key = db.Column(db.String(200), nullable=True)
-    gemini_key = db.Column(db.String(200), nullable=True)
-    searches = db.relationship('SearchHistory', backref='author', lazy=True)
-    saved_strategies = db.relationship('SavedStrategy', backref='author', lazy=True)
-    trips = db.relationship('Trip', backref='author', lazy=True)
-
-class SearchHistory(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    search_query = db.Column(db.Text, nullable=False)
-    results = db.Column(db.Text, nullable=True) # Stores JSON string of search results
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-
-class SavedStrategy(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    content = db.Column(db.Text, nullable=False) # Stores JSON string of the full strategy details
-    critique = db.Column(db.Text, nullable=True)
-    score = db.Column(db.Float, nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    trips = db.relationship('Trip', backref='strategy', lazy=True)
-
-class Trip(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    destination = db.Column(db.String(100), nullable=False)
-    start_date = db.Column(db.DateTime, nullable=False)
-    end_date = db.Column(db.DateTime, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    strategy_id = db.Column(db.Integer, db.ForeignKey('saved_strategy.id'), nullable=True)
+tracing.install(app)
 
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
-# --- Configuration ---
-from openai import OpenAI
-from anthropic import Anthropic
-import google.generativeai as genai
-
-openai_client = None
-anthropic_client = None
-gemini_available = False
-
-if os.getenv("OPENAI_API_KEY"):
-    openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-if os.getenv("ANTHROPIC_API_KEY"):
-    anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-
-if os.getenv("GOOGLE_API_KEY"):
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    gemini_available = True
+def operator_required(view):
+    """login_required, and the user must also be listed in OPERATOR_USERNAMES."""
+    @functools.wraps(view)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if current_user.username not in app.config['OPERATOR_USERNAMES']:
+            return jsonify({'status': 'error', 'message': 'Operators only'}), 403
+        return view(*args, **kwargs)
+    return wrapped
 
 # --- Encryption ---
-from cryptography.fernet import Fernet
-
-encryption_key = os.getenv("ENCRYPTION_KEY")
-cipher_suite = Fernet(encryption_key) if encryption_key else None
+@functools.lru_cache(maxsize=1)
+def get_cipher():
+    """The Fernet cipher for ENCRYPTION_KEY, or None when it isn't set. Built on first use."""
+    encryption_key = os.getenv("ENCRYPTION_KEY")
+    if not encryption_key:
+        return None
+    from cryptography.fernet import Fernet
+    return Fernet(encryption_key)
 
 def encrypt_value(value):
     """Encrypts a string value."""
+    cipher_suite = get_cipher()
     if not value or not cipher_suite:
         return value
     try:
@@ -101,6 +71,7 @@ def encrypt_value(value):
 
 def decrypt_value(value):
     """Decrypts a string value."""
+    cipher_suite = get_cipher()
     if not value or not cipher_suite:
         return value
     try:
@@ -110,6 +81,56 @@ def decrypt_value(value):
         return value
 
 # --- Helper Functions ---
+def system_api_keys():
+    """Returns the provider keys configured through environment variables."""
+    return {
+        'gemini': os.getenv("GOOGLE_API_KEY"),
+        'openai': os.getenv("OPENAI_API_KEY"),
+        'anthropic': os.getenv("ANTHROPIC_API_KEY"),
+        # Offline provider, only consulted when 'fake' is listed in LLM_PROVIDERS
+        'fake': os.getenv("FAKE_LLM_KEY"),
+    }
+
+USER_KEY_COLUMNS = (('gemini', 'gemini_key'), ('openai', 'openai_key'), ('anthropic', 'anthropic_key'))
+
+api_key_cache = TTLCache(app.config['API_KEY_CACHE_SIZE'], app.config['API_KEY_CACHE_TTL_SECONDS'])
+
+def user_api_keys(user):
+    """Returns {provider: decrypted key} for the keys `user` has saved.
+
+    Results are cached per user alongside the ciphertexts they came from, so a key
+    changed elsewhere (another worker process, a script) is never served stale.
+    """
+    ciphertexts = tuple(getattr(user, column) for _, column in USER_KEY_COLUMNS)
+    cached = api_key_cache.get(user.id)
+    if cached is not None and cached[0] == ciphertexts:
+        return cached[1]
+    keys = {
+        name: decrypt_value(ciphertext)
+        for (name, _), ciphertext in zip(USER_KEY_COLUMNS, ciphertexts)
+        if ciphertext
+    }
+    api_key_cache.set(user.id, (ciphertexts, keys))
+    return keys
+
+def resolve_api_keys():
+    """Returns the decrypted provider keys for the current user, falling back to the system keys.
+
+    A user key its provider recently rejected is left out, so the system key (if any)
+    is used for that provider instead. Resolved once per request so worker threads
+    never touch `current_user`.
+    """
+    if 'api_keys' not in g:
+        with tracing.span('resolve_keys'):
+            api_keys = system_api_keys()
+            if current_user.is_authenticated:
+                for name, key in user_api_keys(current_user).items():
+                    verdict = limits.key_health(name, key)
+                    if verdict is None or verdict['ok']:
+                        api_keys[name] = key
+        g.api_keys = api_keys
+    return dict(g.api_keys)
+
 def mock_generation():
     """Returns hardcoded detailed strategies for testing."""
     return [
@@ -178,8 +199,10 @@ def mock_generation():
         }
     ]
 
-def generate_strategies_llm(problem):
-    prompt = f"""
+GENERATION_SYSTEM_PROMPT = "You are a helpful travel assistant that outputs only valid JSON."
+
+def build_generation_prompt(problem):
+    return f"""
     You are a travel planning expert. Break down the following problem into 3 distinct high-level approaches or strategies. 
     Problem: {problem}. 
     
@@ -191,197 +214,680 @@ def generate_strategies_llm(problem):
     - 'locations': list of objects with 'name', 'lat' (float), 'lon' (float) for major cities visited.
     """
 
-    content = None
-    
-    # Check for user-provided keys first
-    user_gemini_key = decrypt_value(current_user.gemini_key) if current_user.is_authenticated and current_user.gemini_key else os.getenv("GOOGLE_API_KEY")
-    user_openai_key = decrypt_value(current_user.openai_key) if current_user.is_authenticated and current_user.openai_key else os.getenv("OPENAI_API_KEY")
-    user_anthropic_key = decrypt_value(current_user.anthropic_key) if current_user.is_authenticated and current_user.anthropic_key else os.getenv("ANTHROPIC_API_KEY")
+def generate_strategies_llm(problem, api_keys=None, on_usage=None):
+    if api_keys is None:
+        api_keys = resolve_api_keys()
 
-    print(f"Keys available - Gemini: {bool(user_gemini_key)}, OpenAI: {bool(user_openai_key)}, Anthropic: {bool(user_anthropic_key)}")
+    if app.config['GENERATION_STREAMING'] and app.config['GENERATION_MODE'] != 'race':
+        return list(iter_generated_strategies(problem, api_keys, on_usage=on_usage))
 
-    # 1. Try Google Gemini
-    if user_gemini_key:
-        try:
-            print("Using Google Gemini...")
-            genai.configure(api_key=user_gemini_key)
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
-            content = response.text
-            print("Gemini response received.")
-        except Exception as e:
-            print(f"Gemini error: {e}")
-            content = None
+    print(f"Keys available - {', '.join(f'{name}: {bool(key)}' for name, key in api_keys.items())}")
 
-    # 2. Try OpenAI
-    if not content and user_openai_key:
-        try:
-            print("Using OpenAI...")
-            client = OpenAI(api_key=user_openai_key)
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful travel assistant that outputs only valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
-            )
-            content = response.choices[0].message.content
-            print("OpenAI response received.")
-        except Exception as e:
-            print(f"OpenAI error: {e}")
-            content = None
+    prompt = build_generation_prompt(problem)
+    if app.config['GENERATION_MODE'] == 'race':
+        # First provider whose answer parses into a non-empty strategy list wins
+        return providers.complete_with_race(
+            prompt,
+            api_keys,
+            parse=parse_strategies,
+            hedge_delay=app.config['HEDGE_DELAY_SECONDS'],
+            system=GENERATION_SYSTEM_PROMPT,
+            max_tokens=4000,
+            on_usage=on_usage,
+        ) or []
 
-    # 3. Try Anthropic
-    if not content and user_anthropic_key:
-        try:
-            print("Using Anthropic (Haiku)...")
-            client = Anthropic(api_key=user_anthropic_key)
-            message = client.messages.create(
-                model="claude-3-haiku-20240307",
-                max_tokens=4000,
-                temperature=0.7,
-                system="You are a helpful travel assistant that outputs only valid JSON.",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            content = message.content[0].text
-            print("Anthropic response received.")
-        except Exception as e:
-            print(f"Anthropic error: {e}")
-            content = None
+    # Gemini -> OpenAI -> Anthropic, using the pooled client for each key
+    content = providers.complete_with_fallback(
+        prompt,
+        api_keys,
+        system=GENERATION_SYSTEM_PROMPT,
+        max_tokens=4000,
+        purpose='generation',
+        on_usage=on_usage,
+    )
 
     if not content:
         print("No content generated from any provider.")
         return []
 
-    try:
-        # Clean up potential markdown formatting
-        content = content.replace('```json', '').replace('```', '').strip()
-        
-        # Attempt to find the first '[' and last ']' to extract the list
-        import re
-        match = re.search(r'\[.*\]', content, re.DOTALL)
-        if match:
-            content = match.group(0)
-        
-        # Ensure it's a list
+    return parse_strategies(content)
+
+def iter_generated_strategies(problem, api_keys, on_usage=None):
+    """Streams generation and yields each strategy as soon as its JSON object is complete.
+
+    A response cut off mid-array still yields the strategies that finished.
+    """
+    print(f"Keys available - {', '.join(f'{name}: {bool(key)}' for name, key in api_keys.items())}")
+    produced = 0
+    for strategy in providers.stream_with_fallback(
+        build_generation_prompt(problem),
+        api_keys,
+        parser_factory=json_extract.StrategyStreamParser,
+        system=GENERATION_SYSTEM_PROMPT,
+        max_tokens=4000,
+        purpose='generation',
+        on_usage=on_usage,
+    ):
+        produced += 1
+        yield strategy
+    if not produced:
+        print("No strategies generated from any provider.")
+
+def parse_strategies(content):
+    """Parses an LLM response into a list of strategy dicts; returns [] if nothing usable is found."""
+    with tracing.span('parse', kind='strategies') as current:
         try:
-            data = json.loads(content)
-        except json.JSONDecodeError:
-            # Fallback: Try to fix common JSON errors (like trailing commas)
-            # This is a simple heuristic; for production, a robust library like `json5` or `dirtyjson` is better.
-            # Here we just try to remove trailing commas before closing brackets/braces
-            content_fixed = re.sub(r',\s*([\]}])', r'\1', content)
-            data = json.loads(content_fixed)
-        
-        if isinstance(data, dict):
-            if 'strategies' in data and isinstance(data['strategies'], list):
-                return data['strategies']
-            # If the LLM returned a single strategy object, wrap it in a list
-            if 'title' in data and 'summary' in data:
-                return [data]
-            return []
-            
-        if isinstance(data, list):
-            # Filter out non-dict items
-            return [item for item in data if isinstance(item, dict)]
-            
-        return []
+            strategies = json_extract.extract_strategies(content)
+        except Exception as e:
+            print(f"Error parsing strategies: {e}")
+            strategies = []
+        current.set(outcome='ok' if strategies else 'invalid')
+    if not strategies:
+        print("Error parsing JSON: no strategy objects found")
+        print(f"Raw content: {content[:2000]}")
+    return strategies
+
+def build_refinement_prompt(problem, strategy, count):
+    draft = {k: v for k, v in strategy.items() if k not in ('critique', 'score')}
+    return f"""
+    You are a travel planning expert improving a draft plan.
+    Problem: {problem}.
+    Draft strategy: {json.dumps(draft)}
+    A harsh critic scored it {strategy.get('score', 0)}/10 and said: {strategy.get('critique', '')}
+
+    Write {count} refined variants of this strategy that answer the critic's main objections. Each variant should change one thing, for example rebalancing the budget, swapping a city, or reordering the route, and keep what already works.
+    Output strictly as a JSON list of objects with the same keys as the draft ('title', 'summary', 'cost_breakdown', 'itinerary', 'locations'), plus 'refinement': string (one sentence on what changed).
+    """
+
+@tracing.traced('refine')
+def refine_strategy_llm(problem, strategy, count, api_keys, on_usage=None):
+    """Asks for `count` refined variants of a critiqued strategy; returns the parsed strategies, or []."""
+    try:
+        content = providers.complete_with_fallback(
+            build_refinement_prompt(problem, strategy, count),
+            api_keys,
+            system=GENERATION_SYSTEM_PROMPT,
+            max_tokens=4000,
+            purpose='refinement',
+            on_usage=on_usage,
+        )
     except Exception as e:
-        print(f"Error parsing JSON: {e}")
-        print(f"Raw content: {content}")
+        print(f"Error refining strategy: {e}")
+        return []
+    if not content:
+        tracing.annotate(outcome='no_response')
         return []
+    with tracing.span('parse', kind='refinement'):
+        try:
+            refined = json_extract.extract_strategies(content)
+        except Exception as e:
+            print(f"Error parsing refinement: {e}")
+            refined = []
+    tracing.annotate(outcome='ok' if refined else 'invalid')
+    return refined
+
+critique_cache = TTLCache(app.config['CRITIQUE_CACHE_SIZE'], app.config['CRITIQUE_CACHE_TTL_SECONDS'])
+
+@tracing.traced('critique')
+def critique_strategy_llm(strategy_content, api_keys=None, on_usage=None, on_call=None):
+    fingerprint = strategy_fingerprint(strategy_content)
+    cached = critique_cache.get(fingerprint)
+    if cached is not None:
+        tracing.annotate(outcome='cached')
+        return dict(cached)
 
-def critique_strategy_llm(strategy_content):
     try:
         strategy_str = json.dumps(strategy_content)
         prompt = f"Act as a harsh travel critic. Analyze this strategy: {strategy_str}. Evaluate feasibility, balance, and budget. Give a score 1-10. Output JSON with keys: 'critique', 'score'."
 
-        content = None
-
-        # Check for user-provided keys first
-        user_gemini_key = decrypt_value(current_user.gemini_key) if current_user.is_authenticated and current_user.gemini_key else os.getenv("GOOGLE_API_KEY")
-        user_openai_key = decrypt_value(current_user.openai_key) if current_user.is_authenticated and current_user.openai_key else os.getenv("OPENAI_API_KEY")
-        user_anthropic_key = decrypt_value(current_user.anthropic_key) if current_user.is_authenticated and current_user.anthropic_key else os.getenv("ANTHROPIC_API_KEY")
+        if api_keys is None:
+            api_keys = resolve_api_keys()
 
-        # 1. Try Google Gemini
-        if user_gemini_key:
-            try:
-                genai.configure(api_key=user_gemini_key)
-                model = genai.GenerativeModel('gemini-2.5-flash')
-                response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
-                content = response.text
-            except Exception as e:
-                print(f"Gemini critique error: {e}")
-                content = None
-
-        # 2. Try OpenAI
-        if not content and user_openai_key:
-            try:
-                client = OpenAI(api_key=user_openai_key)
-                response = client.chat.completions.create(
-                    model="gpt-4-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a critic that outputs only valid JSON."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    response_format={"type": "json_object"}
-                )
-                content = response.choices[0].message.content
-            except Exception as e:
-                print(f"OpenAI critique error: {e}")
-                content = None
-
-        # 3. Try Anthropic
-        if not content and user_anthropic_key:
-            try:
-                client = Anthropic(api_key=user_anthropic_key)
-                message = client.messages.create(
-                    model="claude-3-haiku-20240307",
-                    max_tokens=1000,
-                    temperature=0.7,
-                    system="You are a critic that outputs only valid JSON.",
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                content = message.content[0].text
-            except Exception as e:
-                print(f"Anthropic critique error: {e}")
-                content = None
+        if on_call:
+            on_call(1)
+        content = providers.complete_with_fallback(
+            prompt,
+            api_keys,
+            system="You are a critic that outputs only valid JSON.",
+            max_tokens=1000,
+            purpose='critique',
+            on_usage=on_usage,
+        )
 
         if not content:
-            return {"critique": "Could not generate critique.", "score": 0}
+            tracing.annotate(outcome='no_response')
+            return dict(FALLBACK_CRITIQUE)
         
-        content = content.replace('```json', '').replace('```', '').strip()
-        return json.loads(content)
+        with tracing.span('parse', kind='critique'):
+            critique_data = json_extract.extract_json(content)
+        if not isinstance(critique_data, dict):
+            raise ValueError(f"no JSON object in critique response: {content[:200]!r}")
+        if 'score' in critique_data:
+            critique_cache.set(fingerprint, critique_data)
+        tracing.annotate(outcome='ok')
+        return dict(critique_data)
 
     except Exception as e:
+        tracing.annotate(outcome='error')
         print(f"Error critiquing strategy: {e}")
         return {"critique": "Error generating critique.", "score": 0}
 
+FALLBACK_CRITIQUE = {"critique": "Could not generate critique.", "score": 0}
+FALLBACK_CRITIQUE_TEXTS = (FALLBACK_CRITIQUE['critique'], "Error generating critique.")
+
+# Shared across requests so the total number of in-flight critique calls stays bounded
+critique_executor = ThreadPoolExecutor(max_workers=app.config['CRITIQUE_MAX_WORKERS'], thread_name_prefix='critique')
+# Tree search expansions; each one waits on critiques, so they can't share the critique pool
+refine_executor = ThreadPoolExecutor(max_workers=app.config['CRITIQUE_MAX_WORKERS'], thread_name_prefix='refine')
+
+def critique_strategies(strategies, api_keys, deadline=None, mode=None, on_usage=None, on_call=None):
+    """Critiques every strategy and returns the critique dicts in the same order.
+
+    In 'parallel' mode all critiques are submitted at once. Critiques that have not
+    finished by `deadline` (a `time.monotonic()` value) get the fallback critique,
+    exactly like a critique whose providers all failed. `on_call(n)` is told about
+    each provider call made; critiques served from critique_cache make none.
+    """
+    mode = mode or app.config['CRITIQUE_MODE']
+    if mode == 'sequential':
+        return [critique_strategy_llm(s, api_keys, on_usage, on_call) for s in strategies]
+    if mode == 'batch':
+        return critique_strategies_batch(strategies, api_keys, deadline=deadline, on_usage=on_usage, on_call=on_call)
+
+    critiques = [None] * len(strategies)
+    for index, critique_data in iter_parallel_critiques(strategies, api_keys, deadline=deadline, on_usage=on_usage,
+                                                        on_call=on_call):
+        critiques[index] = critique_data
+    return critiques
+
+def iter_parallel_critiques(strategies, api_keys, deadline=None, on_usage=None, on_call=None):
+    """Submits all critiques at once and yields (index, critique) pairs as they complete."""
+    critique = tracing.bind(critique_strategy_llm)
+    futures = {critique_executor.submit(critique, s, api_keys, on_usage, on_call): i for i, s in enumerate(strategies)}
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    try:
+        for future in as_completed(list(futures), timeout=timeout):
+            yield futures.pop(future), future.result()
+    except TimeoutError:
+        pass
+    for future, index in futures.items():
+        future.cancel()
+        print("Critique missed the request deadline.")
+        yield index, dict(FALLBACK_CRITIQUE)
+
+def critique_strategies_batch(strategies, api_keys, deadline=None, on_usage=None, on_call=None):
+    """Critiques all uncached strategies with a single "harsh critic" call.
+
+    The reply must be a JSON array of {index, critique, score} aligned with the input.
+    Strategies the batch reply doesn't cover validly are critiqued one by one in
+    parallel, so a malformed batch costs one extra round trip rather than the search.
+    """
+    critiques = [critique_cache.get(strategy_fingerprint(s)) for s in strategies]
+    missing = [i for i, c in enumerate(critiques) if c is None]
+    if not missing:
+        return [dict(c) for c in critiques]
+
+    batch = [strategies[i] for i in missing]
+    if on_call:
+        on_call(1)
+    future = critique_executor.submit(tracing.bind(request_batch_critique), batch, api_keys, on_usage)
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    try:
+        aligned = future.result(timeout=timeout)
+    except Exception as e:
+        print(f"Batch critique failed: {e}")
+        aligned = [None] * len(batch)
+
+    retry = []
+    for i, critique_data in zip(missing, aligned):
+        if critique_data is None:
+            retry.append(i)
+        else:
+            critique_cache.set(strategy_fingerprint(strategies[i]), critique_data)
+            critiques[i] = critique_data
+    if retry:
+        print(f"Batch critique left {len(retry)} of {len(batch)} strategies unscored; critiquing them individually.")
+        fallback = critique_strategies([strategies[i] for i in retry], api_keys, deadline=deadline, mode='parallel',
+                                       on_usage=on_usage, on_call=on_call)
+        for i, critique_data in zip(retry, fallback):
+            critiques[i] = critique_data
+    return [dict(c) for c in critiques]
+
+def build_batch_critique_prompt(strategies):
+    numbered = [dict(s, index=i) for i, s in enumerate(strategies)]
+    return (
+        f"Act as a harsh travel critic. Analyze each of these {len(strategies)} strategies: {json.dumps(numbered)}. "
+        "For each one, evaluate feasibility, balance, and budget and give a score 1-10. "
+        f"Output JSON with the key 'critiques': an array of exactly {len(strategies)} objects, one per strategy "
+        "in the same order, each with keys 'index' (the strategy's index), 'critique', 'score'."
+    )
+
+@tracing.traced('batch_critique')
+def request_batch_critique(strategies, api_keys, on_usage=None):
+    """Sends the batch critique prompt; returns one critique dict (or None) per strategy."""
+    content = providers.complete_with_fallback(
+        build_batch_critique_prompt(strategies),
+        api_keys,
+        system="You are a critic that outputs only valid JSON.",
+        max_tokens=1000 * len(strategies),
+        purpose='batch critique',
+        on_usage=on_usage,
+    )
+    if not content:
+        return [None] * len(strategies)
+    with tracing.span('parse', kind='batch_critique'):
+        data = json_extract.extract_json(content)
+    if data is None:
+        print(f"Batch critique is not valid JSON: {content[:200]!r}")
+        return [None] * len(strategies)
+    return align_batch_critiques(data, len(strategies))
+
+def align_batch_critiques(data, count):
+    """Maps a batch critique reply onto strategy positions.
+
+    Entries are placed by their 'index' when every entry carries a distinct, in-range
+    one, otherwise by position, which is only trusted when the array has exactly
+    `count` entries. Entries without a critique string and a 0-10 score are dropped.
+    """
+    if isinstance(data, dict):
+        data = data.get('critiques')
+    if not isinstance(data, list):
+        return [None] * count
+
+    aligned = [None] * count
+    indexes = [item.get('index') if isinstance(item, dict) else None for item in data]
+    by_index = all(isinstance(i, int) and 0 <= i < count for i in indexes) and len(set(indexes)) == len(indexes)
+    if not by_index and len(data) != count:
+        print(f"Batch critique returned {len(data)} entries for {count} strategies without usable indexes.")
+        return aligned
+
+    for position, item in enumerate(data):
+        if not isinstance(item, dict):
+            continue
+        score = item.get('score')
+        if isinstance(score, str):
+            try:
+                score = float(score.split('/')[0])
+            except ValueError:
+                continue
+        if not isinstance(item.get('critique'), str) or not isinstance(score, (int, float)) or not 0 <= score <= 10:
+            continue
+        aligned[indexes[position] if by_index else position] = {'critique': item['critique'], 'score': score}
+    return aligned
+
+TRENDING_SEARCHES = [
+    {"label": "Kyoto", "query": "Kyoto in Spring"},
+    {"label": "Iceland", "query": "Iceland Road Trip"},
+    {"label": "Amalfi", "query": "Amalfi Coast Luxury"},
+    {"label": "Tokyo", "query": "Tokyo Food Tour"},
+    {"label": "Paris", "query": "Paris Romantic Getaway"},
+    {"label": "Bali", "query": "Bali Wellness Retreat"},
+    {"label": "New York", "query": "NYC Art & Culture"},
+    {"label": "Patagonia", "query": "Patagonia Hiking Adventure"},
+    {"label": "Santorini", "query": "Santorini Sunset Views"},
+    {"label": "Cape Town", "query": "Cape Town Wine & Safari"},
+    {"label": "Swiss Alps", "query": "Swiss Alps Ski Trip"},
+    {"label": "Machu Picchu", "query": "Machu Picchu Trek"}
+]
+
+def build_problem(query, origin):
+    """Combines the search box and the optional origin into the problem statement."""
+    if origin:
+        return f"{query} (Starting from {origin})"
+    return query
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+query_index = QueryIndex(os.path.join(app.instance_path, 'query_index'))
+
+@event.listens_for(SearchHistory, 'after_insert')
+def index_search_query(mapper, connection, target):
+    query_index.add(target.id, target.user_id, target.search_query)
+
+_query_index_checked = False
+_query_index_lock = threading.Lock()
+
+def ensure_query_index():
+    """Builds the near-duplicate index from SearchHistory when it has never been built. Checks once per process."""
+    global _query_index_checked
+    if _query_index_checked:
+        return
+    with _query_index_lock:
+        if _query_index_checked:
+            return
+        # No snapshot means no rebuild yet; the log alone only holds searches added since
+        if not os.path.exists(query_index.snapshot_path) and SearchHistory.query.count():
+            rows = db.session.query(SearchHistory.id, SearchHistory.user_id, SearchHistory.search_query).yield_per(10000)
+            print(f"Indexed {query_index.rebuild(rows)} past searches for near-duplicate lookup")
+        _query_index_checked = True
+
+cost_store = CostStore(os.path.join(app.instance_path, 'cost_analytics'))
+
+def refresh_cost_store():
+    """Feeds cost_store the searches that finished since it last looked. Returns the strategy rows added."""
+    watermark, pending = cost_store.cursor()
+    changed = SearchHistory.id > watermark
+    if pending:
+        changed = changed | SearchHistory.id.in_(pending)
+    rows = (
+        db.session.query(SearchHistory.id, SearchHistory.user_id, SearchHistory.status, SearchHistory.results)
+        .filter(changed)
+        .order_by(SearchHistory.id)
+        .yield_per(2000)
+    )
+    return cost_store.ingest(rows)
+
+strategy_cache = StrategyCache(
+    os.path.join(app.instance_path, 'strategy_cache.db'),
+    maxsize=app.config['STRATEGY_CACHE_SIZE'],
+    ttl=app.config['STRATEGY_CACHE_TTL_SECONDS'],
+)
+
+def default_search_params():
+    return {
+        'depth': app.config['TOT_DEPTH'],
+        'beam_width': app.config['TOT_BEAM_WIDTH'],
+        'branching': app.config['TOT_BRANCHING'],
+        'max_calls': app.config['TOT_MAX_CALLS'],
+        'max_tokens': app.config['TOT_MAX_TOKENS'],
+        'max_seconds': app.config['ANALYZE_DEADLINE_SECONDS'],
+    }
+
+SEARCH_PARAM_NAMES = ('depth', 'beam_width', 'branching', 'max_calls', 'max_tokens', 'max_seconds')
+
+def search_params(values):
+    """Tree search shape and budget from request `values`, clamped to what the server allows."""
+    params = default_search_params()
+    bounds = {
+        'depth': (0, tot_search.MAX_DEPTH),
+        'beam_width': (1, tot_search.MAX_BEAM_WIDTH),
+        'branching': (1, tot_search.MAX_BRANCHING),
+        # The budget can only be lowered
+        'max_calls': (1, params['max_calls']),
+        'max_tokens': (1, params['max_tokens']),
+        'max_seconds': (1, params['max_seconds']),
+    }
+    for name, (low, high) in bounds.items():
+        value = values.get(name, type=float if name == 'max_seconds' else int)
+        if value is not None:
+            params[name] = min(max(value, low), high)
+    return params
+
+def strategy_cache_key(problem, search):
+    """Deeper searches give different results, so each search shape is cached separately."""
+    if not search['depth']:
+        return problem
+    return f"{problem} (tree depth {search['depth']} beam {search['beam_width']} branching {search['branching']})"
+
+def iter_strategy_pipeline(problem, api_keys, deadline=None, search=None):
+    """Runs generation, critique and the tree search for `problem`, yielding progress as it happens.
+
+    Yields ('strategy', index, strategy) once per parsed strategy, ('critique', index,
+    critique) as each critique arrives, and ('status', None, message) as the tree search
+    (tot_search.py) moves through its levels. Each refined strategy arrives as one more
+    'strategy', already critiqued, with the next free index. A finished tree search
+    yields ('tree', None, tree), and the pipeline ends with ('ranked', order, strategies)
+    where `order` lists indexes best-first. Results are served from the strategy cache
+    when possible; nothing is cached when generation failed.
+    """
+    search = search or default_search_params()
+    cache_key = strategy_cache_key(problem, search)
+    cached = strategy_cache.get(cache_key)
+    if cached is not None:
+        print("Strategy cache hit.")
+        strategies = json.loads(cached)
+        for index, strategy in enumerate(strategies):
+            yield 'strategy', index, strategy
+        yield 'ranked', list(range(len(strategies))), strategies
+        return
+
+    search_deadline = time.monotonic() + search['max_seconds']
+    budget = tot_search.Budget(search['max_calls'], search['max_tokens'],
+                               search_deadline if deadline is None else min(deadline, search_deadline))
+    budget.count_calls(1)
+    strategies = []
+    if app.config['GENERATION_STREAMING'] and app.config['GENERATION_MODE'] != 'race':
+        generated = iter_generated_strategies(problem, api_keys, on_usage=budget.charge)
+    else:
+        generated = generate_strategies_llm(problem, api_keys, on_usage=budget.charge)
+    for strategy in generated:
+        if isinstance(strategy, dict):
+            strategies.append(strategy)
+            yield 'strategy', len(strategies) - 1, strategy
+
+    # Only critiques that miss critique_cache count against the call budget
+    if app.config['CRITIQUE_MODE'] == 'parallel':
+        critique_events = iter_parallel_critiques(strategies, api_keys, deadline=deadline, on_usage=budget.charge,
+                                                  on_call=budget.count_calls)
+    else:
+        critique_events = enumerate(critique_strategies(strategies, api_keys, deadline=deadline, on_usage=budget.charge,
+                                                        on_call=budget.count_calls))
+    degraded = False
+    for index, critique_data in critique_events:
+        strategies[index]['critique'] = critique_data.get('critique', 'No critique available.')
+        strategies[index]['score'] = critique_data.get('score', 0)
+        degraded = degraded or critique_data.get('critique') in FALLBACK_CRITIQUE_TEXTS
+        yield 'critique', index, {'critique': strategies[index]['critique'], 'score': strategies[index]['score']}
+
+    if search['depth'] and strategies and not degraded:
+        engine = tot_search.BeamSearch(
+            strategies,
+            expand=lambda strategy, count: refine_strategy_llm(problem, strategy, count, api_keys, on_usage=budget.charge),
+            score=lambda refined: critique_strategies(refined, api_keys, deadline=budget.deadline, on_usage=budget.charge),
+            budget=budget,
+            executor=refine_executor,
+            depth=search['depth'],
+            beam_width=search['beam_width'],
+            branching=search['branching'],
+            prune_margin=app.config['TOT_PRUNE_MARGIN'],
+        )
+        with tracing.span('tree_search', depth=search['depth']) as current:
+            for kind, payload in engine.run():
+                if kind == 'status':
+                    yield 'status', None, payload
+                else:
+                    yield 'strategy', payload.id, payload.strategy
+            current.set(nodes=len(engine.nodes), stopped=engine.stopped, **engine.budget.as_dict())
+        if engine.stopped:
+            print(f"Tree search stopped early: {engine.stopped}.")
+        with tracing.span('rank'):
+            # As many results as the first level had, now the best from the whole tree
+            best = engine.ranked(limit=len(strategies))
+            order = [node.id for node in best]
+            strategies = [node.strategy for node in best]
+        yield 'tree', None, engine.tree()
+    else:
+        with tracing.span('rank'):
+            order = sorted(range(len(strategies)), key=lambda i: strategies[i].get('score', 0), reverse=True)
+            strategies = [strategies[i] for i in order]
+    # Don't pin fallback critiques (provider outage, missed deadline) in the cache
+    if strategies and not degraded:
+        strategy_cache.set(cache_key, json.dumps(strategies))
+    yield 'ranked', order, strategies
+
+def run_strategy_pipeline(problem, api_keys, deadline=None, search=None):
+    """Generates and critiques strategies for `problem`; returns them ranked by score, or []."""
+    strategies = []
+    for kind, _, payload in iter_strategy_pipeline(problem, api_keys, deadline=deadline, search=search):
+        if kind == 'ranked':
+            strategies = payload
+    return strategies
+
+def iter_analysis_events(problem, api_keys, use_mock, deadline=None, allow_mock_fallback=True, search=None):
+    """Turns one analysis into client-facing (event, data) pairs.
+
+    Yields 'strategy', 'critique', 'status' and 'warning' events as the pipeline
+    progresses and ends with ('ranked', {'order': [...], 'strategies': [...], 'tree': ...}),
+    where the tree is None unless a tree search ran. When generation fails the example
+    strategies are used instead, unless `allow_mock_fallback` is False, in which case
+    the ranking is empty and the caller decides what to do.
+    """
+    order, strategies, tree = [], [], None
+    if not use_mock:
+        for kind, index, payload in iter_strategy_pipeline(problem, api_keys, deadline=deadline, search=search):
+            if kind == 'ranked':
+                order, strategies = index, payload
+            elif kind == 'tree':
+                tree = payload
+            elif kind == 'status':
+                yield 'status', {'message': payload}
+            elif kind == 'strategy':
+                yield 'strategy', {'index': index, 'strategy': payload}
+            else:
+                yield 'critique', dict(payload, index=index)
+
+    if not strategies and (use_mock or allow_mock_fallback):
+        if not use_mock:
+            print("LLM generation failed or returned empty. Falling back to mock data.")
+            yield 'warning', {'message': 'AI generation failed. Showing example strategies instead.'}
+        strategies = sorted(mock_generation(), key=lambda x: x.get('score', 0), reverse=True)
+        order = list(range(len(strategies)))
+        for index, strategy in enumerate(strategies):
+            yield 'strategy', {'index': index, 'strategy': strategy}
+
+    yield 'ranked', {'order': order, 'strategies': strategies, 'tree': tree}
+
+job_queue = JobQueue(
+    max_workers=app.config['JOB_WORKERS'],
+    max_running_per_owner=app.config['JOB_MAX_RUNNING_PER_USER'],
+    max_queued_per_owner=app.config['JOB_MAX_QUEUED_PER_USER'],
+    max_retries=app.config['JOB_MAX_RETRIES'],
+    retry_backoff=app.config['JOB_RETRY_BACKOFF_SECONDS'],
+)
+
+@tracing.traced('analysis_job')
+def run_analysis_job(job, problem, api_keys, use_mock, search_id=None, results_url=None, params=None):
+    """Job body for /analyze: runs the analysis and records progress on the SearchHistory row.
+
+    An empty generation result is retried as a transient provider error; only the last
+    attempt falls back to the example strategies. `params` are the tree search shape and
+    budget from `search_params()`.
+    """
+    tracing.annotate(attempt=job.attempts, mock=use_mock)
+    if job.attempts > 1:
+        tracing.count('wanderly_job_retries_total')
+    with app.app_context():
+        search = db.session.get(SearchHistory, search_id) if search_id else None
+
+        def record(status, progress):
+            job.set_progress(progress)
+            if search is not None:
+                with tracing.span('db_write', kind='progress'):
+                    search.status = status
+                    search.progress = progress
+                    db.session.commit()
+
+        last_attempt = job.attempts > job_queue.max_retries
+        try:
+            record('running', 'Exploring strategies...')
+            deadline = time.monotonic() + app.config['ANALYZE_DEADLINE_SECONDS']
+            ranked = None
+            for kind, data in iter_analysis_events(problem, api_keys, use_mock, deadline, allow_mock_fallback=last_attempt,
+                                                   search=params):
+                if kind == 'ranked':
+                    ranked = data
+                else:
+                    job.publish(kind, data)
+                    if kind == 'strategy' and data['index'] == 0 and not use_mock:
+                        record('running', 'The critic is scoring each strategy...')
+                    elif kind == 'status':
+                        record('running', data['message'])
+
+            if not ranked['strategies']:
+                raise TransientJobError("No provider returned usable strategies")
+
+            done = {'order': ranked['order']}
+            if ranked['tree'] is not None:
+                done['search'] = tree_summary(ranked['tree'])
+            if search is not None:
+                with tracing.span('db_write', kind='results'):
+                    search.results = json.dumps(ranked['strategies'])
+                    search.search_tree = json.dumps(ranked['tree']) if ranked['tree'] is not None else None
+                    search.status = 'done'
+                    search.progress = None
+                    db.session.commit()
+                done['results_url'] = results_url
+            else:
+                # Anonymous searches aren't persisted; the status endpoint hands the results back
+                done['strategies'] = ranked['strategies']
+            return done
+        except Exception as e:
+            # The job queue retries TransientJobError until the last attempt; anything else is final
+            if search is not None and (last_attempt or not isinstance(e, TransientJobError)):
+                db.session.rollback()
+                search.status = 'failed'
+                search.progress = str(e)[:200] or None
+                db.session.commit()
+            raise
+
+def tree_summary(tree):
+    """The tree search outcome without its nodes, for job status payloads."""
+    return {key: tree[key] for key in ('params', 'budget', 'stopped', 'best_score')} | {'nodes': len(tree['nodes'])}
+
+def job_owner():
+    """Fairness and access key for queued jobs: the user, or the client address when logged out."""
+    if current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    return f"anon:{request.remote_addr}"
+
+def rate_limited():
+    """Takes one search from the caller's /analyze bucket. Returns None if allowed, else seconds to wait."""
+    retry_after = limits.take_analysis(job_owner())
+    if retry_after is not None:
+        print(f"Rate limited {job_owner()} for {retry_after:.0f}s.")
+    return retry_after
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        # Keep proxies from buffering the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+def prewarm_strategy_cache():
+    """Fills the strategy cache for the trending searches using the system keys."""
+    api_keys = system_api_keys()
+    if not any(api_keys.get(name) for name in providers.PROVIDER_ORDER):
+        print("Skipping strategy cache pre-warm (no system keys).")
+        return
+    with app.app_context():
+        for item in TRENDING_SEARCHES:
+            if strategy_cache.get(item['query']) is None:
+                print(f"Pre-warming strategy cache: {item['query']}")
+                run_strategy_pipeline(item['query'], api_keys)
+
+def warm_up():
+    """Background start-up work for a worker process: the /analytics store, then the strategy cache."""
+    with app.app_context():
+        added = refresh_cost_store()
+    if added:
+        print(f"Read the costs of {added} strategies from past searches for /analytics")
+    if app.config['STRATEGY_CACHE_PREWARM']:
+        prewarm_strategy_cache()
+
+_warmed_up_pid = None
+_warm_up_lock = threading.Lock()
+
+@app.before_request
+def start_warm_up():
+    # Once per process, whatever server runs the app (forked WSGI workers each get their own)
+    global _warmed_up_pid
+    if _warmed_up_pid == os.getpid():
+        return
+    with _warm_up_lock:
+        if _warmed_up_pid == os.getpid():
+            return
+        _warmed_up_pid = os.getpid()
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
 # --- Routes ---
 
 @app.route('/')
 def index():
-    trending_searches = [
-        {"label": "Kyoto", "query": "Kyoto in Spring"},
-        {"label": "Iceland", "query": "Iceland Road Trip"},
-        {"label": "Amalfi", "query": "Amalfi Coast Luxury"},
-        {"label": "Tokyo", "query": "Tokyo Food Tour"},
-        {"label": "Paris", "query": "Paris Romantic Getaway"},
-        {"label": "Bali", "query": "Bali Wellness Retreat"},
-        {"label": "New York", "query": "NYC Art & Culture"},
-        {"label": "Patagonia", "query": "Patagonia Hiking Adventure"},
-        {"label": "Santorini", "query": "Santorini Sunset Views"},
-        {"label": "Cape Town", "query": "Cape Town Wine & Safari"},
-        {"label": "Swiss Alps", "query": "Swiss Alps Ski Trip"},
-        {"label": "Machu Picchu", "query": "Machu Picchu Trek"}
-    ]
     # Select 4 random trending searches
-    selected_trending = random.sample(trending_searches, 4)
+    selected_trending = random.sample(TRENDING_SEARCHES, 4)
     return render_template('index.html', trending=selected_trending)
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -425,78 +931,347 @@ def logout():
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    query = request.form.get('query')
-    origin = request.form.get('origin')
-    
-    problem = query
-    if origin:
-        problem = f"{query} (Starting from {origin})"
+    """Queues the analysis and answers right away.
+
+    Browsers get the results page, which follows the job's event stream; JSON clients
+    get 202 with the job id and a status URL to poll.
+    """
+    problem = build_problem(request.form.get('query'), request.form.get('origin'))
+    wants_json = request.accept_mimetypes.best == 'application/json'
+
+    previous = None
+    if app.config['SEARCH_SUGGESTIONS'] and current_user.is_authenticated and request.form.get('force') != '1':
+        previous = find_previous_search(problem)
+    if previous is not None:
+        results_url = url_for('show_results', search_id=previous.id)
+        if wants_json:
+            return jsonify({'status': 'suggested', 'search_id': previous.id, 'query': previous.search_query,
+                            'results_url': results_url, 'message': 'Post again with force=1 to run a new search.'})
+        suggestion = {'query': request.form.get('query'), 'origin': request.form.get('origin') or '',
+                      'timestamp': previous.timestamp}
+        return render_template('results.html', problem=previous.search_query,
+                               strategies=json.loads(previous.results), suggestion=suggestion)
     
     # 1. Generate Strategies (Mock or Real)
-    # Check if ANY key is available (User or System)
-    has_gemini = (current_user.is_authenticated and current_user.gemini_key) or os.getenv("GOOGLE_API_KEY")
-    has_openai = (current_user.is_authenticated and current_user.openai_key) or os.getenv("OPENAI_API_KEY")
-    has_anthropic = (current_user.is_authenticated and current_user.anthropic_key) or os.getenv("ANTHROPIC_API_KEY")
-    
-    use_mock = not (has_gemini or has_openai or has_anthropic)
-    
+    # Check if ANY key is available (User or System) for a configured provider
+    api_keys = resolve_api_keys()
+    use_mock = not any(api_keys.get(name) for name in providers.PROVIDER_ORDER)
     if use_mock:
         print("Using mock generation (no keys available).")
-        strategies = mock_generation()
-    else:
-        print("Attempting LLM generation...")
-        raw_strategies = generate_strategies_llm(problem)
-        strategies = []
-        for s in raw_strategies:
-            if not isinstance(s, dict):
-                continue
-            critique_data = critique_strategy_llm(s)
-            s['critique'] = critique_data.get('critique', 'No critique available.')
-            s['score'] = critique_data.get('score', 0)
-            strategies.append(s)
-        
-        if not strategies:
-            print("LLM generation failed or returned empty. Falling back to mock data.")
-            flash("AI generation failed. Showing example strategies instead.", "warning")
-            strategies = mock_generation()
-            
-    # Sort by score
-    strategies.sort(key=lambda x: x.get('score', 0), reverse=True)
-    
+
+    if not app.config['ANALYZE_QUEUE']:
+        tree_args = {name: request.form[name] for name in SEARCH_PARAM_NAMES if request.form.get(name)}
+        stream_url = url_for('analyze_stream', query=request.form.get('query'), origin=request.form.get('origin') or None,
+                             **tree_args)
+        return render_template('results.html', problem=problem, strategies=[], stream_url=stream_url)
+
+    # Mock searches cost no provider tokens, so only real ones are rate limited
+    retry_after = None if use_mock else rate_limited()
+    if retry_after is not None:
+        message = f"You're searching faster than we can keep up. Please try again in {retry_after:.0f} seconds."
+        if wants_json:
+            return jsonify({'status': 'error', 'message': message}), 429, {'Retry-After': str(int(retry_after) + 1)}
+        flash(message)
+        return redirect(url_for('index'))
+
+    search = None
+    results_url = None
     if current_user.is_authenticated:
-        new_search = SearchHistory(
-            search_query=problem, 
-            results=json.dumps(strategies),
-            user_id=current_user.id
-        )
-        db.session.add(new_search)
+        with tracing.span('db_write', kind='queued'):
+            search = SearchHistory(search_query=problem, user_id=current_user.id, status='queued', progress='Waiting for a worker...')
+            db.session.add(search)
+            db.session.commit()
+        results_url = url_for('show_results', search_id=search.id)
+
+    try:
+        job = job_queue.submit(job_owner(), run_analysis_job, problem, api_keys, use_mock,
+                               search_id=search.id if search else None, results_url=results_url,
+                               params=search_params(request.form))
+    except QueueFullError:
+        if search is not None:
+            db.session.delete(search)
+            db.session.commit()
+        message = 'You already have several searches in progress. Please wait for them to finish.'
+        if wants_json:
+            return jsonify({'status': 'error', 'message': message}), 429
+        flash(message)
+        return redirect(url_for('index'))
+
+    if search is not None:
+        search.job_id = job.id
         db.session.commit()
-        return redirect(url_for('show_results', search_id=new_search.id))
+
+    if wants_json:
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id), 'results_url': results_url}), 202
+    return render_template('results.html', problem=problem, strategies=[], stream_url=url_for('job_events', job_id=job.id))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """JSON status of a queued analysis."""
+    job = job_queue.get(job_id)
+    if job is None or job.owner != job_owner():
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    payload = job.as_dict()
+    if job.status == 'done':
+        payload.update(job.result)
+    return jsonify(payload)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-sent events for a queued analysis, replayed from the start of the job."""
+    job = job_queue.get(job_id)
+    if job is None or job.owner != job_owner():
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+
+    def events():
+        seen = 0
+        while True:
+            new_events = job.wait_for_events(seen, timeout=15)
+            if not new_events:
+                if job.finished:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            seen += len(new_events)
+            for kind, data in new_events:
+                yield sse_event(kind, data)
+
+    return sse_response(events())
+
+@app.route('/analyze/stream')
+def analyze_stream():
+    """Runs one search inside the request and streams it as server-sent events.
+
+    Used when the job queue is disabled. Emits 'strategy' as each strategy is parsed,
+    'critique' as each critique arrives, and 'done' with the final ranking (and the
+    saved results URL for logged-in users).
+    """
+    deadline = time.monotonic() + app.config['ANALYZE_DEADLINE_SECONDS']
+    problem = build_problem(request.args.get('query'), request.args.get('origin'))
+    api_keys = resolve_api_keys()
+    use_mock = not any(api_keys.get(name) for name in providers.PROVIDER_ORDER)
+    retry_after = None if use_mock else rate_limited()
+    search = search_params(request.args)
+
+    def events():
+        if retry_after is not None:
+            # A 429 would make EventSource reconnect, so the refusal goes down the stream
+            yield sse_event('failed', {'message': f"You're searching faster than we can keep up. "
+                                                  f"Please try again in {retry_after:.0f} seconds."})
+            return
+        yield sse_event('status', {'message': 'Exploring strategies...'})
+        for kind, data in iter_analysis_events(problem, api_keys, use_mock, deadline, search=search):
+            if kind != 'ranked':
+                yield sse_event(kind, data)
+                continue
+            done = {'order': data['order']}
+            tree = json.dumps(data['tree']) if data['tree'] is not None else None
+            if current_user.is_authenticated:
+                with tracing.span('db_write', kind='results'):
+                    new_search = SearchHistory(search_query=problem, results=json.dumps(data['strategies']),
+                                               search_tree=tree, user_id=current_user.id, status='done')
+                    db.session.add(new_search)
+                    db.session.commit()
+                done['results_url'] = url_for('show_results', search_id=new_search.id)
+            yield sse_event('done', done)
+
+    return sse_response(events())
+
+# Rendered results and strategy pages: (kind, row id) -> (etag, html). The rows don't change once
+# written, but SQLite hands the highest id out again after a delete, so save_strategy and
+# delete_strategy drop the entry for their id. The ETag check below covers other processes.
+page_cache = TTLCache(app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL_SECONDS'])
+
+def template_version(*names):
+    digest = hashlib.sha256()
+    for name in names:
+        with open(os.path.join(app.root_path, app.template_folder, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+# Part of every page ETag, so browsers don't get 304s for markup a deploy has changed
+PAGE_TEMPLATE_VERSION = template_version('results.html', 'strategy_details.html')
+
+def cached_page(kind, row_id, version, render):
+    """Serves the page `render()` builds with a strong ETag, from page_cache when it can.
+
+    `version` must change whenever the page would. A browser that already has this
+    version gets a 304 before the row's blob is loaded or anything is rendered.
+    """
+    etag = hashlib.sha256(f"{kind}:{row_id}:{version!r}:{PAGE_TEMPLATE_VERSION}".encode()).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        outcome = 'not_modified'
+        response = Response(status=304)
     else:
-        # Fallback for anonymous users: render directly
-        return render_template('results.html', problem=problem, strategies=strategies)
+        cached = page_cache.get((kind, row_id))
+        if cached is not None and cached[0] == etag:
+            outcome, html = 'hit', cached[1]
+        else:
+            outcome, html = 'miss', render()
+            if page_cache.maxsize:
+                page_cache.set((kind, row_id), (etag, html))
+        response = Response(html, mimetype='text/html')
+    tracing.count('wanderly_page_cache_total', page=kind, outcome=outcome)
+    response.set_etag(etag)
+    # Only for the signed-in owner; the browser may keep it but must revalidate before each use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/results/<int:search_id>')
 @login_required
 def show_results(search_id):
-    search = SearchHistory.query.get_or_404(search_id)
-    if search.author != current_user:
+    # The results blob is only read if the page has to be rendered
+    search, has_results = (
+        db.session.query(SearchHistory, SearchHistory.results.isnot(None))
+        .options(defer(SearchHistory.results), defer(SearchHistory.search_tree))
+        .filter(SearchHistory.id == search_id)
+        .first_or_404()
+    )
+    if search.user_id != current_user.id:
         return redirect(url_for('index'))
+    
+    # Still being worked on: follow the job's progress instead
+    job = job_queue.get(search.job_id) if search.job_id else None
+    if search.status in ('queued', 'running') and job is not None:
+        return render_template('results.html', problem=search.search_query, strategies=[],
+                               stream_url=url_for('job_events', job_id=job.id))
         
-    strategies = json.loads(search.results) if search.results else []
-    return render_template('results.html', problem=search.search_query, strategies=strategies)
+    def render():
+        strategies = json.loads(search.results) if search.results else []
+        return render_template('results.html', problem=search.search_query, strategies=strategies)
+    # compact_db.py may clear the results later; the timestamp tells apart a reused id
+    return cached_page('results', search.id, (search.timestamp, search.status, has_results), render)
+
+@app.route('/results/<int:search_id>/tree')
+@login_required
+def search_tree(search_id):
+    """The tree search behind a result: every node with its parent, score and state, plus the budget spent."""
+    search = SearchHistory.query.get_or_404(search_id)
+    if search.author != current_user:
+        return jsonify({'status': 'error', 'message': 'Unknown search'}), 404
+    if not search.search_tree:
+        return jsonify({'status': 'error', 'message': 'This search has no stored tree'}), 404
+    return Response(search.search_tree, mimetype='application/json')
+
+def find_previous_search(problem):
+    """Returns the current user's finished search that best matches `problem`, or None."""
+    search_id = search_index.find_similar_search(
+        db.session.connection(), current_user.id, problem,
+        min_overlap=app.config['SEARCH_SUGGESTION_MIN_OVERLAP'],
+    )
+    # Rewordings ("cheap Japan food trip") share few whole words; fall back to the shingle index
+    if search_id is None:
+        ensure_query_index()
+    candidates = [search_id] if search_id is not None else [
+        similar_id for similar_id, _ in query_index.lookup(
+            problem, k=5, user_id=current_user.id, min_similarity=app.config['SIMILAR_SEARCH_THRESHOLD'])
+    ]
+    if not candidates:
+        return None
+    # The index keeps ids of deleted searches and of searches still running; check them here
+    found = {search.id: search for search in SearchHistory.query.filter(
+        SearchHistory.id.in_(candidates),
+        SearchHistory.user_id == current_user.id,
+        SearchHistory.results.isnot(None),
+        SearchHistory.status.is_(None) | (SearchHistory.status == 'done'),
+    )}
+    return next((found[candidate] for candidate in candidates if candidate in found), None)
+
+@app.route('/search_history')
+@login_required
+def search_history():
+    """Full-text search over the user's past searches and saved strategies, best match first."""
+    query = request.args.get('q', '')
+    kind = request.args.get('kind')
+    if kind not in (None, search_index.KIND_SEARCH, search_index.KIND_STRATEGY):
+        return jsonify({'status': 'error', 'message': 'kind must be search or strategy'}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = min(max(request.args.get('page_size', 20, type=int), 1), 50)
+
+    start = time.perf_counter()
+    hits = search_index.search(db.session.connection(), current_user.id, query, kind=kind,
+                               limit=page_size + 1, offset=(page - 1) * page_size)
+    took_ms = (time.perf_counter() - start) * 1000
+    for hit in hits:
+        if hit['kind'] == search_index.KIND_SEARCH:
+            hit['url'] = url_for('show_results', search_id=hit['id'])
+        else:
+            hit['url'] = url_for('strategy_details', id=hit['id'])
+    return jsonify({
+        'query': query,
+        'page': page,
+        'hits': hits[:page_size],
+        'has_more': len(hits) > page_size,
+        'took_ms': round(took_ms, 2),
+    })
+
+def keyset_page(query, columns, cursor, page_size):
+    """Returns one page of `query` ordered by `columns` descending, plus the cursor of the next page.
+
+    `cursor` holds the column values of the last row of the previous page (or None
+    for the first page), so each page is an index range scan rather than an OFFSET.
+    """
+    if cursor is not None:
+        query = query.filter(tuple_(*columns) < tuple_(*cursor))
+    rows = query.order_by(*(column.desc() for column in columns)).limit(page_size + 1).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = tuple(getattr(rows[-1], column.key) for column in columns)
+    return rows, next_cursor
+
+def encode_cursor(values):
+    return ','.join(value.isoformat() if isinstance(value, datetime) else str(value) for value in values) if values else None
+
+def parse_history_cursor(value):
+    """Parses a 'timestamp,id' history cursor; returns None if absent or malformed."""
+    try:
+        timestamp, row_id = value.rsplit(',', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+def parse_id_cursor(value):
+    try:
+        return (int(value),)
+    except (TypeError, ValueError):
+        return None
 
 @app.route('/profile')
 @login_required
 def profile():
-    history = SearchHistory.query.filter_by(user_id=current_user.id).order_by(SearchHistory.timestamp.desc()).limit(10).all()
-    saved_raw = SavedStrategy.query.filter_by(user_id=current_user.id).all()
-    trips = Trip.query.filter_by(user_id=current_user.id).order_by(Trip.start_date.asc()).all()
-    
-    trips = Trip.query.filter_by(user_id=current_user.id).order_by(Trip.start_date.asc()).all()
-    
-    trips = Trip.query.filter_by(user_id=current_user.id).order_by(Trip.start_date.asc()).all()
-    return render_template('profile.html', trips=trips, saved_strategies=saved_raw, search_history=history)
+    # One query per section, loading only the columns the template renders
+    history, next_history = keyset_page(
+        SearchHistory.query
+            .filter_by(user_id=current_user.id)
+            .options(load_only(SearchHistory.id, SearchHistory.search_query, SearchHistory.timestamp, SearchHistory.status)),
+        (SearchHistory.timestamp, SearchHistory.id),
+        parse_history_cursor(request.args.get('history_before')),
+        app.config['PROFILE_HISTORY_PAGE_SIZE'],
+    )
+    saved, next_saved = keyset_page(
+        SavedStrategy.query
+            .filter_by(user_id=current_user.id)
+            .options(load_only(SavedStrategy.id, SavedStrategy.title, SavedStrategy.score, SavedStrategy.summary)),
+        (SavedStrategy.id,),
+        parse_id_cursor(request.args.get('saved_before')),
+        app.config['PROFILE_SAVED_PAGE_SIZE'],
+    )
+    trips = (
+        Trip.query
+        .filter_by(user_id=current_user.id)
+        .options(joinedload(Trip.strategy).load_only(SavedStrategy.id, SavedStrategy.title))
+        .order_by(Trip.start_date.asc())
+        .all()
+    )
+    return render_template(
+        'profile.html',
+        trips=trips,
+        saved_strategies=saved,
+        search_history=history,
+        next_history=encode_cursor(next_history),
+        next_saved=encode_cursor(next_saved),
+    )
 
 @app.route('/save_strategy', methods=['POST'])
 @login_required
@@ -509,32 +1284,222 @@ def save_strategy():
         "locations": data.get('locations')
     }
     
+    # Prefer the critic's own verdict over whatever the page posted back
+    critique_data = critique_cache.get(strategy_fingerprint(data)) or data
+    
     new_strategy = SavedStrategy(
         title=data['title'],
         content=json.dumps(strategy_content),
-        critique=data['critique'],
-        score=data['score'],
+        critique=critique_data['critique'],
+        score=critique_data['score'],
         user_id=current_user.id
     )
+    new_strategy.set_details(strategy_content)
     db.session.add(new_strategy)
     db.session.commit()
+    page_cache.pop(('strategy', new_strategy.id))
     return jsonify({'status': 'success'})
 
 @app.route('/strategy/<int:id>')
 @login_required
 def strategy_details(id):
-    strategy = SavedStrategy.query.get_or_404(id)
-    if strategy.author != current_user:
+    strategy = SavedStrategy.query.options(defer(SavedStrategy.content)).get_or_404(id)
+    if strategy.user_id != current_user.id:
         return redirect(url_for('profile'))
     
-    parsed_content = json.loads(strategy.content)
-    
-    # Extract location for image
-    image_keyword = "travel"
-    if parsed_content.get('locations') and len(parsed_content['locations']) > 0:
-        image_keyword = parsed_content['locations'][0]['name']
+    if not strategy.is_normalized:
+        # Saved before the strategy tables existed and not backfilled yet
+        strategy.normalize_from_content()
+        db.session.commit()
     
-    return render_template('strategy_details.html', strategy=strategy, details=parsed_content, image_keyword=image_keyword)
+    def render():
+        # Days with their activities, locations and costs in one query each rather than one per day
+        loaded = SavedStrategy.query.options(
+            defer(SavedStrategy.content),
+            selectinload(SavedStrategy.days).selectinload(StrategyDay.activities),
+            selectinload(SavedStrategy.locations),
+            selectinload(SavedStrategy.costs),
+        ).populate_existing().get(strategy.id)
+        # Extract location for image
+        image_keyword = loaded.primary_location or "travel"
+        return render_template('strategy_details.html', strategy=loaded, details=loaded.details(), image_keyword=image_keyword)
+    # The child rows are written with these columns and never change after
+    version = (strategy.title, strategy.score, strategy.critique, strategy.summary, strategy.total_cost,
+               strategy.currency, strategy.num_days, strategy.primary_location)
+    return cached_page('strategy', strategy.id, version, render)
+
+def location_points(boxes=None):
+    """(location id, strategy id, lat, lon) of the current user's geocoded locations as an (N, 4) array.
+
+    With `boxes`, only the points inside them, read with one index range scan per run of geohash cells.
+    """
+    query = (
+        db.session.query(StrategyLocation.id, StrategyLocation.strategy_id, StrategyLocation.lat, StrategyLocation.lon)
+        .filter(StrategyLocation.user_id == current_user.id)
+    )
+    if boxes is None:
+        query = query.filter(StrategyLocation.geohash.isnot(None))
+    else:
+        # OR-ed ranges would make SQLite scan from the first one onwards; a UNION keeps each range seek separate
+        ranges = [query.filter(StrategyLocation.geohash.between(low, high))
+                  for low, high in geo.cell_ranges(geo.covering_cells(boxes))]
+        query = ranges[0].union_all(*ranges[1:])
+    # Plain tuples: NumPy probes Row objects for array attributes, which costs more than the query
+    points = np.array([tuple(row) for row in query.all()], dtype=float).reshape(-1, 4)
+    if boxes is not None:
+        # The geohash cells overhang the boxes; trim to the exact area
+        points = points[geo.in_box(points[:, 2], points[:, 3], boxes)]
+    return points
+
+def location_names(location_ids):
+    if not len(location_ids):
+        return {}
+    return dict(db.session.query(StrategyLocation.id, StrategyLocation.name)
+                .filter(StrategyLocation.id.in_([int(i) for i in location_ids])))
+
+def strategy_titles(strategy_ids):
+    if not len(strategy_ids):
+        return {}
+    return dict(db.session.query(SavedStrategy.id, SavedStrategy.title)
+                .filter(SavedStrategy.id.in_([int(i) for i in strategy_ids])))
+
+def parse_bbox(value):
+    """'south,west,north,east' -> list of boxes, or None if malformed."""
+    try:
+        south, west, north, east = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if not (-90 <= south <= north <= 90) or west > east:
+        return None
+    if east - west >= 360:
+        return [(south, -180.0, north, 180.0)]
+    # Web maps report longitudes past ±180 once the world wraps around
+    shifted_west = (west + 180) % 360 - 180
+    return geo.split_box(south, shifted_west, north, shifted_west + east - west)
+
+@app.route('/nearby')
+@login_required
+def nearby():
+    """Saved strategies with a location within `radius_km` of lat/lon, or inside `bbox`, closest first."""
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    lat, lon = request.args.get('lat', type=float), request.args.get('lon', type=float)
+    if request.args.get('bbox'):
+        boxes = parse_bbox(request.args['bbox'])
+        if boxes is None:
+            return jsonify({'status': 'error', 'message': 'bbox must be south,west,north,east'}), 400
+        radius = None
+    elif geo.is_valid(lat, lon):
+        radius = min(max(request.args.get('radius_km', 50.0, type=float), 0.0), 5000.0)
+        boxes = geo.radius_boxes(lat, lon, radius)
+    else:
+        return jsonify({'status': 'error', 'message': 'Pass lat and lon (with optional radius_km), or bbox'}), 400
+
+    start = time.perf_counter()
+    points = location_points(boxes)
+    if radius is not None:
+        distances = geo.haversine_km(lat, lon, points[:, 2], points[:, 3])
+        keep = distances <= radius
+        points, distances = points[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+    else:
+        distances = None
+        order = np.argsort(points[:, 1], kind='stable')
+    points = points[order]
+    distances = None if distances is None else distances[order]
+
+    # A strategy ranks by its closest location; its first row after sorting is that one
+    strategy_ids, first = np.unique(points[:, 1], return_index=True)
+    page = points[np.sort(first)[:limit], 1]
+    rows = np.flatnonzero(np.isin(points[:, 1], page))
+    names = location_names(points[rows, 0])
+    titles = strategy_titles(page)
+    strategies = {int(strategy_id): {
+        'id': int(strategy_id),
+        'title': titles.get(int(strategy_id)),
+        'url': url_for('strategy_details', id=int(strategy_id)),
+        'distance_km': None,
+        'locations': [],
+    } for strategy_id in page}
+    for row in rows:
+        distance = None if distances is None else round(float(distances[row]), 1)
+        entry = strategies[int(points[row, 1])]
+        if entry['distance_km'] is None:
+            entry['distance_km'] = distance
+        entry['locations'].append({'name': names.get(int(points[row, 0])), 'lat': float(points[row, 2]),
+                                   'lon': float(points[row, 3]), 'distance_km': distance})
+    return jsonify({
+        'strategies': list(strategies.values()),
+        'total': len(strategy_ids),
+        'took_ms': round((time.perf_counter() - start) * 1000, 2),
+    })
+
+@app.route('/api/strategy_map')
+@login_required
+def strategy_map():
+    """Clustered markers of the user's saved locations for a map at `zoom`, optionally limited to `bbox`.
+
+    Points are grouped by the geohash prefix sized for `zoom`, in SQL over the covering
+    index, and each cluster sits at the centroid of its points.
+    """
+    zoom = min(max(request.args.get('zoom', 2, type=int), 0), 18)
+    boxes = parse_bbox(request.args['bbox']) if request.args.get('bbox') else None
+    located = (
+        db.session.query(StrategyLocation.id.label('id'), StrategyLocation.geohash.label('geohash'),
+                         StrategyLocation.lat.label('lat'), StrategyLocation.lon.label('lon'))
+        .filter(StrategyLocation.user_id == current_user.id, StrategyLocation.geohash.isnot(None))
+    )
+    if boxes is not None:
+        # Cells overhanging the viewport are fine here; their markers just sit near the edge
+        ranges = [located.filter(StrategyLocation.geohash.between(low, high))
+                  for low, high in geo.cell_ranges(geo.covering_cells(boxes))]
+        located = ranges[0].union_all(*ranges[1:])
+    located = located.subquery()
+    cell = func.substr(located.c.geohash, 1, geo.precision_for_zoom(zoom))
+    clusters = (
+        db.session.query(func.count(), func.avg(located.c.lat), func.avg(located.c.lon), func.min(located.c.id))
+        .group_by(cell)
+        .all()
+    )
+    singles = [location_id for count, _, _, location_id in clusters if count == 1]
+    details = {}
+    if singles:
+        details = {row.id: row for row in db.session.query(
+            StrategyLocation.id, StrategyLocation.name, StrategyLocation.strategy_id, SavedStrategy.title,
+        ).join(SavedStrategy, SavedStrategy.id == StrategyLocation.strategy_id).filter(StrategyLocation.id.in_(singles))}
+    markers = []
+    for count, lat, lon, location_id in clusters:
+        marker = {'lat': round(lat, 5), 'lon': round(lon, 5), 'count': count}
+        if count == 1 and location_id in details:
+            row = details[location_id]
+            marker.update(name=row.name, title=row.title, url=url_for('strategy_details', id=row.strategy_id))
+        markers.append(marker)
+    return jsonify({'zoom': zoom, 'points': sum(marker['count'] for marker in markers), 'clusters': markers})
+
+@app.route('/analytics')
+@login_required
+def analytics():
+    """Spend by cost category, average totals per destination and unrealistic budgets, over past search results.
+
+    Covers the current user's searches, or everyone's with `scope=all`, in one
+    `currency` (the most common one by default). Outliers are only listed for the
+    current user's own searches.
+    """
+    start = time.perf_counter()
+    added = refresh_cost_store()
+    everyone = request.args.get('scope') == 'all'
+    summary = cost_store.summary(
+        user_id=None if everyone else current_user.id,
+        currency=request.args.get('currency') or None,
+        destinations=min(max(request.args.get('destinations', 10, type=int), 1), 100),
+        # Destinations only a handful of strategies went to would say more about one user than about prices
+        min_count=5 if everyone else 1,
+        outlier_z=min(max(request.args.get('z', 3.5, type=float), 1.0), 10.0),
+        outliers=min(max(request.args.get('outliers', 20, type=int), 0), 100),
+        outliers_user_id=current_user.id,
+    )
+    summary.update(scope='all' if everyone else 'user', ingested=added,
+                   took_ms=round((time.perf_counter() - start) * 1000, 2))
+    return jsonify(summary)
 
 @app.route('/delete_strategy/<int:id>', methods=['POST'])
 @login_required
@@ -552,6 +1517,7 @@ def delete_strategy(id):
     
     db.session.delete(strategy)
     db.session.commit()
+    page_cache.pop(('strategy', id))
     flash('Strategy deleted successfully.')
     return redirect(url_for('profile'))
 
@@ -573,15 +1539,9 @@ def add_trip():
             destination = strategy.title
         
         if not end_date:
-            # Try to calculate duration from itinerary
-            try:
-                content = json.loads(strategy.content)
-                days = len(content.get('itinerary', []))
-                # Default to 7 days if itinerary is empty or parsing fails, otherwise use itinerary length
-                duration = days if days > 0 else 7
-                end_date = start_date + timedelta(days=duration)
-            except:
-                end_date = start_date + timedelta(days=7) # Fallback
+            # Use the itinerary length, defaulting to 7 days if it is empty or unknown
+            duration = strategy.num_days or 7
+            end_date = start_date + timedelta(days=duration)
 
         # Check if a trip for this strategy already exists for this user
         existing_trip = Trip.query.filter_by(user_id=current_user.id, strategy_id=strategy_id).first()
@@ -622,68 +1582,98 @@ def delete_trip(id):
     flash('Trip cancelled successfully.')
     return redirect(url_for('profile'))
 
+@app.route('/api/provider_stats')
+@login_required
+def provider_stats():
+    """Per-provider attempt, win and latency counters, used to tune HEDGE_DELAY_SECONDS."""
+    return jsonify({
+        'generation_mode': app.config['GENERATION_MODE'],
+        'hedge_delay_seconds': app.config['HEDGE_DELAY_SECONDS'],
+        'providers': providers.stats_snapshot(),
+    })
+
+@app.route('/api/limits')
+@operator_required
+def limit_stats():
+    """Circuit breaker states, per-key token budgets, reported token usage and /analyze throttling."""
+    return jsonify(limits.snapshot())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: stage latency histograms plus LLM call and token counters."""
+    token = app.config['METRICS_TOKEN']
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode()):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain', headers={'WWW-Authenticate': 'Bearer'})
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return Response('Set METRICS_TOKEN to scrape from another host\n', status=403, mimetype='text/plain')
+    return Response(tracing.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/traces')
+@operator_required
+def recent_traces():
+    """The most recent finished traces with their span trees, newest first."""
+    return jsonify(tracing.recent_traces(min(request.args.get('limit', 20, type=int), 100)))
+
+@app.route('/api/cache_stats')
+@login_required
+def cache_stats():
+    return jsonify({'strategies': strategy_cache.stats(), 'critiques': critique_cache.stats(), 'pages': page_cache.stats()})
+
 @app.route('/settings')
 @login_required
 def settings():
     print("Accessing settings page...")
     return render_template('settings.html')
 
+def key_check_response(result):
+    """A providers.check_key() result in the shape the settings page reads."""
+    status = {True: 'success', False: 'error', None: 'unverified'}[result['ok']]
+    return {'status': status, 'message': result['message'], 'cached': result['cached']}
+
 @app.route('/update_api_keys', methods=['POST'])
 @login_required
 def update_api_keys():
-    current_user.openai_key = encrypt_value(request.form.get('openai_key'))
-    current_user.anthropic_key = encrypt_value(request.form.get('anthropic_key'))
-    current_user.gemini_key = encrypt_value(request.form.get('gemini_key'))
+    # The form is pre-filled with the stored ciphertexts; an untouched field must not be encrypted twice
+    keys = {name: decrypt_value(request.form.get(column)) for name, column in USER_KEY_COLUMNS}
+    for name, column in USER_KEY_COLUMNS:
+        setattr(current_user, column, encrypt_value(keys[name]))
     db.session.commit()
+    api_key_cache.pop(current_user.id)
     flash('API Keys updated successfully.')
+    # Checked together, so saving three keys takes as long as the slowest provider
+    for name, result in providers.check_keys(keys).items():
+        if result['ok'] is False:
+            flash(f"{providers.PROVIDERS[name].display_name} rejected the key ({result['message']}). "
+                  "Searches will skip it until it is replaced.")
+        elif result['ok'] is None:
+            flash(f"{result['message']}. The key was saved unchecked.")
     return redirect(url_for('settings'))
 
 @app.route('/verify_api_key', methods=['POST'])
 @login_required
 def verify_api_key():
-    data = request.json
-    provider = data.get('provider')
-    # The key coming from the frontend might be the raw input (if testing before saving)
-    # or it might be the saved encrypted key if we were to implement a "Test Saved Key" feature.
-    # For now, this route is likely used by a "Test" button next to the input field, sending the raw input.
-    # However, if we want to be safe, we can check.
-    key = data.get('key')
-    
-    if not key:
-        return jsonify({'status': 'error', 'message': 'No key provided'})
+    """Checks one key ({provider, key}) or several at once ({keys: {provider: key}}) with the provider.
 
-    try:
-        if provider == 'gemini':
-            genai.configure(api_key=key)
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            # Simple generation test
-            model.generate_content("Hello", generation_config={"max_output_tokens": 5})
-            return jsonify({'status': 'success'})
-            
-        elif provider == 'openai':
-            client = OpenAI(api_key=key)
-            client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": "Hello"}],
-                max_tokens=5
-            )
-            return jsonify({'status': 'success'})
-            
-        elif provider == 'anthropic':
-            client = Anthropic(api_key=key)
-            client.messages.create(
-                model="claude-3-haiku-20240307",
-                max_tokens=5,
-                messages=[{"role": "user", "content": "Hello"}]
-            )
-            return jsonify({'status': 'success'})
-            
+    The key may be the raw input or the stored ciphertext the settings form is
+    pre-filled with. An explicit check always asks the provider again.
+    """
+    data = request.json or {}
+    submitted = data.get('keys') if isinstance(data.get('keys'), dict) else {data.get('provider'): data.get('key')}
+    allowed = {name for name, _ in USER_KEY_COLUMNS}
+    if not any(submitted.values()):
+        return jsonify({'status': 'error', 'message': 'No key provided'})
+    if not set(submitted) <= allowed:
         return jsonify({'status': 'error', 'message': 'Invalid provider'})
-        
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+
+    keys = {name: decrypt_value(key) for name, key in submitted.items() if key}
+    results = {name: key_check_response(result) for name, result in providers.check_keys(keys, force=True).items()}
+    if 'keys' in data:
+        return jsonify({'status': 'success', 'results': results})
+    return jsonify(next(iter(results.values())))
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        upgrade_schema(db)
+        backfill_saved_strategies(db, SavedStrategy)
     app.run(debug=True, port=5001)
@@ -0,0 +1,134 @@
+"""/analytics aggregates over a large set of past search results.
+
+Generates --strategies strategies (five per search, spread over --users users) with
+cost strings in the formats LLMs produce ("$2,600", "1.2k", "800-1000 EUR") and a
+few absurd budgets, then times:
+  * parsing: ingesting every search into the columnar store, and reloading its snapshot
+  * the per-request alternative: json.loads and parse every result, aggregate in Python
+  * summaries: one user's and everyone's, median of --runs, and a repeated one
+  * an incremental refresh: one new search appended to the full store
+
+Usage: python benchmarks/bench_cost_analytics.py [--strategies 1000000] [--users 1000] [--runs 20]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cost_analytics import CostStore, strategy_row
+
+STRATEGIES_PER_SEARCH = 5
+DESTINATIONS = ['Kyoto, Japan', 'Tokyo', 'Paris, France', 'Rome', 'Lisbon', 'Reykjavik', 'Bangkok', 'Bali', 'Cusco',
+                'Mexico City', 'Marrakech', 'New York', 'Sydney', 'Cape Town', 'Buenos Aires', 'Athens']
+CURRENCIES = [('USD', '${:,.0f}'), ('USD', '{:.0f} USD'), ('EUR', '{:.0f} EUR'), ('EUR', '€{:,.0f}'), ('GBP', '£{:,.0f}')]
+
+
+def make_search(rng):
+    strategies = []
+    for _ in range(STRATEGIES_PER_SEARCH):
+        currency, form = rng.choice(CURRENCIES)
+        days = rng.randint(3, 14)
+        per_day = rng.lognormvariate(5.3, 0.4)
+        # One budget in a thousand is off by orders of magnitude
+        if rng.random() < 0.001:
+            per_day *= rng.choice([0.01, 100])
+        parts = {'flights': per_day * days * 0.35, 'lodging': per_day * days * 0.3, 'food': per_day * days * 0.15,
+                 'transport': per_day * days * 0.1, 'activities': per_day * days * 0.1}
+        costs = {category: form.format(amount) for category, amount in parts.items()}
+        costs['food'] = f"{parts['food'] / 1000:.1f}k" if rng.random() < 0.3 else costs['food']
+        costs['lodging'] = f"{parts['lodging']:.0f}-{parts['lodging'] * 1.3:.0f}" if rng.random() < 0.2 else costs['lodging']
+        costs['total'] = form.format(sum(parts.values()))
+        costs['currency'] = currency
+        strategies.append({
+            'title': 'Strategy', 'cost_breakdown': costs, 'score': rng.randint(4, 9),
+            'itinerary': [{'day': day} for day in range(1, days + 1)],
+            'locations': [{'name': rng.choice(DESTINATIONS)}],
+        })
+    return json.dumps(strategies)
+
+
+def python_summary(results, user_ids, user_id):
+    """What /analytics would cost without the store: parse every stored result on each request."""
+    totals = {}
+    for results_json, owner in zip(results, user_ids):
+        if owner != user_id:
+            continue
+        for strategy in json.loads(results_json):
+            row = strategy_row(strategy)
+            if row is not None and row['currency'] == 'USD':
+                totals.setdefault(row['destination'], []).append(row['costs'][-1])
+    return {name: sum(values) / len(values) for name, values in totals.items()}
+
+
+def median_ms(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--strategies', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    searches = args.strategies // STRATEGIES_PER_SEARCH
+    print(f"Generating {searches:,} searches...")
+    templates = [make_search(rng) for _ in range(min(searches, 20000))]
+    results = [templates[i % len(templates)] for i in range(searches)]
+    user_ids = [rng.randrange(args.users) for _ in range(searches)]
+
+    path = os.path.join(tempfile.mkdtemp(prefix='wanderly-bench-'), 'cost_analytics')
+    store = CostStore(path, save_every=args.strategies + 1)
+    start = time.perf_counter()
+    added = store.ingest((i + 1, user_ids[i], 'done', results[i]) for i in range(searches))
+    seconds = time.perf_counter() - start
+    print(f"Ingested {added:,} strategies in {seconds:.1f} s ({added / seconds:,.0f}/s)")
+    start = time.perf_counter()
+    store.save()
+    saved = time.perf_counter() - start
+    start = time.perf_counter()
+    reloaded = len(CostStore(path))
+    print(f"Snapshot: {os.path.getsize(store.snapshot_path) / 2**20:.1f} MB, saved in {saved * 1000:.0f} ms, "
+          f"reloaded {reloaded:,} rows in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    user = user_ids[0]
+    python_ms = median_ms(lambda: python_summary(results, user_ids, user), 3)
+    print(f"Per-request parsing, one user's destination averages: {python_ms:,.0f} ms")
+
+    def fresh_summary(**kwargs):
+        # Summaries are memoized until new rows arrive; time the computation itself
+        store._summaries.clear()
+        return store.summary(**kwargs)
+    user_ms = median_ms(lambda: fresh_summary(user_id=user, outliers_user_id=user), args.runs)
+    all_ms = median_ms(lambda: fresh_summary(outliers_user_id=user), args.runs)
+    memo_ms = median_ms(lambda: store.summary(outliers_user_id=user), args.runs)
+    summary = store.summary(outliers_user_id=None)
+    print(f"Store summary, one user: {user_ms:.1f} ms ({python_ms / user_ms:,.0f}x faster); "
+          f"everyone ({summary['strategies']:,} {summary['currency']} strategies): {all_ms:.1f} ms, "
+          f"{memo_ms:.3f} ms when repeated")
+    print(f"Outliers flagged: {summary['outliers']['count']:,}; "
+          f"median total {summary['categories']['total']['p50']:,.0f} {summary['currency']}")
+
+    extra = make_search(rng)
+    next_id = searches + 1
+    def append_one():
+        nonlocal next_id
+        store.ingest([(next_id, user, 'done', extra)])
+        next_id += 1
+    print(f"Incremental refresh, one new search: {median_ms(append_one, args.runs):.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
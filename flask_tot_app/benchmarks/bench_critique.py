@@ -0,0 +1,76 @@
+"""Compares the sequential, parallel and batch critique stages against the offline fake provider.
+
+Reports wall time per critique stage plus the provider calls and estimated tokens it
+cost. The critique cache is cleared before every run so each run pays full price.
+
+Usage: python benchmarks/bench_critique.py [--strategies 3] [--latency 0.8] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ['LLM_PROVIDERS'] = 'fake'
+
+import app as wanderly
+import providers
+
+API_KEYS = {'fake': 'bench-key'}
+
+
+class CountingFakeProvider(providers.FakeProvider):
+    """Fake provider that tallies calls and token estimates across all instances."""
+    totals = {'calls': 0, 'input_tokens': 0, 'output_tokens': 0}
+
+    def generate(self, prompt, system=None, max_tokens=None, temperature=None):
+        completion = super().generate(prompt, system=system, max_tokens=max_tokens, temperature=temperature)
+        totals = CountingFakeProvider.totals
+        totals['calls'] += 1
+        totals['input_tokens'] += completion.input_tokens + len(system or '') // 4
+        totals['output_tokens'] += completion.output_tokens
+        return completion
+
+
+def run(mode, strategies, runs, deadline_seconds):
+    timings = []
+    CountingFakeProvider.totals.update(calls=0, input_tokens=0, output_tokens=0)
+    for _ in range(runs):
+        wanderly.critique_cache.clear()
+        start = time.perf_counter()
+        deadline = time.monotonic() + deadline_seconds
+        wanderly.critique_strategies([dict(s) for s in strategies], API_KEYS, deadline=deadline, mode=mode)
+        timings.append(time.perf_counter() - start)
+    per_run = {k: v // runs for k, v in CountingFakeProvider.totals.items()}
+    return timings, per_run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--strategies', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.8, help='fixed round trip per provider call in seconds')
+    parser.add_argument('--ms-per-token', type=float, default=5.0, help='simulated decode time per output token')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--deadline', type=float, default=30.0)
+    args = parser.parse_args()
+
+    os.environ['FAKE_LLM_LATENCY'] = str(args.latency)
+    os.environ['FAKE_LLM_MS_PER_OUTPUT_TOKEN'] = str(args.ms_per_token)
+    providers.PROVIDERS['fake'] = CountingFakeProvider
+    strategies = (wanderly.mock_generation() * args.strategies)[:args.strategies]
+    # Make the copies distinct so the batch prompt really carries N strategies
+    for i, strategy in enumerate(strategies):
+        strategy['title'] = f"{strategy['title']} #{i}"
+
+    for mode in ('sequential', 'parallel', 'batch'):
+        timings, cost = run(mode, strategies, args.runs, args.deadline)
+        print(
+            f"{mode:>10}: p50 {statistics.median(timings):.3f}s  max {max(timings):.3f}s  "
+            f"calls {cost['calls']}  tokens in {cost['input_tokens']} / out {cost['output_tokens']}  "
+            f"(per run, {args.runs} runs)"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""/nearby and the profile map over a large set of saved strategy locations.
+
+Seeds a throwaway SQLite database with one user owning --points locations spread
+around real cities, then times:
+  * haversine over every point: Python loop vs the vectorized NumPy version
+  * radius lookups: full scan + haversine vs the /nearby geohash prefix scans
+  * /api/strategy_map clustering, for the whole world and for a city viewport
+
+Usage: python benchmarks/bench_geo.py [--points 1000000] [--lookups 200]
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+DB_DIR = tempfile.mkdtemp(prefix='wanderly-bench-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+import numpy as np
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+import app as wanderly
+import geo
+from cost_analytics import CostStore
+
+# The first request warms up the /analytics store, so keep it out of instance/
+wanderly.cost_store = CostStore(os.path.join(DB_DIR, 'cost_analytics'))
+
+CITIES = [(35.68, 139.65), (35.01, 135.77), (48.86, 2.35), (41.90, 12.50), (40.71, -74.01), (-33.87, 151.21),
+          (-22.91, -43.17), (51.51, -0.13), (19.43, -99.13), (-13.53, -71.97), (64.15, -21.94), (13.76, 100.50),
+          (-8.65, 115.22), (31.63, -8.01), (38.72, -9.14), (37.98, 23.73), (1.35, 103.82), (-34.60, -58.38)]
+LOCATIONS_PER_STRATEGY = 4
+
+
+def seed(points, batch=20000):
+    db = wanderly.db
+    db.create_all()
+    user = wanderly.User(username='bench', email='bench@example.com', password=generate_password_hash('bench'))
+    db.session.add(user)
+    db.session.commit()
+    rng = random.Random(3)
+    strategies = points // LOCATIONS_PER_STRATEGY
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO saved_strategy (id, title, content, critique, score, user_id)"
+            " VALUES (:id, :title, :content, '', 7, :user_id)"
+        ), [{'id': i + 1, 'title': f"Strategy {i + 1}", 'content': b'\x00{}', 'user_id': user.id}
+            for i in range(strategies)])
+        rows = []
+        for i in range(strategies * LOCATIONS_PER_STRATEGY):
+            lat, lon = rng.choice(CITIES)
+            # Most points cluster near a city, some are scattered anywhere
+            if rng.random() < 0.8:
+                lat, lon = lat + rng.gauss(0, 1.5), lon + rng.gauss(0, 1.5)
+            else:
+                lat, lon = rng.uniform(-60, 70), rng.uniform(-180, 180)
+            lat, lon = max(min(lat, 89.9), -89.9), (lon + 180) % 360 - 180
+            rows.append({'strategy_id': i // LOCATIONS_PER_STRATEGY + 1, 'user_id': user.id,
+                         'position': i % LOCATIONS_PER_STRATEGY, 'name': f"Place {i}", 'lat': lat, 'lon': lon, 'geohash': geo.encode(lat, lon)})
+            if len(rows) == batch:
+                conn.execute(text(
+                    "INSERT INTO strategy_location (strategy_id, user_id, position, name, lat, lon, geohash)"
+                    " VALUES (:strategy_id, :user_id, :position, :name, :lat, :lon, :geohash)"), rows)
+                rows = []
+        if rows:
+            conn.execute(text(
+                "INSERT INTO strategy_location (strategy_id, user_id, position, name, lat, lon, geohash)"
+                " VALUES (:strategy_id, :user_id, :position, :name, :lat, :lon, :geohash)"), rows)
+    return user
+
+
+def haversine_python(lat, lon, lats, lons):
+    result = []
+    for lat2, lon2 in zip(lats, lons):
+        dlat, dlon = math.radians(lat2 - lat), math.radians(lon2 - lon)
+        a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+        result.append(2 * geo.EARTH_RADIUS_KM * math.asin(math.sqrt(a)))
+    return result
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    with wanderly.app.app_context():
+        start = time.perf_counter()
+        user = seed(args.points)
+        print(f"Seeded {args.points:,} locations in {time.perf_counter() - start:.1f} s")
+        coords = wanderly.db.session.execute(text("SELECT lat, lon FROM strategy_location")).fetchall()
+        lats = np.array([row.lat for row in coords])
+        lons = np.array([row.lon for row in coords])
+
+    loop_ms, _ = timed(lambda: haversine_python(35.0, 135.7, lats, lons), 1)
+    numpy_ms, _ = timed(lambda: geo.haversine_km(35.0, 135.7, lats, lons), 5)
+    print(f"Haversine over {len(lats):,} points: Python loop {loop_ms:.0f} ms, NumPy {numpy_ms:.1f} ms "
+          f"({loop_ms / numpy_ms:.0f}x)")
+
+    client = wanderly.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+    rng = random.Random(5)
+    probes = [(lat + rng.uniform(-1, 1), lon + rng.uniform(-1, 1), rng.choice([10, 50, 200]))
+              for lat, lon in (rng.choice(CITIES) for _ in range(args.lookups))]
+
+    def scan(lat, lon, radius):
+        with wanderly.app.app_context():
+            rows = wanderly.db.session.execute(text(
+                "SELECT l.strategy_id, l.lat, l.lon FROM strategy_location l"
+                " JOIN saved_strategy s ON s.id = l.strategy_id WHERE s.user_id = :user_id"
+            ), {'user_id': user.id}).fetchall()
+        distances = geo.haversine_km(lat, lon, [row.lat for row in rows], [row.lon for row in rows])
+        return len({row.strategy_id for row, d in zip(rows, distances) if d <= radius})
+
+    scan_ms, _ = timed(lambda: scan(*probes[0]), 3)
+    print(f"Radius lookup by full scan + haversine: {scan_ms:.0f} ms")
+
+    samples, mismatches = {}, 0
+    for lat, lon, radius in probes:
+        start = time.perf_counter()
+        response = client.get(f"/nearby?lat={lat}&lon={lon}&radius_km={radius}&limit=100")
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            raise SystemExit(f"/nearby failed: {response.status_code}")
+        samples.setdefault(radius, []).append((elapsed, response.json['total']))
+    for lat, lon, radius in probes[:5]:
+        mismatches += client.get(f"/nearby?lat={lat}&lon={lon}&radius_km={radius}").json['total'] != scan(lat, lon, radius)
+    for radius, results in sorted(samples.items()):
+        latencies = sorted(elapsed for elapsed, _ in results)
+        print(f"/nearby within {radius} km: p50 {statistics.median(latencies):.1f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)]:.1f} ms, "
+              f"~{statistics.mean(total for _, total in results):,.0f} matching strategies")
+    print(f"{mismatches} of 5 /nearby totals differ from the full scan")
+
+    world_ms, world = timed(lambda: client.get('/api/strategy_map?zoom=2').json, 1)
+    print(f"/api/strategy_map, whole world at zoom 2: {world_ms:.0f} ms, {world['points']:,} points -> "
+          f"{len(world['clusters'])} clusters")
+    city_ms, city = timed(lambda: client.get('/api/strategy_map?zoom=10&bbox=34.8,135.5,35.2,136.0').json, 5)
+    print(f"/api/strategy_map, Kyoto viewport at zoom 10: {city_ms:.1f} ms, {city['points']:,} points -> "
+          f"{len(city['clusters'])} clusters")
+
+
+if __name__ == '__main__':
+    main()
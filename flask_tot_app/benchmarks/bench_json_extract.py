@@ -0,0 +1,129 @@
+"""Compares the old regex-and-reparse strategy parser with json_extract on malformed LLM output.
+
+The corpus holds realistic failure shapes: markdown fences, chatty preambles,
+trailing commas, {"strategies": [...]} wrappers, responses cut off at the token
+limit, and big garbled outputs full of brackets. For each case the script reports
+how many strategies each parser recovered and how long it took. `--fuzz` also
+truncates a valid response at every offset, streams it in random-sized chunks, and
+checks that the extractor never raises or loses a strategy that had completed.
+
+Usage: python benchmarks/bench_json_extract.py [--repeat 200] [--fuzz]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json_extract
+from providers import fake_strategies
+
+
+def legacy_parse(content):
+    """The parser app.py used before json_extract, kept for comparison."""
+    try:
+        content = content.replace('```json', '').replace('```', '').strip()
+        match = re.search(r'\[.*\]', content, re.DOTALL)
+        if match:
+            content = match.group(0)
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            data = json.loads(re.sub(r',\s*([\]}])', r'\1', content))
+        if isinstance(data, dict):
+            if isinstance(data.get('strategies'), list):
+                return data['strategies']
+            if 'title' in data and 'summary' in data:
+                return [data]
+            return []
+        if isinstance(data, list):
+            return [item for item in data if isinstance(item, dict)]
+        return []
+    except Exception:
+        return []
+
+
+def complete_items(text):
+    """Number of array elements that closed before `text` was cut off."""
+    return len(json.loads(text[:text.rindex('}, {') + 1] + ']'))
+
+
+def build_corpus():
+    """Returns (name, text, expected strategy count) triples."""
+    strategies = fake_strategies("Two weeks in Japan [cherry blossom season], {budget: $4k}")
+    clean = json.dumps(strategies, indent=2)
+    trailing = re.sub(r'(\n\s*)([\]}])', r',\1\2', clean)
+    big = [dict(strategies[0], title=f"Strategy {i}", summary="Uses [brackets] and {braces} in prose.")
+           for i in range(60)]
+    big_text = json.dumps(big)
+    big_cut = big_text[:len(big_text) * 3 // 4]
+    return [
+        ('clean list', clean, 3),
+        ('markdown fence', f"```json\n{clean}\n```", 3),
+        ('preamble and epilogue', f"Sure! Here are 3 [three] strategies:\n{clean}\nLet me know [if] you need more.", 3),
+        ('trailing commas', trailing, 3),
+        ('strategies wrapper', json.dumps({'strategies': strategies}), 3),
+        ('single object', json.dumps(strategies[0]), 1),
+        ('raw newline in string', clean.replace('Offline strategy 1', 'Offline\nstrategy 1'), 3),
+        ('truncated mid-array', clean[:clean.rindex('"title"') + 20], 2),
+        ('truncated wrapper', json.dumps({'strategies': strategies})[:-40], 2),
+        ('two fenced blocks', f"```json\n{clean}\n```\nAlternative:\n```json\n{clean}\n```", 3),
+        ('large response', big_text, 60),
+        ('large truncated', big_cut, complete_items(big_cut)),
+        ('garbled brackets', '[' * 2000 + ' oops ' + '{"a": [' * 500, 0),
+    ]
+
+
+def time_call(fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(text)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def fuzz(iterations, seed=0):
+    rng = random.Random(seed)
+    text = json.dumps(fake_strategies("fuzz"), indent=1)
+    # Offsets at which each strategy's closing brace has been seen
+    ends = [m.end() for m in re.finditer(r'\n \}', text)]
+    failures = 0
+    for cut in range(len(text) + 1):
+        expected = sum(1 for end in ends if end <= cut)
+        if len(json_extract.extract_strategies(text[:cut])) != expected:
+            failures += 1
+    for _ in range(iterations):
+        parser = json_extract.StrategyStreamParser()
+        pos = 0
+        while pos < len(text):
+            step = rng.randint(1, 40)
+            parser.feed(text[pos:pos + step])
+            pos += step
+        if len(parser.strategies) != 3:
+            failures += 1
+    print(f"fuzz: {len(text) + 1} truncations + {iterations} random chunkings, {failures} failures")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--fuzz', action='store_true')
+    parser.add_argument('--fuzz-iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'case':<24}{'expected':>9}{'legacy':>8}{'extract':>8}{'legacy us':>12}{'extract us':>12}")
+    for name, text, expected in build_corpus():
+        legacy_time, legacy = time_call(legacy_parse, text, args.repeat)
+        new_time, new = time_call(json_extract.extract_strategies, text, args.repeat)
+        print(f"{name:<24}{expected:>9}{len(legacy):>8}{len(new):>8}{legacy_time * 1e6:>12.1f}{new_time * 1e6:>12.1f}")
+
+    if args.fuzz and fuzz(args.fuzz_iterations):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
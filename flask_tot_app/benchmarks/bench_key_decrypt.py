@@ -0,0 +1,56 @@
+"""Measures per-search API key decryption cost with and without the decrypted-key cache.
+
+"Before" decrypts all three user keys for every provider call in a search: one
+generation call plus one critique call per strategy, which is what the code did
+before keys were resolved once per request. "After" resolves keys through
+`user_api_keys()`, so only the first search in each TTL window pays for Fernet.
+
+Usage: python benchmarks/bench_key_decrypt.py [--searches 1000] [--strategies 3]
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from cryptography.fernet import Fernet
+
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+
+import app as wanderly
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--searches', type=int, default=1000)
+    parser.add_argument('--strategies', type=int, default=3)
+    args = parser.parse_args()
+
+    user = SimpleNamespace(
+        id=1,
+        gemini_key=wanderly.encrypt_value('gemini-' + 'x' * 32),
+        openai_key=wanderly.encrypt_value('sk-' + 'x' * 48),
+        anthropic_key=wanderly.encrypt_value('sk-ant-' + 'x' * 90),
+    )
+    calls_per_search = 1 + args.strategies
+
+    start = time.perf_counter()
+    for _ in range(args.searches):
+        for _ in range(calls_per_search):
+            for _, column in wanderly.USER_KEY_COLUMNS:
+                wanderly.decrypt_value(getattr(user, column))
+    before = (time.perf_counter() - start) / args.searches
+
+    wanderly.api_key_cache.clear()
+    start = time.perf_counter()
+    for _ in range(args.searches):
+        wanderly.user_api_keys(user)
+    after = (time.perf_counter() - start) / args.searches
+
+    print(f"before: {before * 1e6:8.1f} us/search ({calls_per_search * 3} decrypts)")
+    print(f"after:  {after * 1e6:8.1f} us/search (3 decrypts per {wanderly.app.config['API_KEY_CACHE_TTL_SECONDS']}s per user)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Checking API keys, and what a rejected key costs a search.
+
+Starts benchmarks/fake_llm_server.py with a fixed --latency per request and times,
+for one key per provider in --providers:
+  * sequential: the old check, a short generation per provider one after another
+  * concurrent: providers.check_keys(force=True), one model lookup per provider at once
+  * cached: providers.check_keys() again, answered from the verdicts in limits.py
+Then it puts the key 'invalid' first in the fallback chain (the fake server answers
+it with a 401) and times a completion before and after that rejection is cached.
+
+Usage: python benchmarks/bench_key_verify.py [--providers gemini,openai,anthropic] [--latency 0.3] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import fake_llm_server
+
+
+def median_ms(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--providers', default='gemini,openai,anthropic', help="LLM_PROVIDERS for the app")
+    parser.add_argument('--latency', type=float, default=0.3, help="seconds the fake server takes per request")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ['LLM_PROVIDERS'] = args.providers
+    os.environ.pop('FAKE_LLM_KEY', None)
+    fake = fake_llm_server.FakeLLMServer(fake_llm_server.FakeLLMConfig(latency=f"fixed:{args.latency}")).start()
+    os.environ.update(fake.environment())
+
+    import limits
+    import providers
+
+    names = [name for name in providers.PROVIDER_ORDER if name in providers.PROVIDERS]
+    keys = {name: f"bench-key-{name}" for name in names}
+
+    def sequential():
+        for name, api_key in keys.items():
+            providers.get_provider(name, api_key).generate("Hello", max_tokens=5)
+
+    def concurrent():
+        results = providers.check_keys(keys, force=True)
+        assert all(result['ok'] for result in results.values()), results
+
+    def cached():
+        results = providers.check_keys(keys)
+        assert all(result['cached'] for result in results.values()), results
+
+    sequential()  # warm up the SDK imports and clients
+    sequential_ms = median_ms(sequential, args.runs)
+    concurrent_ms = median_ms(concurrent, args.runs)
+    cached_ms = median_ms(cached, args.runs)
+    print(f"Checking {len(keys)} keys ({', '.join(names)}), {args.latency * 1000:.0f} ms per request:")
+    print(f"  sequential generations: {sequential_ms:,.0f} ms")
+    print(f"  concurrent model lookups: {concurrent_ms:,.0f} ms ({sequential_ms / concurrent_ms:.1f}x faster)")
+    print(f"  cached verdicts: {cached_ms:.3f} ms")
+
+    if len(names) < 2:
+        print("Needs two providers to time a fallback past a rejected key")
+    else:
+        chain = dict(keys, **{names[0]: 'invalid'})
+        first = chain_ms = None
+        for attempt in range(2):
+            start = time.perf_counter()
+            text = providers.complete_with_fallback("Hello", chain, max_tokens=5, purpose='bench')
+            elapsed = (time.perf_counter() - start) * 1000
+            assert text, "every provider failed"
+            if attempt == 0:
+                first = elapsed
+            else:
+                chain_ms = elapsed
+        verdict = limits.key_health(names[0], 'invalid')
+        print(f"Completion with a rejected {names[0]} key first: {first:,.0f} ms; "
+              f"{chain_ms:,.0f} ms once the rejection is cached ({verdict['message'][:60]!r})")
+
+    print(f"Fake server: {dict(fake.stats)}")
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
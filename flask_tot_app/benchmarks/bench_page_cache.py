@@ -0,0 +1,128 @@
+"""Throughput of repeated results and strategy page views.
+
+Seeds a throwaway database with one finished search (--strategies strategies of
+--days days each) and the best of them saved, then requests both pages --views
+times in three ways:
+  * uncached: every view loads the row, parses the JSON and renders the template
+  * cached: views are served from the in-process page cache
+  * revalidated: the browser sends the page's ETag back and gets a 304
+
+It also checks that deleting the strategy and saving another one under the same id
+(SQLite reuses the highest id) serves the new page, not the cached one.
+
+Usage: python benchmarks/bench_page_cache.py [--views 2000] [--strategies 5] [--days 7]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='wanderly-bench-'), 'bench.db')}"
+
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
+
+import app as wanderly
+from cost_analytics import CostStore
+
+# The first request warms up the /analytics store, so keep it out of instance/
+wanderly.cost_store = CostStore(os.path.join(tempfile.mkdtemp(prefix='wanderly-bench-'), 'cost_analytics'))
+
+
+def make_strategy(n, days):
+    return {
+        'title': f"Strategy {n}: slow travel through Kyoto and Osaka",
+        'summary': "Rail passes, ryokan nights and a day trip to Nara. " * 3,
+        'cost_breakdown': {'flights': '$900', 'accommodation': '$1,400', 'food': '$600', 'activities': '$350',
+                           'transport': '$280', 'currency': 'USD'},
+        'itinerary': [
+            {'day': day, 'title': f"Day in district {day}", 'activities': [
+                {'name': f"Stop {day}.{i}", 'type': 'sightseeing', 'description': "Temples, markets and a tea house. " * 2}
+                for i in range(4)
+            ]}
+            for day in range(1, days + 1)
+        ],
+        'locations': [{'name': 'Kyoto', 'lat': 35.01, 'lon': 135.77}, {'name': 'Osaka', 'lat': 34.69, 'lon': 135.5}],
+        'critique': "Well paced, though the Nara day is rushed. " * 3,
+        'score': 8 - n * 0.5,
+    }
+
+
+def seed(strategies, days):
+    db = wanderly.db
+    db.create_all()
+    user = wanderly.User(username='bench', email='bench@example.com', password=generate_password_hash('bench'))
+    db.session.add(user)
+    db.session.commit()
+    found = [make_strategy(n, days) for n in range(strategies)]
+    search = wanderly.SearchHistory(search_query="Two weeks in Kansai on a budget", results=json.dumps(found),
+                                    user_id=user.id, status='done')
+    db.session.add(search)
+    db.session.commit()
+    return user.id, search.id
+
+
+def save(client, strategy):
+    response = client.post('/save_strategy', json=strategy)
+    assert response.status_code == 200, response.status_code
+    return wanderly.db.session.query(func.max(wanderly.SavedStrategy.id)).scalar()
+
+
+def views_per_second(client, url, views, etag=None, expect=200):
+    headers = {'If-None-Match': etag} if etag else {}
+    start = time.perf_counter()
+    for _ in range(views):
+        response = client.get(url, headers=headers)
+        if response.status_code != expect:
+            raise SystemExit(f"{url}: expected {expect}, got {response.status_code}")
+    return views / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--views', type=int, default=2000)
+    parser.add_argument('--strategies', type=int, default=5)
+    parser.add_argument('--days', type=int, default=7)
+    args = parser.parse_args()
+
+    with wanderly.app.app_context():
+        user_id, search_id = seed(args.strategies, args.days)
+        client = wanderly.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        strategy_id = save(client, make_strategy(0, args.days))
+
+        pages = {'results': f"/results/{search_id}", 'strategy': f"/strategy/{strategy_id}"}
+        cache = wanderly.page_cache
+        maxsize = cache.maxsize
+        for label, url in pages.items():
+            client.get(url)  # warm up the template and SQLite caches
+            cache.maxsize = 0
+            cache.clear()
+            uncached = views_per_second(client, url, args.views)
+            cache.maxsize = maxsize
+            first = client.get(url)
+            cached = views_per_second(client, url, args.views)
+            revalidated = views_per_second(client, url, args.views, etag=first.headers['ETag'], expect=304)
+            print(f"{label} page ({len(first.data) / 1024:.0f} KB): uncached {uncached:,.0f}/s, "
+                  f"cached {cached:,.0f}/s ({cached / uncached:.1f}x), 304 {revalidated:,.0f}/s ({revalidated / uncached:.1f}x)")
+
+        # Delete and save a different strategy: it gets the same id, and must not be served the old page
+        old = client.get(pages['strategy'])
+        client.post(f"/delete_strategy/{strategy_id}")
+        replacement = make_strategy(1, args.days)
+        replacement['title'] = "A different strategy"
+        if save(client, replacement) != strategy_id:
+            print("Note: the replacement strategy got a new id; the reuse check is moot")
+        new = client.get(pages['strategy'], headers={'If-None-Match': old.headers['ETag']})
+        if new.status_code != 200 or b"A different strategy" not in new.data:
+            raise SystemExit(f"Stale strategy page served after delete + save (status {new.status_code})")
+        print("Invalidation: a re-used strategy id serves the new page")
+        print(f"Page cache: {cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
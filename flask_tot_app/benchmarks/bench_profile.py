@@ -0,0 +1,127 @@
+"""Times the profile dashboard for a heavy user, before and after the index and query changes.
+
+Seeds a throwaway SQLite database with one user who has 10k searches, 1k saved
+strategies and a few trips. "Before" drops the profile indexes and runs the old
+view's queries: full rows, every saved strategy, the trip query three times, and
+one lazy load per trip strategy. "After" requests /profile with the indexes in
+place. It also times a deep keyset page of the search history.
+
+Usage: python benchmarks/bench_profile.py [--searches 10000] [--saved 1000] [--runs 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+DB_DIR = tempfile.mkdtemp(prefix='wanderly-bench-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+
+from flask import render_template
+from sqlalchemy import event, text
+from werkzeug.security import generate_password_hash
+
+import app as wanderly
+from migrations import add_missing_indexes
+
+PROFILE_INDEXES = ('ix_search_history_user_timestamp', 'ix_saved_strategy_user_id',
+                   'ix_trip_user_start_date', 'ix_trip_strategy_id')
+
+
+def seed(searches, saved, trips):
+    db = wanderly.db
+    db.create_all()
+    user = wanderly.User(username='bench', email='bench@example.com', password=generate_password_hash('bench'))
+    db.session.add(user)
+    db.session.commit()
+
+    strategies = wanderly.mock_generation()
+    results = json.dumps(strategies)
+    start = datetime.utcnow() - timedelta(days=365)
+    db.session.execute(
+        wanderly.SearchHistory.__table__.insert(),
+        [{'search_query': f"Trip idea #{i}", 'results': results, 'timestamp': start + timedelta(minutes=i),
+          'user_id': user.id, 'status': 'done'} for i in range(searches)],
+    )
+    for i in range(saved):
+        strategy = strategies[i % len(strategies)]
+        content = {k: strategy[k] for k in ('summary', 'cost_breakdown', 'itinerary', 'locations')}
+        row = wanderly.SavedStrategy(title=f"{strategy['title']} #{i}", content=json.dumps(content),
+                                     critique=strategy['critique'], score=strategy['score'], user_id=user.id)
+        row.set_details(content)
+        db.session.add(row)
+    db.session.flush()
+    for i in range(trips):
+        db.session.add(wanderly.Trip(destination=f"Trip {i}", start_date=start + timedelta(days=400 + i),
+                                     end_date=start + timedelta(days=407 + i), user_id=user.id, strategy_id=i + 1))
+    db.session.commit()
+    return user.id
+
+
+def legacy_profile(user_id):
+    """The profile view as it was before this change."""
+    SearchHistory, SavedStrategy, Trip = wanderly.SearchHistory, wanderly.SavedStrategy, wanderly.Trip
+    history = SearchHistory.query.filter_by(user_id=user_id).order_by(SearchHistory.timestamp.desc()).limit(10).all()
+    saved_raw = SavedStrategy.query.filter_by(user_id=user_id).all()
+    trips = Trip.query.filter_by(user_id=user_id).order_by(Trip.start_date.asc()).all()
+    trips = Trip.query.filter_by(user_id=user_id).order_by(Trip.start_date.asc()).all()
+    trips = Trip.query.filter_by(user_id=user_id).order_by(Trip.start_date.asc()).all()
+    return render_template('profile.html', trips=trips, saved_strategies=saved_raw, search_history=history)
+
+
+def measure(fn, runs, counter):
+    timings, queries = [], []
+    for _ in range(runs):
+        wanderly.db.session.expire_all()
+        counter[0] = 0
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+        queries.append(counter[0])
+    return statistics.median(timings), max(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--searches', type=int, default=10000)
+    parser.add_argument('--saved', type=int, default=1000)
+    parser.add_argument('--trips', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    app = wanderly.app
+    app.config['TESTING'] = True
+    counter = [0]
+    with app.app_context():
+        event.listen(wanderly.db.engine, 'before_cursor_execute', lambda *a: counter.__setitem__(0, counter[0] + 1))
+        user_id = seed(args.searches, args.saved, args.trips)
+        print(f"Seeded {args.searches} searches, {args.saved} saved strategies, {args.trips} trips in {DB_DIR}")
+
+        user = wanderly.db.session.get(wanderly.User, user_id)
+        with app.test_request_context('/profile'):
+            wanderly.login_user(user)
+            for name in PROFILE_INDEXES:
+                wanderly.db.session.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+            wanderly.db.session.commit()
+            before = measure(lambda: legacy_profile(user_id), args.runs, counter)
+            add_missing_indexes(wanderly.db)
+            wanderly.db.session.commit()
+            after = measure(wanderly.profile, args.runs, counter)
+
+        deep = wanderly.SearchHistory.query.order_by(wanderly.SearchHistory.id).offset(args.searches // 10).first()
+        cursor = wanderly.encode_cursor((deep.timestamp, deep.id))
+        with app.test_request_context(f'/profile?history_before={cursor}'):
+            wanderly.login_user(user)
+            deep_page = measure(wanderly.profile, args.runs, counter)
+
+    print(f"before:          {before[0] * 1000:8.1f} ms  {before[1]} queries")
+    print(f"after:           {after[0] * 1000:8.1f} ms  {after[1]} queries")
+    print(f"after, deep page:{deep_page[0] * 1000:8.1f} ms  {deep_page[1]} queries")
+
+
+if __name__ == '__main__':
+    main()
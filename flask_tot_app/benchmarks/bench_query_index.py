@@ -0,0 +1,103 @@
+"""Build, lookup and insert cost of the near-duplicate query index at scale.
+
+Generates synthetic travel queries, indexes them, then looks up reworded copies of
+random stored queries (words shuffled, filler words added or dropped) and reports
+latency percentiles and how often the original came back in the top 5. It also
+times single inserts, including the periodic merges, and a cold reload from disk.
+
+Usage: python benchmarks/bench_query_index.py [--queries 1000000] [--lookups 2000] [--inserts 20000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from query_index import QueryIndex
+
+PLACES = ['Japan', 'Kyoto', 'Osaka', 'Lisbon', 'Porto', 'Patagonia', 'Iceland', 'Peru', 'Vietnam', 'Hanoi',
+          'Morocco', 'Marrakech', 'Tuscany', 'Rome', 'Sicily', 'Greece', 'Crete', 'Norway', 'Bali', 'Mexico City',
+          'Oaxaca', 'Seoul', 'Busan', 'Taiwan', 'Istanbul', 'Cairo', 'Kenya', 'Cape Town', 'Chile', 'Colombia']
+THEMES = ['food', 'hiking', 'beach', 'museum', 'wine', 'street food', 'surfing', 'photography', 'nightlife',
+          'history', 'temples', 'road trip', 'train', 'honeymoon', 'family', 'skiing', 'diving', 'festival']
+MODIFIERS = ['on a budget', 'cheap', 'luxury', 'with kids', 'for two weeks', 'in spring', 'in winter',
+             'for a long weekend', 'solo', 'with grandparents', 'off the beaten path', 'slow travel', '']
+ORIGINS = ['NYC', 'London', 'Chicago', 'Berlin', 'Toronto', 'Sydney', 'Paris', 'Boston', 'Denver', 'Tokyo', '']
+FILLER = ['I want a', 'we would love a', 'planning a', 'looking for a', 'trip', 'some', 'please']
+
+
+def make_query(rng):
+    words = [rng.choice(THEMES), 'trip', 'in', rng.choice(PLACES), rng.choice(MODIFIERS), rng.choice(MODIFIERS)]
+    query = ' '.join(word for word in words if word)
+    origin = rng.choice(ORIGINS)
+    # Numbers keep queries distinct, as dates and budgets do in real searches
+    query += f" {rng.randint(3, 21)} days"
+    return f"{query} (Starting from {origin})" if origin else query
+
+
+def reword(query, rng):
+    words = query.replace('(Starting from', '').replace(')', '').split()
+    rng.shuffle(words)
+    if len(words) > 4 and rng.random() < 0.5:
+        words.pop(rng.randrange(len(words)))
+    words.insert(0, rng.choice(FILLER))
+    return ' '.join(words)
+
+
+def percentile(samples, q):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--inserts', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    directory = tempfile.mkdtemp(prefix='wanderly-bench-')
+    index = QueryIndex(os.path.join(directory, 'query_index'))
+    queries = [make_query(rng) for _ in range(args.queries)]
+    users = [rng.randrange(args.users) for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    index.rebuild((i, users[i], query) for i, query in enumerate(queries))
+    build = time.perf_counter() - start
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    print(f"Indexed {len(index):,} queries in {build:.1f} s ({size / 1e6:.0f} MB on disk)")
+
+    for label, user_scoped in (('all users', False), ('one user', True)):
+        latencies, found = [], 0
+        for _ in range(args.lookups):
+            source = rng.randrange(args.queries)
+            probe = reword(queries[source], rng)
+            begin = time.perf_counter()
+            hits = index.lookup(probe, k=5, user_id=users[source] if user_scoped else None)
+            latencies.append((time.perf_counter() - begin) * 1000)
+            # Identical generated queries are interchangeable, so any exact twin counts
+            found += any(queries[hit] == queries[source] for hit, _ in hits)
+        print(f"Lookup, {label}: p50 {statistics.median(latencies):.2f} ms, p99 {percentile(latencies, 0.99):.2f} ms, "
+              f"max {max(latencies):.2f} ms; original in top 5 for {found / args.lookups:.1%}")
+
+    latencies = []
+    for i in range(args.inserts):
+        begin = time.perf_counter()
+        index.add(args.queries + i, rng.randrange(args.users), make_query(rng))
+        latencies.append((time.perf_counter() - begin) * 1000)
+    print(f"Insert: p50 {statistics.median(latencies):.3f} ms, p99 {percentile(latencies, 0.99):.3f} ms, "
+          f"max {max(latencies):.0f} ms (merge + snapshot every {index.merge_size} inserts)")
+
+    start = time.perf_counter()
+    reloaded = QueryIndex(index.path)
+    count = len(reloaded)
+    print(f"Cold load of {count:,} entries: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
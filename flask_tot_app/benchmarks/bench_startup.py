@@ -0,0 +1,109 @@
+"""Cold-start time of the web app and the database scripts.
+
+Each target is imported in a fresh interpreter (`python -X importtime`) --runs
+times, and the median import time and whole-process time are reported. The slowest
+top-level packages come from the importtime report of one run. It also checks
+which provider SDKs were loaded, which should be none, since providers.py imports
+them on first use.
+
+Exits non-zero when `import app` loads an SDK, or takes longer than --max-ms, so CI
+can track it.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--top 12] [--max-ms 1500] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+TARGETS = {
+    'web app (import app)': 'import app',
+    'db scripts (create_app + models)': 'from factory import create_app; import models; create_app()',
+    'providers.py': 'import providers',
+}
+SDKS = ('openai', 'anthropic', 'google.generativeai', 'google.ai.generativelanguage', 'cryptography.fernet', 'httpx')
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+print(json.dumps({{'seconds': time.perf_counter() - start, 'sdks': [m for m in {sdks!r} if m in sys.modules]}}))
+"""
+
+
+def run_once(statement, env):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', CHILD.format(statement=statement, sdks=SDKS)],
+        cwd=APP_DIR, env=env, capture_output=True, text=True,
+    )
+    process_seconds = time.perf_counter() - start
+    if result.returncode:
+        raise SystemExit(f"{statement!r} failed:\n{result.stderr[-2000:]}")
+    child = json.loads(result.stdout.strip().splitlines()[-1])
+    return child['seconds'], process_seconds, child['sdks'], result.stderr
+
+
+def package_times(importtime_report):
+    """Self time per top-level package, in ms, from an `-X importtime` report."""
+    totals = defaultdict(int)
+    for line in importtime_report.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(self_us)
+    return {name: us / 1000 for name, us in sorted(totals.items(), key=lambda item: -item[1])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=12, help="slowest top-level packages to list per target")
+    parser.add_argument('--max-ms', type=float, help="fail if the median `import app` takes longer")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # A throwaway database, so importing the app never touches instance/site.db
+    env['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='wanderly-startup-'), 'startup.db')}"
+
+    results = {}
+    for label, statement in TARGETS.items():
+        runs = [run_once(statement, env) for _ in range(args.runs)]
+        results[label] = {
+            'import_ms': round(statistics.median(run[0] for run in runs) * 1000, 1),
+            'process_ms': round(statistics.median(run[1] for run in runs) * 1000, 1),
+            'sdks_loaded': runs[-1][2],
+            'packages_ms': {name: round(ms, 1) for name, ms in list(package_times(runs[-1][3]).items())[:args.top]},
+        }
+
+    for label, row in results.items():
+        print(f"{label}: import {row['import_ms']:.0f} ms, whole process {row['process_ms']:.0f} ms "
+              f"(median of {args.runs}); SDKs loaded: {', '.join(row['sdks_loaded']) or 'none'}")
+        print('    ' + ', '.join(f"{name} {ms:.0f}" for name, ms in row['packages_ms'].items()) + ' (ms self time)')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.json}")
+
+    app = results['web app (import app)']
+    failures = []
+    if app['sdks_loaded']:
+        failures.append(f"`import app` loaded {', '.join(app['sdks_loaded'])}; import provider SDKs on first use")
+    if args.max_ms is not None and app['import_ms'] > args.max_ms:
+        failures.append(f"`import app` took {app['import_ms']:.0f} ms, over --max-ms {args.max_ms:.0f}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
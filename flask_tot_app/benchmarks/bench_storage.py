@@ -0,0 +1,100 @@
+"""Database size and read latency of search results stored as plain JSON text vs compressed.
+
+Seeds a throwaway SQLite database with synthetic searches, stored as plain TEXT the
+way the app wrote them before CompressedText. It measures the file size and the
+time to load and parse random results, runs the compression migration plus VACUUM,
+then measures both again.
+
+Usage: python benchmarks/bench_storage.py [--searches 100000] [--reads 2000]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+DB_DIR = tempfile.mkdtemp(prefix='wanderly-bench-')
+DB_PATH = os.path.join(DB_DIR, 'bench.db')
+os.environ['DATABASE_URL'] = f"sqlite:///{DB_PATH}"
+
+from werkzeug.security import generate_password_hash
+
+import app as wanderly
+from migrations import compress_legacy_text
+
+
+def seed(searches, batch=5000):
+    db = wanderly.db
+    db.create_all()
+    user = wanderly.User(username='bench', email='bench@example.com', password=generate_password_hash('bench'))
+    db.session.add(user)
+    db.session.commit()
+    base = wanderly.mock_generation()
+    start = datetime.utcnow() - timedelta(days=365)
+    with db.engine.begin() as conn:
+        for offset in range(0, searches, batch):
+            rows = []
+            for i in range(offset, min(offset + batch, searches)):
+                strategies = [dict(s, title=f"{s['title']} ({i})", score=round(random.uniform(4, 9), 1)) for s in base]
+                rows.append((f"Trip idea #{i}", json.dumps(strategies), (start + timedelta(seconds=i * 300)).isoformat(' '),
+                             user.id, 'done'))
+            # Raw TEXT inserts, the pre-compression storage format
+            conn.exec_driver_sql(
+                "INSERT INTO search_history (search_query, results, timestamp, user_id, status) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+
+def database_size():
+    with wanderly.db.engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    return os.path.getsize(DB_PATH)
+
+
+def read_latency(ids):
+    timings = []
+    for search_id in ids:
+        wanderly.db.session.expire_all()
+        start = time.perf_counter()
+        search = wanderly.db.session.get(wanderly.SearchHistory, search_id)
+        json.loads(search.results)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return statistics.median(timings) * 1e6, timings[int(len(timings) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--searches', type=int, default=100000)
+    parser.add_argument('--reads', type=int, default=2000)
+    args = parser.parse_args()
+
+    with wanderly.app.app_context():
+        start = time.perf_counter()
+        seed(args.searches)
+        print(f"Seeded {args.searches} searches in {time.perf_counter() - start:.1f}s ({DB_DIR})")
+        ids = random.sample(range(1, args.searches + 1), min(args.reads, args.searches))
+
+        size_before = database_size()
+        p50_before, p99_before = read_latency(ids)
+
+        start = time.perf_counter()
+        converted = compress_legacy_text(wanderly.db)
+        with wanderly.db.engine.connect() as conn:
+            conn.exec_driver_sql('VACUUM')
+        migrate_time = time.perf_counter() - start
+
+        size_after = database_size()
+        p50_after, p99_after = read_latency(ids)
+
+    print(f"migration: {converted} rows compressed + VACUUM in {migrate_time:.1f}s")
+    print(f"plain text: {size_before / 1e6:8.1f} MB  read p50 {p50_before:6.0f}us  p99 {p99_before:6.0f}us")
+    print(f"compressed: {size_after / 1e6:8.1f} MB  read p50 {p50_after:6.0f}us  p99 {p99_after:6.0f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Overhead of tracing spans and the /metrics endpoint.
+
+Times an empty span, a nested span pair and `bind()`, then runs the same streamed
+search (fake provider, no latency, caches cleared) with tracing on and off to show
+what it adds to a whole request. It finishes by timing /metrics.
+
+Usage: python benchmarks/bench_tracing.py [--spans 200000] [--searches 200]
+"""
+import argparse
+import itertools
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ['LLM_PROVIDERS'] = 'fake'
+os.environ['FAKE_LLM_KEY'] = 'bench-key'
+os.environ['FAKE_LLM_LATENCY'] = '0'
+os.environ['ANALYZE_RATE_PER_MINUTE'] = '1000000'
+os.environ['ANALYZE_BURST'] = '1000000'
+os.environ['LLM_KEY_TOKENS_PER_MINUTE'] = '0'
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='wanderly-bench-'), 'bench.db')}"
+
+import app as wanderly
+import tracing
+from cost_analytics import CostStore
+
+# The first request warms up the /analytics store, so keep it out of instance/
+wanderly.cost_store = CostStore(os.path.join(tempfile.mkdtemp(prefix='wanderly-bench-'), 'cost_analytics'))
+
+QUERY_NUMBERS = itertools.count()
+# The strategy cache persists in instance/, so queries must be new to this run too
+RUN_ID = time.time_ns()
+
+
+def per_call_us(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def empty_span():
+    with tracing.span('bench'):
+        pass
+
+
+def nested_spans():
+    with tracing.span('bench_outer'):
+        with tracing.span('bench_inner', provider='fake', outcome='ok'):
+            pass
+
+
+def search_latencies(client, searches):
+    samples = []
+    for _ in range(searches):
+        # A query never used before misses the strategy cache
+        query = f"bench trip {RUN_ID} {next(QUERY_NUMBERS)}"
+        wanderly.critique_cache.clear()
+        start = time.perf_counter()
+        body = client.get('/analyze/stream', query_string={'query': query}).data
+        samples.append((time.perf_counter() - start) * 1000)
+        if b'event: done' not in body:
+            raise SystemExit("search did not finish")
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--spans', type=int, default=200000)
+    parser.add_argument('--searches', type=int, default=200)
+    args = parser.parse_args()
+
+    with wanderly.app.app_context():
+        wanderly.db.create_all()
+
+    baseline = per_call_us(lambda: None, args.spans)
+    print(f"Empty span: {per_call_us(empty_span, args.spans) - baseline:.2f} µs")
+    print(f"Nested span pair with labels: {per_call_us(nested_spans, args.spans) - baseline:.2f} µs")
+    print(f"bind() + call: {per_call_us(lambda: tracing.bind(baseline.__abs__)(), args.spans) - baseline:.2f} µs")
+
+    client = wanderly.app.test_client()
+    search_latencies(client, 20)  # warm up imports, pools and the SQLite cache
+    results = {False: [], True: []}
+    # Alternate every search, so drift (the growing cache file, CPU frequency) hits both sides equally
+    for i in range(args.searches * 2):
+        tracing.ENABLED = bool(i % 2)
+        results[tracing.ENABLED].extend(search_latencies(client, 1))
+    off, on = statistics.median(results[False]), statistics.median(results[True])
+    print(f"Streamed search, median of {args.searches}: tracing off {off:.2f} ms, on {on:.2f} ms "
+          f"({(on - off) / off:+.1%})")
+
+    tracing.ENABLED = True
+    spans = tracing.recent_traces(1)[0]
+    count = lambda node: 1 + sum(count(child) for child in node['children'])
+    print(f"Spans per search: {count(spans)}")
+    metrics_ms = statistics.median(per_call_us(lambda: client.get('/metrics'), 1) / 1000 for _ in range(50))
+    series = sum(1 for line in tracing.render_metrics().splitlines() if line and not line.startswith('#'))
+    print(f"/metrics: {metrics_ms:.2f} ms for {series} series")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+"""Local stand-in for the Gemini, OpenAI and Anthropic HTTP APIs.
+
+Speaks just enough of each wire format for the SDKs in providers.py, streaming and
+not streaming:
+  * OpenAI     POST /v1/chat/completions
+  * Anthropic  POST /v1/messages
+  * Gemini     POST /v1beta/models/<model>:generateContent and :streamGenerateContent (REST transport)
+  * GET /v1/models/<model> (OpenAI, Anthropic) and /v1beta/models/<model> (Gemini), used to check keys
+
+Any request made with the API key 'invalid' is answered with a 401.
+
+Answers are built like FakeProvider's: three strategies for a planning prompt, a
+critique for a critic prompt, a batch of critiques for a batch prompt. Every
+response is delayed by a draw from a latency distribution, plus a per-token decode
+time, and can be replaced by an HTTP error or a malformed body at a set rate:
+    fixed:1.5              always 1.5 s
+    uniform:0.5:2          between 0.5 and 2 s
+    lognormal:1.2:0.5      median 1.2 s, sigma 0.5 (long tail, like real APIs)
+Each of --latency, --failure-rate and --malformed-rate takes a single value or
+per-provider values, e.g. --failure-rate "0.02,gemini=0.3".
+
+Usage: python benchmarks/fake_llm_server.py [--port 8765] [--latency lognormal:1.2:0.5] ...
+then start the app with the environment variables it prints.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+MALFORMED_KINDS = ('truncated', 'fenced', 'prose', 'garbage')
+ERROR_STATUSES = (500, 503, 429)
+
+
+def parse_distribution(spec):
+    """'fixed:1', 'uniform:0.5:2' or 'lognormal:1.2:0.5' -> a function returning seconds."""
+    kind, *params = spec.split(':')
+    params = [float(p) for p in params]
+    if kind == 'fixed':
+        return lambda rng: params[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def per_provider(spec, parse):
+    """'0.1' or '0.1,gemini=0.5' -> {provider or None (default): parsed value}."""
+    values = {}
+    for part in spec.split(','):
+        name, _, value = part.rpartition('=')
+        values[name or None] = parse(value)
+    return values
+
+
+def malform(text, kind, rng):
+    """Damages a JSON answer the way LLMs do."""
+    if kind == 'truncated':
+        return text[:rng.randint(1, max(1, len(text) - 1))]
+    if kind == 'fenced':
+        # Recoverable: json_extract strips Markdown fences
+        return f"```json\n{text}\n```"
+    if kind == 'prose':
+        return f"Sure! Here is what you asked for:\n{text}\nLet me know if you need anything else."
+    return "I'm sorry, I can't help with planning that trip."
+
+
+class FakeLLMConfig:
+    def __init__(self, latency='fixed:0', ms_per_token=0.0, failure_rate='0', malformed_rate='0', seed=None):
+        self.latency = per_provider(latency, parse_distribution)
+        self.ms_per_token = ms_per_token
+        self.failure_rate = per_provider(failure_rate, float)
+        self.malformed_rate = per_provider(malformed_rate, float)
+        self.seed = seed
+
+    def pick(self, values, provider):
+        return values.get(provider, values.get(None))
+
+
+class FakeLLMServer:
+    """Runs the fake APIs on a background thread. `stats` counts requests and injected faults."""
+
+    def __init__(self, config, host='127.0.0.1', port=0):
+        self.config = config
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+        # Imported here so a harness can set the app's environment before providers.py reads it
+        from providers import FakeProvider
+        self._responder = FakeProvider('fake-llm-server')
+        handler = type('Handler', (_Handler,), {'server_state': self})
+        self._httpd = ThreadingHTTPServer((host, port), handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self):
+        """Environment variables that point the app's provider SDKs at this server."""
+        return {
+            'OPENAI_BASE_URL': f"{self.url}/v1",
+            'ANTHROPIC_BASE_URL': self.url,
+            'GEMINI_API_ENDPOINT': self.url,
+            'GOOGLE_API_KEY': 'fake-llm-server',
+            'OPENAI_API_KEY': 'fake-llm-server',
+            'ANTHROPIC_API_KEY': 'fake-llm-server',
+        }
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-llm-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def draw(self, provider):
+        """Returns (delay seconds, error status or None, malformed kind or None) for one request."""
+        config = self.config
+        with self._rng_lock:
+            delay = max(0.0, config.pick(config.latency, provider)(self._rng))
+            error = self._rng.choice(ERROR_STATUSES) if self._rng.random() < config.pick(config.failure_rate, provider) else None
+            malformed = (self._rng.choice(MALFORMED_KINDS)
+                         if self._rng.random() < config.pick(config.malformed_rate, provider) else None)
+        return delay, error, malformed
+
+    def answer(self, prompt, system):
+        return self._responder._respond(prompt, system)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def api_key(self):
+        authorization = self.headers.get('Authorization', '')
+        query = dict(part.partition('=')[::2] for part in self.path.partition('?')[2].split('&') if part)
+        return (authorization[len('Bearer '):] if authorization.startswith('Bearer ') else None) or \
+            self.headers.get('x-api-key') or self.headers.get('x-goog-api-key') or query.get('key')
+
+    def reject_key(self):
+        """Answers 401 for the key 'invalid'; returns whether it did."""
+        if self.api_key() != 'invalid':
+            return False
+        self.server_state.count('rejected_keys')
+        self.send_json(401, {'error': {'message': "Incorrect API key provided", 'type': 'authentication_error',
+                                       'code': 401, 'status': 'UNAUTHENTICATED'}})
+        return True
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        model = re.match(r'^/(v1|v1beta)/models/([^/:]+)$', path)
+        if not model:
+            return self.send_json(404, {'error': {'message': f"No fake endpoint at {path}"}})
+        state = self.server_state
+        provider = 'gemini' if model.group(1) == 'v1beta' else 'anthropic' if self.headers.get('x-api-key') else 'openai'
+        state.count(f"{provider}_model_lookups")
+        time.sleep(state.draw(provider)[0])
+        if self.reject_key():
+            return
+        name = model.group(2)
+        self.send_json(200, {
+            'openai': {'id': name, 'object': 'model', 'created': 0, 'owned_by': 'fake'},
+            'anthropic': {'id': name, 'type': 'model', 'display_name': name, 'created_at': '2024-01-01T00:00:00Z'},
+            'gemini': {'name': f"models/{name}", 'baseModelId': name, 'version': '1', 'displayName': name},
+        }[provider])
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        path = self.path.split('?')[0]
+        if self.reject_key():
+            return
+        gemini = re.match(r'^/v1(?:beta)?/models/([^:]+):(generateContent|streamGenerateContent)$', path)
+        if path.endswith('/chat/completions'):
+            self.handle_llm('openai', body, body.get('model', 'gpt'), body.get('stream', False), *openai_prompt(body))
+        elif path.endswith('/messages'):
+            self.handle_llm('anthropic', body, body.get('model', 'claude'), body.get('stream', False),
+                            anthropic_prompt(body), body.get('system'))
+        elif gemini:
+            self.handle_llm('gemini', body, gemini.group(1), gemini.group(2) == 'streamGenerateContent',
+                            gemini_prompt(body), None)
+        else:
+            self.send_json(404, {'error': {'message': f"No fake endpoint at {path}"}})
+
+    def handle_llm(self, provider, body, model, stream, prompt, system):
+        state = self.server_state
+        delay, error, malformed = state.draw(provider)
+        state.count(f"{provider}_requests")
+        time.sleep(delay)
+        if error:
+            state.count(f"{provider}_errors")
+            return self.send_json(error, {'error': {'message': f"Injected {error} from the fake server",
+                                                    'type': 'overloaded_error' if error != 429 else 'rate_limit_error',
+                                                    'code': error, 'status': 'UNAVAILABLE'}})
+        text = state.answer(prompt, system)
+        if malformed:
+            state.count(f"{provider}_malformed")
+            state.count(f"malformed_{malformed}")
+            text = malform(text, malformed, random.Random(len(prompt)))
+        usage = (len(prompt) + len(system or '')) // 4, len(text) // 4
+        state.count(f"{provider}_output_tokens", usage[1])
+        if not stream:
+            # The whole answer is decoded before a non-streaming response is sent
+            time.sleep(usage[1] * state.config.ms_per_token / 1000)
+            return self.send_json(200, FORMATS[provider]['complete'](model, text, usage))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json' if provider == 'gemini' else 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        pieces = [text[i:i + 64] for i in range(0, len(text), 64)]
+        for payload in FORMATS[provider]['stream'](model, pieces, usage):
+            if payload is None:
+                time.sleep(16 * state.config.ms_per_token / 1000)
+                continue
+            self.write_chunk(payload)
+        self.write_chunk('')
+
+    def write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def openai_prompt(body):
+    system = next((m['content'] for m in body.get('messages', []) if m.get('role') == 'system'), None)
+    user = next((m['content'] for m in body.get('messages', []) if m.get('role') == 'user'), '')
+    return user, system
+
+
+def anthropic_prompt(body):
+    content = body.get('messages', [{}])[0].get('content', '')
+    return content if isinstance(content, str) else ''.join(block.get('text', '') for block in content)
+
+
+def gemini_prompt(body):
+    return ''.join(part.get('text', '') for content in body.get('contents', []) for part in content.get('parts', []))
+
+
+def sse(data, event=None):
+    return (f"event: {event}\n" if event else '') + f"data: {json.dumps(data)}\n\n"
+
+
+def openai_complete(model, text, usage):
+    return {'id': f"chatcmpl-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion', 'created': int(time.time()),
+            'model': model, 'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text},
+                                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': usage[0], 'completion_tokens': usage[1], 'total_tokens': sum(usage)}}
+
+
+def openai_stream(model, pieces, usage):
+    base = {'id': f"chatcmpl-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion.chunk', 'created': int(time.time()),
+            'model': model}
+    for piece in pieces:
+        yield None
+        yield f"data: {json.dumps(dict(base, choices=[{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]))}\n\n"
+    yield f"data: {json.dumps(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))}\n\n"
+    yield f"data: {json.dumps(dict(base, choices=[], usage={'prompt_tokens': usage[0], 'completion_tokens': usage[1], 'total_tokens': sum(usage)}))}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def anthropic_complete(model, text, usage):
+    return {'id': f"msg_{uuid.uuid4().hex[:12]}", 'type': 'message', 'role': 'assistant', 'model': model,
+            'content': [{'type': 'text', 'text': text}], 'stop_reason': 'end_turn', 'stop_sequence': None,
+            'usage': {'input_tokens': usage[0], 'output_tokens': usage[1]}}
+
+
+def anthropic_stream(model, pieces, usage):
+    message = dict(anthropic_complete(model, '', (usage[0], 0)), content=[], stop_reason=None)
+    yield sse({'type': 'message_start', 'message': message}, 'message_start')
+    yield sse({'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}, 'content_block_start')
+    for piece in pieces:
+        yield None
+        yield sse({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': piece}},
+                  'content_block_delta')
+    yield sse({'type': 'content_block_stop', 'index': 0}, 'content_block_stop')
+    yield sse({'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+               'usage': {'output_tokens': usage[1]}}, 'message_delta')
+    yield sse({'type': 'message_stop'}, 'message_stop')
+
+
+def gemini_complete(model, text, usage, finished=True):
+    candidate = {'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}
+    if finished:
+        candidate['finishReason'] = 'STOP'
+    return {'candidates': [candidate],
+            'usageMetadata': {'promptTokenCount': usage[0], 'candidatesTokenCount': usage[1],
+                              'totalTokenCount': sum(usage)},
+            'modelVersion': model}
+
+
+def gemini_stream(model, pieces, usage):
+    # The REST transport streams one JSON array, an element per chunk
+    for i, piece in enumerate(pieces):
+        yield None
+        chunk = gemini_complete(model, piece, usage, finished=i == len(pieces) - 1)
+        yield ('[' if i == 0 else ',\r\n') + json.dumps(chunk)
+    yield ']' if pieces else '[]'
+
+
+FORMATS = {
+    'openai': {'complete': openai_complete, 'stream': openai_stream},
+    'anthropic': {'complete': anthropic_complete, 'stream': anthropic_stream},
+    'gemini': {'complete': gemini_complete, 'stream': gemini_stream},
+}
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', default='lognormal:1.2:0.5',
+                        help="fixed:S, uniform:LO:HI or lognormal:MEDIAN:SIGMA, optionally per provider")
+    parser.add_argument('--ms-per-token', type=float, default=2.0, help="simulated decode time per output token")
+    parser.add_argument('--failure-rate', default='0', help="share of requests answered with 500/503/429")
+    parser.add_argument('--malformed-rate', default='0', help="share of answers that are damaged JSON")
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def config_from_args(args):
+    return FakeLLMConfig(args.latency, args.ms_per_token, args.failure_rate, args.malformed_rate, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = FakeLLMServer(config_from_args(args), args.host, args.port)
+    print(f"Fake LLM APIs listening on {server.url}. Start the app with:")
+    for name, value in server.environment().items():
+        print(f"  export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(dict(server.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""Offline load test of the whole app against the fake LLM APIs.
+
+Starts benchmarks/fake_llm_server.py and the app (threaded Werkzeug server, fresh
+SQLite database, strategy cache and query index in a temp directory), then runs
+--users virtual users over real HTTP for --duration seconds. Each one registers
+and then loops:
+  POST /analyze -> poll /jobs/<id> until done -> GET /results/<id> -> POST /save_strategy -> GET /profile
+Every provider call goes through the real SDKs and providers.py, so fallback,
+circuit breakers, parsing and critiques are all exercised. Latency, failure and
+malformed-output rates are set with the fake server's options.
+
+Reports throughput and p50/p95/p99 per endpoint, end-to-end search time, what the
+fake server injected, and database growth. --json writes the same numbers to a
+file, so runs before and after a change can be compared.
+
+Usage: python benchmarks/load_test.py [--users 8] [--duration 60] [--latency lognormal:1.2:0.5]
+                                      [--failure-rate 0.05] [--malformed-rate 0.05] [--json out.json]
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+
+import fake_llm_server
+
+PLACES = ['Kyoto', 'Lisbon', 'Patagonia', 'Iceland', 'Hanoi', 'Marrakech', 'Tuscany', 'Crete', 'Oaxaca', 'Seoul',
+          'Cape Town', 'Bali', 'Peru', 'Norway', 'Istanbul']
+THEMES = ['food', 'hiking', 'museums', 'beaches', 'wine', 'temples', 'road trip', 'nightlife', 'family']
+ORIGINS = ['NYC', 'London', 'Berlin', 'Toronto', 'Sydney', '']
+POPULAR = ['Kyoto in Spring', 'Iceland Road Trip', 'Tokyo Food Tour', 'Paris Romantic Getaway']
+
+
+class Recorder:
+    """Latency samples and outcomes per operation, shared by all virtual users."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def time(self, operation):
+        start = time.perf_counter()
+        outcome = {'ok': True}
+        try:
+            yield outcome
+        except httpx.HTTPError:
+            outcome['ok'] = False
+        with self._lock:
+            self.samples[operation].append(time.perf_counter() - start)
+            if not outcome['ok']:
+                self.errors[operation] += 1
+
+    def add(self, operation, seconds):
+        with self._lock:
+            self.samples[operation].append(seconds)
+
+    def summary(self, elapsed):
+        rows = {}
+        for operation, samples in self.samples.items():
+            ordered = sorted(samples)
+            rows[operation] = {
+                'count': len(ordered),
+                'errors': self.errors[operation],
+                'per_second': round(len(ordered) / elapsed, 2),
+                'p50_ms': round(percentile(ordered, 0.50) * 1000, 1),
+                'p95_ms': round(percentile(ordered, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(ordered, 0.99) * 1000, 1),
+            }
+        return rows
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+def make_query(rng, repeat_rate):
+    if rng.random() < repeat_rate:
+        return rng.choice(POPULAR), ''
+    return f"{rng.choice(THEMES)} trip in {rng.choice(PLACES)} for {rng.randint(3, 21)} days", rng.choice(ORIGINS)
+
+
+def saved_strategy(rng, query):
+    lat, lon = rng.uniform(-50, 65), rng.uniform(-170, 170)
+    return {
+        'title': f"Saved: {query[:60]}",
+        'summary': f"Load test strategy for {query}",
+        'cost_breakdown': {'flights': '$900', 'lodging': '$600', 'food': '$300', 'total': '$1800', 'currency': 'USD'},
+        'itinerary': [{'day': 1, 'title': 'Arrival', 'activities': [{'name': 'Walk', 'type': 'other', 'description': 'Explore.'}]}],
+        'locations': [{'name': 'Somewhere', 'lat': lat, 'lon': lon}],
+        'critique': 'Feasibility: 7/10.',
+        'score': 7,
+    }
+
+
+def virtual_user(number, base_url, deadline, recorder, args, counts):
+    rng = random.Random(args.seed * 1000 + number if args.seed is not None else None)
+    with httpx.Client(base_url=base_url, timeout=args.request_timeout) as client:
+        email = f"load{number}@example.com"
+        client.post('/register', data={'username': f"load{number}", 'email': email, 'password': 'load-test'})
+        while time.monotonic() < deadline:
+            query, origin = make_query(rng, args.repeat_rate)
+            with recorder.time('POST /analyze') as outcome:
+                response = client.post('/analyze', data={'query': query, 'origin': origin},
+                                       headers={'Accept': 'application/json'})
+                outcome['ok'] = response.status_code == 202
+            if response.status_code == 429:
+                counts['rate_limited'] += 1
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+                continue
+            if response.status_code != 202:
+                continue
+            job = response.json()
+
+            submitted = time.perf_counter()
+            status = None
+            while time.monotonic() < deadline + args.drain:
+                status = client.get(job['status_url']).json()
+                if status['status'] in ('done', 'failed'):
+                    break
+                time.sleep(args.poll_interval)
+            counts[f"searches_{status['status'] if status else 'unknown'}"] += 1
+            if not status or status['status'] != 'done':
+                continue
+            recorder.add('search (submit -> done)', time.perf_counter() - submitted)
+
+            with recorder.time('GET /results/<id>') as outcome:
+                outcome['ok'] = client.get(job['results_url']).status_code == 200
+            with recorder.time('POST /save_strategy') as outcome:
+                outcome['ok'] = client.post('/save_strategy', json=saved_strategy(rng, query)).status_code == 200
+            with recorder.time('GET /profile') as outcome:
+                outcome['ok'] = client.get('/profile').status_code == 200
+            if args.think_time:
+                time.sleep(rng.expovariate(1 / args.think_time))
+
+
+def database_size(wanderly, path):
+    """Size of the database file once the WAL has been folded back into it."""
+    from sqlalchemy import text
+    with wanderly.app.app_context():
+        wanderly.db.session.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    return os.path.getsize(path)
+
+
+def table_counts(wanderly):
+    from sqlalchemy import text
+    with wanderly.app.app_context():
+        return {table: wanderly.db.session.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+                for table in ('search_history', 'saved_strategy', 'strategy_location')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=60, help="seconds of load; running searches then get --drain")
+    parser.add_argument('--drain', type=float, default=30)
+    parser.add_argument('--providers', default='gemini,openai,anthropic', help="LLM_PROVIDERS for the app")
+    parser.add_argument('--repeat-rate', type=float, default=0.1, help="share of searches for a few popular queries")
+    parser.add_argument('--think-time', type=float, default=0, help="mean pause between a user's searches")
+    parser.add_argument('--poll-interval', type=float, default=0.25)
+    parser.add_argument('--request-timeout', type=float, default=120)
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--verbose', action='store_true', help="show the app's own log lines")
+    fake_llm_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='wanderly-load-')
+    db_path = os.path.join(workdir, 'load.db')
+    os.environ.update({
+        'LLM_PROVIDERS': args.providers,
+        'DATABASE_URL': f"sqlite:///{db_path}",
+        # The test measures the pipeline, not the limits put in front of it
+        'ANALYZE_RATE_PER_MINUTE': '1000000',
+        'ANALYZE_BURST': '1000000',
+        'LLM_KEY_TOKENS_PER_MINUTE': '0',
+        'SEARCH_SUGGESTIONS': '0',
+    })
+    os.environ.pop('FAKE_LLM_KEY', None)
+    fake = fake_llm_server.FakeLLMServer(fake_llm_server.config_from_args(args)).start()
+    os.environ.update(fake.environment())
+
+    import app as wanderly
+    from cache import StrategyCache
+    from cost_analytics import CostStore
+    from migrations import upgrade_schema
+    from query_index import QueryIndex
+    from werkzeug.serving import make_server
+
+    # Keep the run's cache, index and /analytics store out of instance/
+    wanderly.strategy_cache = StrategyCache(os.path.join(workdir, 'strategy_cache.db'),
+                                            maxsize=wanderly.app.config['STRATEGY_CACHE_SIZE'],
+                                            ttl=wanderly.app.config['STRATEGY_CACHE_TTL_SECONDS'])
+    wanderly.query_index = QueryIndex(os.path.join(workdir, 'query_index'))
+    wanderly.cost_store = CostStore(os.path.join(workdir, 'cost_analytics'))
+    with wanderly.app.app_context():
+        upgrade_schema(wanderly.db)
+    server = make_server('127.0.0.1', 0, wanderly.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-app', daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    if not args.verbose:
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    size_before, rows_before = database_size(wanderly, db_path), table_counts(wanderly)
+    recorder, counts = Recorder(), Counter()
+    print(f"{args.users} users for {args.duration:.0f} s against {base_url}; fake LLM APIs at {fake.url} "
+          f"(latency {args.latency}, failures {args.failure_rate}, malformed {args.malformed_rate})")
+    start = time.monotonic()
+    deadline = start + args.duration
+    log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with log:
+        users = [threading.Thread(target=virtual_user, args=(i, base_url, deadline, recorder, args, counts))
+                 for i in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+    elapsed = time.monotonic() - start
+    server.shutdown()
+    fake.stop()
+
+    size_after, rows_after = database_size(wanderly, db_path), table_counts(wanderly)
+    searches = rows_after['search_history'] - rows_before['search_history']
+    results = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('json', 'verbose')},
+        'elapsed_seconds': round(elapsed, 1),
+        'operations': recorder.summary(elapsed),
+        'searches': dict(counts),
+        'fake_llm': dict(fake.stats),
+        'providers': wanderly.providers.stats_snapshot(),
+        'database': {
+            'bytes_before': size_before,
+            'bytes_after': size_after,
+            'bytes_per_search': round((size_after - size_before) / searches) if searches else None,
+            'rows_added': {table: rows_after[table] - rows_before[table] for table in rows_after},
+        },
+    }
+
+    print(f"\n{'operation':<26}{'count':>7}{'errors':>8}{'per s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for operation, row in results['operations'].items():
+        print(f"{operation:<26}{row['count']:>7}{row['errors']:>8}{row['per_second']:>8}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    done = counts['searches_done']
+    print(f"\nSearches: {done} done ({done / elapsed * 60:.1f}/min), {counts['searches_failed']} failed, "
+          f"{counts['searches_unknown']} unfinished, {counts['rate_limited']} rate limited")
+    print("Fake LLM: " + ', '.join(f"{key} {value}" for key, value in sorted(fake.stats.items())))
+    for name, stats in results['providers'].items():
+        if stats['attempts']:
+            print(f"Provider {name}: {stats['attempts']} attempts, {stats['wins']} wins, {stats['failures']} failures, "
+                  f"avg {stats['avg_latency']} s")
+    database = results['database']
+    print(f"Database: {database['bytes_before'] / 1e6:.2f} -> {database['bytes_after'] / 1e6:.2f} MB "
+          f"({database['bytes_per_search']} bytes per search), rows added {database['rows_added']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Hammers SearchHistory with parallel writers and counts "database is locked" errors.
+
+Each writer thread mimics an analysis job. It inserts a queued row, updates its
+status and progress a few times, then stores a results blob, committing after
+every step. Reader threads page through the history at the same time, the way
+profile and results views do. Run it with the defaults to exercise the WAL/busy-timeout config, and
+with --legacy to reproduce the old settings: a rollback journal, synchronous=FULL and
+only sqlite3's default 5s lock wait.
+
+Usage: python benchmarks/stress_db_writers.py [--writers 16] [--jobs 50] [--legacy]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--jobs', type=int, default=50, help='jobs per writer')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--legacy', action='store_true', help='SQLite defaults, as before dbconfig')
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix='wanderly-stress-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(db_dir, 'stress.db')}"
+    if args.legacy:
+        os.environ.update(SQLITE_JOURNAL_MODE='DELETE', SQLITE_SYNCHRONOUS='FULL', SQLITE_MMAP_SIZE='0',
+                          SQLITE_CACHE_SIZE_KB='2000')
+
+    from sqlalchemy.exc import OperationalError
+    from werkzeug.security import generate_password_hash
+    import app as wanderly
+
+    app, db = wanderly.app, wanderly.db
+    with app.app_context():
+        db.create_all()
+        user = wanderly.User(username='stress', email='stress@example.com', password=generate_password_hash('x'))
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        mode = db.session.execute(db.text("PRAGMA journal_mode")).scalar()
+
+    results = json.dumps(wanderly.mock_generation())
+    errors = {'locked': 0, 'other': 0}
+    lock = threading.Lock()
+    latencies = []
+
+    def writer(n):
+        with app.app_context():
+            for i in range(args.jobs):
+                start = time.perf_counter()
+                try:
+                    row = wanderly.SearchHistory(search_query=f"writer {n} job {i}", user_id=user_id, status='queued')
+                    db.session.add(row)
+                    db.session.commit()
+                    for step in ('running', 'Generating...', 'Critiquing...'):
+                        row.status, row.progress = 'running', step
+                        db.session.commit()
+                    row.status, row.results = 'done', results
+                    db.session.commit()
+                except OperationalError as e:
+                    db.session.rollback()
+                    with lock:
+                        errors['locked' if 'locked' in str(e) else 'other'] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+    stop = threading.Event()
+    reads = [0]
+
+    def reader():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    wanderly.SearchHistory.query.filter_by(user_id=user_id) \
+                        .order_by(wanderly.SearchHistory.timestamp.desc()).limit(50).all()
+                    db.session.commit()
+                except OperationalError as e:
+                    db.session.rollback()
+                    with lock:
+                        errors['locked' if 'locked' in str(e) else 'other'] += 1
+                    continue
+                with lock:
+                    reads[0] += 1
+
+    readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+    start = time.perf_counter()
+    for thread in readers + threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    latencies.sort()
+    total = args.writers * args.jobs
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else float('nan')
+    print(f"journal_mode={mode}  writers={args.writers}  jobs={total}  elapsed={elapsed:.2f}s")
+    print(f"completed={len(latencies)}  locked={errors['locked']}  other_errors={errors['other']}  "
+          f"p50={p(0.5):.1f}ms  p99={p(0.99):.1f}ms  ({len(latencies) * 5 / elapsed:.0f} commits/s, "
+          f"{reads[0] / elapsed:.0f} reads/s)")
+    if errors['locked'] and not args.legacy:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
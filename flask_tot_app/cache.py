@@ -0,0 +1,178 @@
+"""In-process caches for LLM results.
+
+`TTLCache` is a small thread-safe LRU map with per-entry expiry; critiques are
+memoized in one keyed on `strategy_fingerprint()`. `StrategyCache` puts one in
+front of a SQLite file so generated strategies survive restarts.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from dbconfig import apply_sqlite_pragmas
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire `ttl` seconds after they are stored."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+def normalize_query(problem):
+    """Folds case, Unicode forms, punctuation and whitespace so near-identical queries share a key."""
+    text = unicodedata.normalize('NFKC', problem or '').casefold()
+    text = re.sub(r'[^\w\s()$&-]', ' ', text)
+    return ' '.join(text.split())
+
+
+def query_key(problem):
+    return hashlib.sha256(normalize_query(problem).encode()).hexdigest()
+
+
+# Fields written by the critic; they don't change what the strategy says
+CRITIQUE_FIELDS = ('critique', 'score')
+
+
+def strategy_fingerprint(strategy):
+    """Content hash of a strategy: canonical JSON with sorted keys, critique and score left out."""
+    content = {k: v for k, v in strategy.items() if k not in CRITIQUE_FIELDS}
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class StrategyCache:
+    """Two-tier cache of critiqued strategy lists keyed on the normalized problem string.
+
+    Values are stored as JSON text in both tiers, so every hit hands the caller a fresh
+    copy it can sort and annotate freely.
+    """
+
+    def __init__(self, db_path, maxsize=256, ttl=24 * 3600, max_rows=10000):
+        self.memory = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.db_path = db_path
+        self.disk_hits = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS strategy_cache ("
+                " key TEXT PRIMARY KEY, query TEXT NOT NULL, results TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared across threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            apply_sqlite_pragmas(conn)
+            self._local.conn = conn
+        return conn
+
+    def get(self, problem):
+        """Returns the cached JSON text for `problem`, or None."""
+        key = query_key(problem)
+        results = self.memory.get(key)
+        if results is not None:
+            return results
+        now = time.time()
+        row = self._connect().execute(
+            "SELECT results, expires_at FROM strategy_cache WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        self.disk_hits += 1
+        self.memory.set(key, row[0], ttl=row[1] - now)
+        return row[0]
+
+    def set(self, problem, results):
+        key = query_key(problem)
+        self.memory.set(key, results)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO strategy_cache (key, query, results, expires_at) VALUES (?, ?, ?, ?)",
+                (key, normalize_query(problem), results, time.time() + self.ttl),
+            )
+            conn.execute("DELETE FROM strategy_cache WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM strategy_cache WHERE key IN ("
+                " SELECT key FROM strategy_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            )
+
+    def invalidate(self, problem):
+        key = query_key(problem)
+        self.memory.pop(key)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM strategy_cache WHERE key = ?", (key,))
+
+    def stats(self):
+        stats = self.memory.stats()
+        # A memory miss that was answered from SQLite is still a cache hit
+        stats['memory_hits'] = stats['hits']
+        stats['disk_hits'] = self.disk_hits
+        stats['hits'] += self.disk_hits
+        stats['misses'] -= self.disk_hits
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['disk_rows'] = self._connect().execute("SELECT COUNT(*) FROM strategy_cache").fetchone()[0]
+        return stats
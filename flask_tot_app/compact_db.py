@@ -0,0 +1,100 @@
+"""Retention and compaction for search history.
+
+Compresses any payloads still stored as plain text. Then it drops the stored results
+of searches older than --expire-days (the search itself stays in the history), and
+deletes searches older than --delete-days or beyond each user's newest --keep-per-user.
+The near-duplicate query index is rebuilt without the deleted searches.
+Finally it VACUUMs SQLite so the freed pages go back to the filesystem.
+
+Usage: python compact_db.py [--expire-days 90] [--delete-days N] [--keep-per-user N] [--no-vacuum] [--dry-run]
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+import search_index
+from factory import create_app
+from migrations import compress_legacy_text
+from models import SearchHistory, db
+from query_index import QueryIndex
+
+
+def database_size():
+    path = db.engine.url.database if db.engine.dialect.name == 'sqlite' else None
+    if not path or not os.path.exists(path):
+        return None
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--expire-days', type=int, default=90, help='clear stored results of older searches')
+    parser.add_argument('--delete-days', type=int, default=None, help='delete searches older than this')
+    parser.add_argument('--keep-per-user', type=int, default=None, help='delete all but the newest N searches per user')
+    parser.add_argument('--no-vacuum', action='store_true')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    # Only the models are needed here, not the web app and the provider SDKs behind it
+    app = create_app()
+    with app.app_context():
+        size_before = database_size()
+        # Queued or running searches are never touched
+        finished = SearchHistory.status.is_(None) | SearchHistory.status.in_(('done', 'failed'))
+
+        if not args.dry_run:
+            print(f"Compressed {compress_legacy_text(db)} plain-text payloads")
+
+        expire = SearchHistory.query.filter(
+            finished,
+            SearchHistory.results.isnot(None),
+            SearchHistory.timestamp < datetime.utcnow() - timedelta(days=args.expire_days),
+        )
+        print(f"Clearing results of {expire.count()} searches older than {args.expire_days} days")
+        if not args.dry_run:
+            expire.update({SearchHistory.results: None, SearchHistory.search_tree: None}, synchronize_session=False)
+
+        if args.delete_days is not None:
+            old = SearchHistory.query.filter(
+                finished, SearchHistory.timestamp < datetime.utcnow() - timedelta(days=args.delete_days)
+            )
+            print(f"Deleting {old.count()} searches older than {args.delete_days} days")
+            if not args.dry_run:
+                old.delete(synchronize_session=False)
+
+        if args.keep_per_user is not None:
+            rank = func.row_number().over(
+                partition_by=SearchHistory.user_id,
+                order_by=(SearchHistory.timestamp.desc(), SearchHistory.id.desc()),
+            ).label('rank')
+            ranked = db.session.query(SearchHistory.id, rank).filter(finished).subquery()
+            surplus = db.session.query(ranked.c.id).filter(ranked.c.rank > args.keep_per_user)
+            doomed = SearchHistory.query.filter(SearchHistory.id.in_(surplus))
+            print(f"Deleting {doomed.count()} searches beyond the newest {args.keep_per_user} per user")
+            if not args.dry_run:
+                doomed.delete(synchronize_session=False)
+
+        if args.dry_run:
+            db.session.rollback()
+            return
+        # The bulk statements above bypass the ORM hooks that maintain the full-text index
+        search_index.prune(db.session.connection())
+        db.session.commit()
+        rows = db.session.query(SearchHistory.id, SearchHistory.user_id, SearchHistory.search_query).yield_per(10000)
+        # The same files app.py opens its index from
+        query_index = QueryIndex(os.path.join(app.instance_path, 'query_index'))
+        print(f"Rebuilt the near-duplicate index over {query_index.rebuild(rows)} searches")
+
+        if not args.no_vacuum and db.engine.dialect.name == 'sqlite':
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+                conn.exec_driver_sql('VACUUM')
+        size_after = database_size()
+        if size_before is not None and size_after is not None:
+            print(f"Database size: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+"""Columnar store of the cost breakdowns in past search results, for /analytics.
+
+Every strategy of a finished search becomes one row: search id, user id, position,
+score, days, a currency code, a destination code and one float column per cost
+category. LLM cost strings ("$2,600", "1.2k EUR") are parsed once, with
+strategy_rows.parse_cost_amount, when the search is ingested; missing amounts are
+NaN. Spend distributions, per-destination averages and outliers are then NumPy
+reductions over boolean masks, with no JSON or SQL per request.
+
+The store remembers the highest search id it has seen and the ids below it that were
+still running, so each refresh only reads new or newly finished searches. It is saved
+as an .npz snapshot every `save_every` new rows; rows after the last snapshot are read
+again on the next start. Searches that compact_db.py clears or deletes keep their
+rows here, so old spend stays in the aggregates.
+"""
+import json
+import math
+import os
+import re
+import threading
+
+import numpy as np
+
+from strategy_rows import COST_CATEGORIES, parse_cost_amount, strategy_summary_fields
+
+# The itemized categories; 'total' is the LLM's own total, or their sum when it gave none
+PARTS = tuple(category for category in COST_CATEGORIES if category != 'total')
+PART_ROWS = [COST_CATEGORIES.index(part) for part in PARTS]
+TOTAL = COST_CATEGORIES.index('total')
+PERCENTILES = (10, 25, 50, 75, 90)
+UNKNOWN = -1
+# Summaries memoized per set of arguments, until new rows arrive
+MAX_SUMMARIES = 64
+# Running searches remembered for a later refresh; jobs that never finish shouldn't grow this forever
+MAX_PENDING = 10000
+
+CURRENCY_SYMBOLS = {'$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'JPY', '₹': 'INR', '₩': 'KRW', '฿': 'THB'}
+_CODE = re.compile(r'\b([A-Z]{3})\b')
+
+COLUMNS = {
+    'search_id': np.int64,
+    'user_id': np.int64,
+    'position': np.int16,
+    'score': np.float32,
+    'days': np.int16,
+    'currency': np.int16,
+    'destination': np.int32,
+    # Derived when the row is parsed, so /analytics doesn't redo them per request
+    'log_per_day': np.float32,  # log(total / days); NaN without a positive total and days
+    'mismatch': np.bool_,  # every item priced, and their sum is off the total by more than half
+}
+# How far the items may sum from the stated total before the total counts as made up
+MISMATCH_RATIO = 0.5
+
+
+def currency_of(costs):
+    """ISO-like currency code of a cost_breakdown: its 'currency' field, else a symbol or code in the amounts."""
+    code = costs.get('currency')
+    if isinstance(code, str) and code.strip():
+        code = code.strip()
+        return CURRENCY_SYMBOLS.get(code, code.upper()[:10])
+    for value in costs.values():
+        if isinstance(value, str):
+            for symbol, symbol_code in CURRENCY_SYMBOLS.items():
+                if symbol in value:
+                    return symbol_code
+            match = _CODE.search(value)
+            if match:
+                return match.group(1)
+    return None
+
+
+def quantiles(values, percentiles=PERCENTILES):
+    """np.percentile's (linear) percentiles of `values`, or Nones when empty.
+
+    Sorting is several times faster here than np.percentile, whose partition doesn't
+    vectorize across more than one kth.
+    """
+    if not len(values):
+        return [None] * len(percentiles)
+    values = np.sort(values).astype(np.float64)
+    positions = np.asarray(percentiles) / 100 * (len(values) - 1)
+    low = np.floor(positions).astype(np.int64)
+    high = np.minimum(low + 1, len(values) - 1)
+    return (values[low] + (values[high] - values[low]) * (positions - low)).tolist()
+
+
+def destination_of(name):
+    """The city part of a location name: "Kyoto, Japan" -> "Kyoto"."""
+    if not name:
+        return None
+    return name.split(',')[0].strip() or None
+
+
+def strategy_row(strategy):
+    """Parsed values of one strategy dict, or None when it has no readable costs."""
+    costs = strategy.get('cost_breakdown')
+    if not isinstance(costs, dict):
+        return None
+    amounts = [parse_cost_amount(costs.get(category)) for category in COST_CATEGORIES]
+    fields = strategy_summary_fields(strategy)
+    amounts[TOTAL] = fields['total_cost']
+    if all(amount is None for amount in amounts):
+        return None
+    total, days = amounts[TOTAL], min(fields['num_days'], np.iinfo(np.int16).max)
+    parts = [amounts[row] for row in PART_ROWS]
+    score = strategy.get('score')
+    return {
+        'score': float(score) if isinstance(score, (int, float)) and not isinstance(score, bool) else np.nan,
+        'days': days,
+        'currency': currency_of(costs),
+        'destination': destination_of(fields['primary_location']),
+        'log_per_day': math.log(total / days) if total and total > 0 and days > 0 else np.nan,
+        'mismatch': bool(total and None not in parts and abs(total - sum(parts)) > MISMATCH_RATIO * total),
+        'costs': [np.nan if amount is None else amount for amount in amounts],
+    }
+
+
+class Vocabulary:
+    """Strings <-> small integer codes. Destinations match case-insensitively and keep their first spelling."""
+
+    def __init__(self, names=()):
+        self.names = list(names)
+        self._codes = {name.casefold(): code for code, name in enumerate(self.names)}
+
+    def code(self, name):
+        if name is None:
+            return UNKNOWN
+        key = name.casefold()
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def lookup(self, name):
+        return self._codes.get(name.casefold(), UNKNOWN) if name else UNKNOWN
+
+    def __len__(self):
+        return len(self.names)
+
+
+class CostStore:
+    """Cost rows of past searches, appended as searches finish. Thread-safe.
+
+    `path` is a prefix; the snapshot is `path + '.npz'`. Nothing is read from disk
+    until the first call.
+    """
+
+    def __init__(self, path, save_every=20000):
+        self.path = path
+        self.save_every = save_every
+        self._lock = threading.Lock()
+        self._loaded = False
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    @property
+    def snapshot_path(self):
+        return self.path + '.npz'
+
+    def _reset(self):
+        self._size = 0
+        self._columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        # One row per category, so each category's amounts are contiguous
+        self._costs = np.zeros((len(COST_CATEGORIES), 0), dtype=np.float32)
+        self._capacity = 0
+        self._currencies = Vocabulary()
+        self._destinations = Vocabulary()
+        self._watermark = 0
+        self._pending = set()
+        self._unsaved = 0
+        self._summaries = {}
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._reset()
+        if os.path.exists(self.snapshot_path):
+            with np.load(self.snapshot_path) as snapshot:
+                self._columns = {name: snapshot[name] for name in COLUMNS}
+                self._costs = snapshot['costs']
+                self._currencies = Vocabulary(snapshot['currencies'].tolist())
+                self._destinations = Vocabulary(snapshot['destinations'].tolist())
+                self._watermark = int(snapshot['watermark'])
+                self._pending = set(snapshot['pending'].tolist())
+            self._size = self._capacity = self._costs.shape[1]
+        self._loaded = True
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return self._size
+
+    def cursor(self):
+        """(highest search id ingested, ids at or below it that were still running) for the next refresh."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._watermark, sorted(self._pending)
+
+    def ingest(self, rows):
+        """Adds searches given as (search id, user id, status, results JSON). Returns the number of strategy rows added.
+
+        Queued and running searches are remembered and read again by a later refresh.
+        """
+        batch = []
+        with self._lock:
+            self._ensure_loaded()
+            for search_id, user_id, status, results in rows:
+                self._watermark = max(self._watermark, search_id)
+                if status in ('queued', 'running'):
+                    self._pending.add(search_id)
+                    continue
+                self._pending.discard(search_id)
+                try:
+                    strategies = json.loads(results) if results else []
+                except (TypeError, ValueError):
+                    continue
+                for position, strategy in enumerate(strategies if isinstance(strategies, list) else []):
+                    row = strategy_row(strategy) if isinstance(strategy, dict) else None
+                    if row is not None:
+                        row.update(search_id=search_id, user_id=user_id, position=position,
+                                   currency=self._currencies.code(row['currency']),
+                                   destination=self._destinations.code(row['destination']))
+                        batch.append(row)
+            if len(self._pending) > MAX_PENDING:
+                self._pending = set(sorted(self._pending)[-MAX_PENDING:])
+            if batch:
+                self._append(batch)
+                self._summaries.clear()
+            self._unsaved += len(batch)
+            if self._unsaved >= self.save_every:
+                self._save()
+        return len(batch)
+
+    def _append(self, batch):
+        end = self._size + len(batch)
+        if end > self._capacity:
+            # Doubling keeps appends amortized O(1). Rows are only ever written past `_size`,
+            # so summaries holding views of the old arrays outside the lock stay consistent.
+            self._capacity = max(end, 2 * self._capacity, 1024)
+            self._columns = {name: self._grown(column) for name, column in self._columns.items()}
+            self._costs = self._grown(self._costs)
+        for name, dtype in COLUMNS.items():
+            self._columns[name][self._size:end] = np.array([row[name] for row in batch], dtype=dtype)
+        self._costs[:, self._size:end] = np.array([row['costs'] for row in batch], dtype=np.float32).T
+        self._size = end
+
+    def _grown(self, array):
+        grown = np.zeros(array.shape[:-1] + (self._capacity,), dtype=array.dtype)
+        grown[..., :self._size] = array[..., :self._size]
+        return grown
+
+    def _save(self):
+        temp_path = self.path + '.tmp.npz'
+        np.savez(temp_path, costs=self._costs[:, :self._size], watermark=self._watermark,
+                 pending=np.array(sorted(self._pending), dtype=np.int64),
+                 currencies=np.array(self._currencies.names, dtype=str),
+                 destinations=np.array(self._destinations.names, dtype=str),
+                 **{name: column[:self._size] for name, column in self._columns.items()})
+        os.replace(temp_path, self.snapshot_path)
+        self._unsaved = 0
+
+    def save(self):
+        with self._lock:
+            self._ensure_loaded()
+            self._save()
+
+    def summary(self, user_id=None, currency=None, destinations=10, min_count=3, outlier_z=3.5,
+                outliers=20, outliers_user_id=None):
+        """Spend distributions, destination averages and budget outliers, as a JSON-ready dict.
+
+        Covers one user's rows, or everyone's when `user_id` is None, in one currency
+        (the most common one when not given), since amounts in different currencies
+        can't be compared. Outliers are listed only for `outliers_user_id`, so global
+        statistics never name another user's searches. Results are reused until new
+        rows arrive.
+        """
+        key = (user_id, currency, destinations, min_count, outlier_z, outliers, outliers_user_id)
+        with self._lock:
+            self._ensure_loaded()
+            if key in self._summaries:
+                return self._summaries[key]
+            size = self._size
+            columns = {name: column[:size] for name, column in self._columns.items()}
+            costs = self._costs[:, :size]
+            currency_names = list(self._currencies.names)
+            destination_names = list(self._destinations.names)
+
+        scope = None if user_id is None else columns['user_id'] == user_id
+        codes = columns['currency'] if scope is None else columns['currency'][scope]
+        counts = np.bincount(codes[codes != UNKNOWN], minlength=len(currency_names))
+        by_currency = {currency_names[code]: int(counts[code]) for code in np.argsort(-counts, kind='stable') if counts[code]}
+        chosen = currency if currency is not None else next(iter(by_currency), None)
+        mask = columns['currency'] == Vocabulary(currency_names).lookup(chosen)
+        if scope is not None:
+            mask &= scope
+        rows = np.flatnonzero(mask)
+        block = costs[:, rows]
+
+        categories, spend = {}, {}
+        for index, category in enumerate(COST_CATEGORIES):
+            values = block[index]
+            values = values[~np.isnan(values)]
+            spend[category] = float(values.sum(dtype=np.float64))
+            entry = {'count': int(len(values)), 'mean': round(spend[category] / len(values), 2) if len(values) else None}
+            entry.update({f"p{q}": None if p is None else round(p, 2) for q, p in zip(PERCENTILES, quantiles(values))})
+            categories[category] = entry
+        # Where the itemized money goes, over all strategies together
+        itemized = sum(spend[part] for part in PARTS)
+        share = {part: round(spend[part] / itemized, 3) if itemized else None for part in PARTS}
+
+        result = {
+            'currency': chosen,
+            'currencies': by_currency,
+            'strategies': int(len(rows)),
+            'categories': categories,
+            'share': share,
+            'destinations': self._destination_averages(
+                columns['destination'][rows], block[TOTAL], columns['days'][rows], destination_names,
+                destinations, min_count),
+            'outliers': self._outliers(rows, columns, block[TOTAL], destination_names, outlier_z, outliers,
+                                       outliers_user_id),
+        }
+        with self._lock:
+            if self._size == size:
+                if len(self._summaries) >= MAX_SUMMARIES:
+                    self._summaries.clear()
+                self._summaries[key] = result
+        return result
+
+    @staticmethod
+    def _destination_averages(codes, total, days, names, limit, min_count):
+        keep = (total > 0) & (codes != UNKNOWN)  # False for a NaN total too
+        codes, total, days = codes[keep], total[keep], days[keep]
+        counts = np.bincount(codes, minlength=len(names))
+        sums = np.bincount(codes, weights=total, minlength=len(names))
+        day_sums = np.bincount(codes, weights=days, minlength=len(names))
+        top = [code for code in np.argsort(-counts, kind='stable')[:limit] if counts[code] >= min_count]
+        return [{
+            'name': names[code],
+            'count': int(counts[code]),
+            'avg_total': round(float(sums[code] / counts[code]), 2),
+            'avg_per_day': round(float(sums[code] / day_sums[code]), 2) if day_sums[code] else None,
+        } for code in top]
+
+    @staticmethod
+    def _outliers(rows, columns, total, names, threshold, limit, user_id):
+        """Strategies whose cost per day is far from the rest (robust z-score of its log), or whose total disagrees with its items."""
+        logs = columns['log_per_day'][rows]
+        usable = ~np.isnan(logs)
+        z = np.zeros(len(rows), dtype=np.float32)
+        if usable.sum() >= 10:
+            median = quantiles(logs[usable], (50,))[0]
+            # 1.4826 * MAD estimates the standard deviation of normally distributed data
+            mad = 1.4826 * quantiles(np.abs(logs[usable] - median), (50,))[0]
+            if mad > 0:
+                z = np.nan_to_num((logs - median) / mad)
+        extreme = np.abs(z) > threshold
+        flagged = extreme | columns['mismatch'][rows]
+        listed = flagged if user_id is None else flagged & (columns['user_id'][rows] == user_id)
+        order = np.flatnonzero(listed)
+        order = order[np.argsort(-np.abs(z[order]), kind='stable')][:limit]
+        return {
+            'count': int(flagged.sum()),
+            'z_threshold': threshold,
+            'strategies': [{
+                'search_id': int(columns['search_id'][rows[i]]),
+                'position': int(columns['position'][rows[i]]),
+                'destination': names[columns['destination'][rows[i]]] if columns['destination'][rows[i]] != UNKNOWN else None,
+                'total': None if np.isnan(total[i]) else round(float(total[i]), 2),
+                'days': int(columns['days'][rows[i]]),
+                'per_day': None if np.isnan(logs[i]) else round(math.exp(float(logs[i])), 2),
+                'z': round(float(z[i]), 2),
+                'reason': 'cost per day far from typical' if extreme[i] else 'total disagrees with its items',
+            } for i in order],
+        }
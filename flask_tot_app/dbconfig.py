@@ -0,0 +1,83 @@
+"""Database configuration shared by the app, reset_db.py and the benchmarks.
+
+The URI comes from DATABASE_URL (default: SQLite `site.db` in the instance
+folder). SQLite connections get WAL journaling, `synchronous=NORMAL`, a busy
+timeout, memory-mapped I/O and a larger page cache, so concurrent analysis jobs
+writing SearchHistory wait for each other instead of failing with "database is
+locked". Other databases, such as Postgres, get the SQLAlchemy pool options.
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URI = 'sqlite:///site.db'
+
+
+def database_uri():
+    return os.getenv('DATABASE_URL', DEFAULT_DATABASE_URI)
+
+
+def sqlite_pragmas():
+    """PRAGMA name -> value applied to every new SQLite connection."""
+    return {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+        # Negative values are KiB rather than pages
+        'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', str(64 * 1024))),
+        'temp_store': 'MEMORY',
+    }
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas=None):
+    """Runs the PRAGMAs on a raw sqlite3 connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in (pragmas or sqlite_pragmas()).items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`."""
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return {}
+        busy_seconds = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')) / 1000
+        return {
+            # sqlite3's own lock wait also covers the BEGIN that starts each transaction
+            'connect_args': {'timeout': busy_seconds},
+            'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+            'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+        }
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': True,
+    }
+
+
+def configure_app(app):
+    """Sets the SQLAlchemy URI and engine options on `app`; call before SQLAlchemy(app)."""
+    uri = database_uri()
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+
+
+def install_sqlite_pragmas(engine):
+    """Applies the PRAGMAs to each connection `engine` opens. No-op for other databases."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas()
+    event.listen(engine, 'connect', lambda dbapi_connection, _: apply_sqlite_pragmas(dbapi_connection, pragmas))
@@ -0,0 +1,53 @@
+"""Custom column types.
+
+`CompressedText` stores a text payload (in practice a JSON document) as a BLOB
+with a one-byte format header, followed by zlib data or plain UTF-8. Reads give
+back the original string, so models and views keep using json.dumps/json.loads.
+Rows written before the column was compressed are still TEXT and are returned
+unchanged, which lets the migration convert a live table in batches.
+"""
+import zlib
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+FORMAT_PLAIN = b'\x00'
+FORMAT_ZLIB = b'\x01'
+
+# Below this size the zlib header costs more than it saves
+MIN_COMPRESS_BYTES = 128
+ZLIB_LEVEL = 6
+
+
+def pack_text(value):
+    """Encodes a string as a versioned, possibly compressed BLOB."""
+    data = value.encode('utf-8')
+    if len(data) >= MIN_COMPRESS_BYTES:
+        compressed = zlib.compress(data, ZLIB_LEVEL)
+        if len(compressed) < len(data):
+            return FORMAT_ZLIB + compressed
+    return FORMAT_PLAIN + data
+
+
+def unpack_text(value):
+    """Decodes what `pack_text` produced. Legacy TEXT values pass through unchanged."""
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    header, body = value[:1], value[1:]
+    if header == FORMAT_ZLIB:
+        return zlib.decompress(body).decode('utf-8')
+    if header == FORMAT_PLAIN:
+        return body.decode('utf-8')
+    raise ValueError(f"Unknown compressed text format {header!r}")
+
+
+class CompressedText(TypeDecorator):
+    """Text column stored as a compressed BLOB; see the module docstring."""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else pack_text(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else unpack_text(value)
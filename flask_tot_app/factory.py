@@ -0,0 +1,95 @@
+"""App factory: a Flask app with its configuration and the database bound.
+
+`create_app()` is cheap. It reads the environment, binds `models.db` and marks
+searches orphaned by a restart as failed, and does nothing else. Routes, login,
+tracing and the caches and job queue behind them are set up by app.py on top of
+it. Scripts that only need the database (reset_db.py, migrations.py,
+compact_db.py) call `create_app()` directly and start in a fraction of the time
+(benchmarks/bench_startup.py).
+"""
+import os
+
+from dotenv import load_dotenv
+from flask import Flask
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+import dbconfig
+from models import db, fail_orphaned_searches
+
+
+def create_app():
+    load_dotenv()
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
+    # DATABASE_URL, SQLite pragmas and pool options; see dbconfig.py
+    dbconfig.configure_app(app)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Critique stage: 'parallel' sends all critiques at once, 'batch' scores every strategy in one
+    # call, 'sequential' is the original loop
+    app.config['CRITIQUE_MODE'] = os.getenv('CRITIQUE_MODE', 'parallel')
+    app.config['CRITIQUE_MAX_WORKERS'] = int(os.getenv('CRITIQUE_MAX_WORKERS', '8'))
+    # Generation: 'fallback' tries providers one after another, 'race' hedges to the next provider
+    app.config['GENERATION_MODE'] = os.getenv('GENERATION_MODE', 'fallback')
+    app.config['HEDGE_DELAY_SECONDS'] = float(os.getenv('HEDGE_DELAY_SECONDS', '4'))
+    # Stream generation responses and hand each strategy on as soon as it is parsed (fallback mode only)
+    app.config['GENERATION_STREAMING'] = os.getenv('GENERATION_STREAMING', '1') == '1'
+    # Cache of critiqued strategies keyed on the normalized problem string
+    app.config['STRATEGY_CACHE_TTL_SECONDS'] = int(os.getenv('STRATEGY_CACHE_TTL_SECONDS', str(24 * 3600)))
+    app.config['STRATEGY_CACHE_SIZE'] = int(os.getenv('STRATEGY_CACHE_SIZE', '256'))
+    app.config['STRATEGY_CACHE_PREWARM'] = os.getenv('STRATEGY_CACHE_PREWARM', '0') == '1'
+    # Critiques memoized by strategy content hash
+    app.config['CRITIQUE_CACHE_TTL_SECONDS'] = int(os.getenv('CRITIQUE_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+    app.config['CRITIQUE_CACHE_SIZE'] = int(os.getenv('CRITIQUE_CACHE_SIZE', '2048'))
+    # Decrypted per-user provider keys, kept briefly so each search doesn't repeat Fernet decryption
+    app.config['API_KEY_CACHE_TTL_SECONDS'] = int(os.getenv('API_KEY_CACHE_TTL_SECONDS', '300'))
+    app.config['API_KEY_CACHE_SIZE'] = int(os.getenv('API_KEY_CACHE_SIZE', '1024'))
+    # Rendered results and strategy pages, revalidated by browsers with ETags; 0 keeps ETags but skips the cache
+    app.config['PAGE_CACHE_SIZE'] = int(os.getenv('PAGE_CACHE_SIZE', '512'))
+    app.config['PAGE_CACHE_TTL_SECONDS'] = int(os.getenv('PAGE_CACHE_TTL_SECONDS', '3600'))
+    # Background analysis jobs: /analyze enqueues and returns immediately unless ANALYZE_QUEUE=0
+    app.config['ANALYZE_QUEUE'] = os.getenv('ANALYZE_QUEUE', '1') == '1'
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', '4'))
+    app.config['JOB_MAX_RUNNING_PER_USER'] = int(os.getenv('JOB_MAX_RUNNING_PER_USER', '1'))
+    app.config['JOB_MAX_QUEUED_PER_USER'] = int(os.getenv('JOB_MAX_QUEUED_PER_USER', '5'))
+    app.config['JOB_MAX_RETRIES'] = int(os.getenv('JOB_MAX_RETRIES', '2'))
+    app.config['JOB_RETRY_BACKOFF_SECONDS'] = float(os.getenv('JOB_RETRY_BACKOFF_SECONDS', '2'))
+    # Searches still queued or running this long after they started lost their job to a restart
+    app.config['JOB_ORPHAN_SECONDS'] = int(os.getenv('JOB_ORPHAN_SECONDS', '3600'))
+    # Rows per page of the profile's search history and saved strategies
+    app.config['PROFILE_HISTORY_PAGE_SIZE'] = int(os.getenv('PROFILE_HISTORY_PAGE_SIZE', '10'))
+    app.config['PROFILE_SAVED_PAGE_SIZE'] = int(os.getenv('PROFILE_SAVED_PAGE_SIZE', '24'))
+    # Offer the user's own earlier results for a near-identical search before calling an LLM
+    app.config['SEARCH_SUGGESTIONS'] = os.getenv('SEARCH_SUGGESTIONS', '1') == '1'
+    app.config['SEARCH_SUGGESTION_MIN_OVERLAP'] = float(os.getenv('SEARCH_SUGGESTION_MIN_OVERLAP', '0.8'))
+    # Estimated shingle similarity above which a reworded search counts as the same trip (query_index.py)
+    app.config['SIMILAR_SEARCH_THRESHOLD'] = float(os.getenv('SIMILAR_SEARCH_THRESHOLD', '0.5'))
+    # Wall-clock budget for one /analyze request, in seconds
+    app.config['ANALYZE_DEADLINE_SECONDS'] = float(os.getenv('ANALYZE_DEADLINE_SECONDS', '90'))
+    # Tree-of-Thoughts search (tot_search.py): levels of refinement after the first critiques (0, the default,
+    # turns it off), strategies refined per level and variants asked for each; a search request may set its own
+    app.config['TOT_DEPTH'] = int(os.getenv('TOT_DEPTH', '0'))
+    app.config['TOT_BEAM_WIDTH'] = int(os.getenv('TOT_BEAM_WIDTH', '2'))
+    app.config['TOT_BRANCHING'] = int(os.getenv('TOT_BRANCHING', '2'))
+    # LLM calls and tokens one search may spend, first generation and critiques included; requests may only lower them
+    app.config['TOT_MAX_CALLS'] = int(os.getenv('TOT_MAX_CALLS', '20'))
+    app.config['TOT_MAX_TOKENS'] = int(os.getenv('TOT_MAX_TOKENS', '60000'))
+    # Score points a refinement is assumed to gain at most; branches that can't catch up with the best are pruned
+    app.config['TOT_PRUNE_MARGIN'] = float(os.getenv('TOT_PRUNE_MARGIN', '1.5'))
+    # Comma-separated usernames allowed on the operator endpoints, which show every user's keys and searches
+    app.config['OPERATOR_USERNAMES'] = {name.strip() for name in os.getenv('OPERATOR_USERNAMES', '').split(',') if name.strip()}
+    # Bearer token a scraper must send to /metrics; unset, only requests from this machine are answered
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+
+    db.init_app(app)
+    with app.app_context():
+        dbconfig.install_sqlite_pragmas(db.engine)
+        try:
+            orphaned = fail_orphaned_searches(app.config['JOB_ORPHAN_SECONDS'])
+        except (OperationalError, ProgrammingError):
+            # A new database whose tables haven't been created (or upgraded) yet
+            db.session.rollback()
+        else:
+            if orphaned:
+                print(f"Marked {orphaned} searches interrupted by a restart as failed")
+    return app
@@ -0,0 +1,150 @@
+"""Geohash cells, haversine distances and map clustering for strategy locations.
+
+Each StrategyLocation row stores the geohash of its coordinates in an indexed
+column, so nearby points share a prefix. A radius or bounding-box query becomes
+a few prefix range scans over that index (`covering_cells()`, `cell_ranges()`),
+followed by an exact, vectorized haversine filter over the rows they return.
+Map clusters are the points grouped by a geohash prefix sized for the zoom level.
+"""
+import math
+
+import numpy as np
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9  # ~5 m cells; coarser prefixes of the same string are the larger cells
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Sorts after every BASE32 character, so [prefix, prefix + PREFIX_END) is the whole cell
+PREFIX_END = '~'
+
+
+def is_valid(lat, lon):
+    return lat is not None and lon is not None and -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+def encode(lat, lon, precision=PRECISION):
+    """Geohash of a point, or None when the coordinates are missing or out of range."""
+    if not is_valid(lat, lon):
+        return None
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate, longitude first
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a geohash cell of `precision` characters."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance in km from one point to arrays of points."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def radius_boxes(lat, lon, radius_km):
+    """Bounding boxes (south, west, north, east) covering a circle; two when it crosses 180°."""
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    if south == -90.0 or north == 90.0:
+        # The circle contains a pole, so it spans every longitude
+        return [(south, -180.0, north, 180.0)]
+    dlon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(max(abs(south), abs(north)))))
+    if dlon >= 180:
+        return [(south, -180.0, north, 180.0)]
+    return split_box(south, lon - dlon, north, lon + dlon)
+
+
+def split_box(south, west, north, east):
+    """Normalizes a box whose longitudes may run past ±180 into one or two in-range boxes."""
+    if west < -180:
+        return [(south, west + 360, north, 180.0), (south, -180.0, north, east)]
+    if east > 180:
+        return [(south, west, north, 180.0), (south, -180.0, north, east - 360)]
+    if west > east:
+        return [(south, west, north, 180.0), (south, -180.0, north, east)]
+    return [(south, west, north, east)]
+
+
+def covering_cells(boxes, max_cells=24):
+    """The finest set of at most `max_cells` geohash prefixes that together cover `boxes`."""
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        cells = set()
+        for south, west, north, east in boxes:
+            rows = math.floor((north + 90) / height) - math.floor((south + 90) / height) + 1
+            cols = math.floor((east + 180) / width) - math.floor((west + 180) / width) + 1
+            if rows * cols > max_cells:
+                break
+            for row in range(rows):
+                # Cell centres, clamped so the edge rows and columns stay inside the globe
+                lat = min((math.floor((south + 90) / height) + row + 0.5) * height - 90, 90 - height / 2)
+                for col in range(cols):
+                    lon = min((math.floor((west + 180) / width) + col + 0.5) * width - 180, 180 - width / 2)
+                    cells.add(encode(lat, lon, precision))
+        else:
+            if len(cells) <= max_cells:
+                return sorted(cells)
+    return list(BASE32)
+
+
+def in_box(lats, lons, boxes):
+    """Boolean mask of the points that fall inside any of `boxes`."""
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    mask = np.zeros(len(lats), dtype=bool)
+    for south, west, north, east in boxes:
+        mask |= (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+    return mask
+
+
+def cell_ranges(cells):
+    """Merges sorted same-length cells into (low, high) ranges, so adjacent cells cost one index scan."""
+    ranges = []
+    for cell in cells:
+        if ranges and successor(ranges[-1][1]) == cell:
+            ranges[-1][1] = cell
+        else:
+            ranges.append([cell, cell])
+    return [(low, high + PREFIX_END) for low, high in ranges]
+
+
+def successor(cell):
+    """The next geohash of the same length in sort order, or None after 'zzz...'."""
+    chars = list(cell)
+    for i in range(len(chars) - 1, -1, -1):
+        position = BASE32.index(chars[i])
+        if position < len(BASE32) - 1:
+            chars[i] = BASE32[position + 1]
+            return ''.join(chars)
+        chars[i] = BASE32[0]
+    return None
+
+
+def precision_for_zoom(zoom):
+    """Geohash length whose cells are at least ~60 px wide on a web map at `zoom` (0-18)."""
+    # A 256 px tile spans 360° / 2**zoom
+    target = 360.0 / 2 ** zoom * 60 / 256
+    for precision in range(PRECISION, 0, -1):
+        if cell_size(precision)[1] >= target:
+            return precision
+    return 1
@@ -0,0 +1,195 @@
+"""In-process background job queue for long-running analysis work.
+
+Jobs run on a fixed pool of worker threads. Each owner (a user, or an anonymous
+client) has its own FIFO, and workers pick owners round-robin, so one busy user
+can't starve everybody else. Jobs that raise `TransientJobError` are retried with
+exponential backoff. Progress is published as an append-only event log that
+status polling and streaming endpoints read from.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+
+class TransientJobError(Exception):
+    """Raised by a job function for failures worth retrying (e.g. every provider timed out)."""
+
+
+class QueueFullError(Exception):
+    """Raised by `JobQueue.submit` when the owner already has too many jobs waiting."""
+
+
+class Job:
+    def __init__(self, owner, fn, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'
+        self.progress = 'Waiting for a worker...'
+        self.attempts = 0
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.events = []
+        self._changed = threading.Condition()
+
+    def publish(self, kind, data):
+        """Appends an event to the job's log and wakes up anything waiting on it."""
+        with self._changed:
+            self.events.append((kind, data))
+            self._changed.notify_all()
+
+    def set_progress(self, message):
+        self.progress = message
+        self.publish('status', {'message': message})
+
+    def finish(self, status, result=None, error=None):
+        """Marks the job finished and publishes the final 'done' or 'failed' event atomically."""
+        with self._changed:
+            self.result = result
+            self.error = error
+            self.status = status
+            self.finished_at = time.time()
+            payload = (result or {}) if status == 'done' else {'error': error}
+            self.events.append((status, payload))
+            self._changed.notify_all()
+
+    def wait_for_events(self, since, timeout):
+        """Returns the events after position `since`, waiting up to `timeout` seconds for one."""
+        with self._changed:
+            if len(self.events) <= since and not self.finished:
+                self._changed.wait(timeout)
+            return self.events[since:]
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'attempts': self.attempts,
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    """Bounded worker pool with per-owner fairness, per-owner limits and retries.
+
+    `max_workers` bounds the number of jobs running at once, `max_running_per_owner`
+    how many of those may belong to one owner, and `max_queued_per_owner` how many an
+    owner may have waiting. Finished jobs are kept for `retention` seconds so their
+    status can still be polled.
+    """
+
+    def __init__(self, max_workers=4, max_running_per_owner=1, max_queued_per_owner=5,
+                 max_retries=2, retry_backoff=2.0, retention=3600):
+        self.max_workers = max_workers
+        self.max_running_per_owner = max_running_per_owner
+        self.max_queued_per_owner = max_queued_per_owner
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retention = retention
+        self.jobs = {}
+        self._pending = OrderedDict()  # owner -> deque of jobs, in round-robin order
+        self._running = {}             # owner -> number of running jobs
+        self._cond = threading.Condition()
+        self._workers = []
+
+    def submit(self, owner, fn, *args, **kwargs):
+        """Queues `fn(job, *args, **kwargs)` on behalf of `owner` and returns the Job.
+
+        Whatever `fn` returns becomes `job.result` and the payload of the final 'done' event.
+        """
+        job = Job(owner, fn, args, kwargs)
+        with self._cond:
+            queue = self._pending.setdefault(owner, deque())
+            if len(queue) >= self.max_queued_per_owner:
+                raise QueueFullError(f"{owner} already has {len(queue)} jobs waiting")
+            queue.append(job)
+            self.jobs[job.id] = job
+            self._prune()
+            self._start_workers()
+            self._cond.notify()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': len(self._workers),
+                'queued': sum(len(q) for q in self._pending.values()),
+                'running': sum(self._running.values()),
+                'owners_waiting': len(self._pending),
+                'tracked_jobs': len(self.jobs),
+            }
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._work, name=f'job-worker-{len(self._workers)}', daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def _next_job(self):
+        """Pops the head job of the first owner that is under its running limit, rotating owners."""
+        for owner in list(self._pending):
+            if self._running.get(owner, 0) >= self.max_running_per_owner:
+                continue
+            queue = self._pending.pop(owner)
+            job = queue.popleft()
+            if queue:
+                # Re-append so the next pick starts with the following owner
+                self._pending[owner] = queue
+            self._running[owner] = self._running.get(owner, 0) + 1
+            return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._running[job.owner] -= 1
+                    if not self._running[job.owner]:
+                        del self._running[job.owner]
+                    self._cond.notify_all()
+
+    def _run(self, job):
+        job.status = 'running'
+        while True:
+            job.attempts += 1
+            try:
+                result = job.fn(job, *job.args, **job.kwargs)
+                job.finish('done', result=result)
+                return
+            except TransientJobError as e:
+                if job.attempts > self.max_retries:
+                    job.finish('failed', error=str(e))
+                    return
+                delay = self.retry_backoff * 2 ** (job.attempts - 1)
+                print(f"Job {job.id} attempt {job.attempts} failed ({e}); retrying in {delay:.0f}s.")
+                job.set_progress(f"Retrying after a provider error (attempt {job.attempts + 1})...")
+                time.sleep(delay)
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                job.finish('failed', error=str(e))
+                return
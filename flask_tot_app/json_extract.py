@@ -0,0 +1,244 @@
+"""Tolerant, incremental JSON extraction for LLM responses.
+
+LLMs wrap JSON in markdown fences and prose, leave trailing commas, and get cut off
+mid-array when they hit a token limit. When a JSON value starts, `JSONScanner` first
+tries the C decoder on it. If that fails, it walks the text once, jumping between
+structural characters with precompiled regexes and tracking string and nesting
+state. Along the way it records trailing commas to drop, and it hands back every
+strategy object the moment its closing brace arrives. Each object is then parsed
+once with `json.loads`. The scanner keeps its state between `feed()` calls, so it
+works the same on a complete response and on streamed chunks.
+"""
+import json
+import re
+
+# A whole string literal (group 1 is empty if it is still open) or a structural character
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*("?)|[\[\]{},]', re.DOTALL)
+_STRING_SPECIAL = re.compile(r'["\\]')
+_DECODER = json.JSONDecoder(strict=False)
+# The decoders recurse per nesting level, so garbled brackets can exhaust the stack instead of failing to parse
+_UNPARSEABLE = (ValueError, RecursionError)
+
+# Key under which providers in JSON-object mode tend to nest the strategy list
+STRATEGIES_KEY = 'strategies'
+
+
+class JSONScanner:
+    """Single-pass scanner that yields complete JSON values from a growing buffer.
+
+    `feed()` returns ('item', value) for each object that closes directly inside the
+    collected array, which is either a root-level array or the root object's
+    "strategies" array. It returns ('root', value) when a top-level value closes.
+    Values that still don't parse once trailing commas are removed are skipped.
+    """
+
+    def __init__(self):
+        self.buf = ''
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.string_start = None
+        self.last_key = None
+        self.last_mark = None      # position of the last structural character outside strings
+        self.drops = []            # positions of trailing commas in the current root
+        self.root_start = None
+        self.collect_depth = None  # stack depth at which collected items open
+        self.item_start = None
+        self.items = []            # items parsed from the current root
+
+    def feed(self, chunk):
+        self.buf += chunk
+        events = []
+        buf = self.buf
+        pos = self.pos
+        while True:
+            if self.in_string:
+                match = _STRING_SPECIAL.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                if match.group() == '\\':
+                    if match.end() >= len(buf):
+                        # The escaped character hasn't arrived yet
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self.in_string = False
+                pos = match.end()
+                if len(self.stack) == 1 and self.stack[0] == '{':
+                    self.last_key = buf[self.string_start + 1:match.start()]
+                self.last_mark = match.start()
+                continue
+
+            match = _TOKEN.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            ch = match.group()[0]
+            i = match.start()
+            pos = match.end()
+
+            if not self.stack:
+                # Outside any JSON value: skip prose, fences and stray punctuation
+                if ch == '"':
+                    pos = i + 1
+                elif ch in '[{':
+                    try:
+                        # Fast path: the value is already complete and well-formed
+                        root, end = _DECODER.raw_decode(buf, i)
+                    except _UNPARSEABLE:
+                        self._open_root(ch, i)
+                    else:
+                        events.append(('root', root))
+                        pos = end
+                continue
+
+            if ch == '"':
+                if not match.group(1):
+                    # The string continues in a later chunk
+                    self.in_string = True
+                    self.string_start = i
+                    pos = i + 1
+                    continue
+                if len(self.stack) == 1 and self.stack[0] == '{':
+                    self.last_key = buf[i + 1:pos - 1]
+                self.last_mark = pos - 1
+                continue
+
+            if ch in '[{':
+                if ch == '{' and self.collect_depth == len(self.stack):
+                    try:
+                        item, end = _DECODER.raw_decode(buf, i)
+                    except _UNPARSEABLE:
+                        self.item_start = i
+                    else:
+                        self.items.append(item)
+                        events.append(('item', item))
+                        pos = end
+                        self.last_mark = end - 1
+                        continue
+                self.stack.append(ch)
+                if ch == '[' and len(self.stack) == 2 and self.stack[0] == '{' and self.last_key == STRATEGIES_KEY:
+                    self.collect_depth = 2
+            elif ch in ']}':
+                if self.last_mark is not None and buf[self.last_mark] == ',' and not buf[self.last_mark + 1:i].strip():
+                    self.drops.append(self.last_mark)
+                self.stack.pop()
+                depth = len(self.stack)
+                if ch == '}' and self.item_start is not None and depth == self.collect_depth:
+                    item = self._parse(self.item_start, i + 1)
+                    self.item_start = None
+                    if item is not None:
+                        self.items.append(item)
+                        events.append(('item', item))
+                elif ch == ']' and self.collect_depth is not None and depth == self.collect_depth - 1:
+                    self.collect_depth = None
+                if not self.stack:
+                    root = self._parse(self.root_start, i + 1)
+                    self.root_start = None
+                    if root is not None:
+                        events.append(('root', root))
+                    self.items = []
+            self.last_mark = i
+        self.pos = pos
+        return events
+
+    def _open_root(self, ch, i):
+        self.stack.append(ch)
+        self.root_start = i
+        self.last_key = None
+        self.last_mark = i
+        self.drops = []
+        self.items = []
+        self.item_start = None
+        self.collect_depth = 1 if ch == '[' else None
+
+    def _parse(self, start, end):
+        pieces = []
+        cursor = start
+        for drop in self.drops:
+            if start <= drop < end:
+                pieces.append(self.buf[cursor:drop])
+                cursor = drop + 1
+        pieces.append(self.buf[cursor:end])
+        try:
+            # strict=False tolerates raw newlines and tabs inside strings
+            return json.loads(''.join(pieces), strict=False)
+        except _UNPARSEABLE:
+            return None
+
+    @property
+    def truncated_items(self):
+        """Items recovered from a root value that never closed (e.g. a cut-off array)."""
+        return list(self.items) if self.stack else []
+
+
+def iter_json_values(text):
+    """Yields every complete top-level JSON value embedded in `text`."""
+    scanner = JSONScanner()
+    for kind, value in scanner.feed(text):
+        if kind == 'root':
+            yield value
+
+
+def extract_json(text):
+    """Returns the first parseable top-level JSON value in `text`, or None.
+
+    If the text ends inside an array, the elements that did complete are returned as a list.
+    """
+    scanner = JSONScanner()
+    for kind, value in scanner.feed(text or ''):
+        if kind == 'root':
+            return value
+    return scanner.truncated_items or None
+
+
+def strategies_from_value(value):
+    """Normalizes a parsed response into a list of strategy dicts."""
+    if isinstance(value, dict):
+        if isinstance(value.get(STRATEGIES_KEY), list):
+            return [item for item in value[STRATEGIES_KEY] if isinstance(item, dict)]
+        # A single strategy object instead of a list
+        if 'title' in value and 'summary' in value:
+            return [value]
+        return []
+    if isinstance(value, list):
+        return [item for item in value if isinstance(item, dict)]
+    return []
+
+
+class StrategyStreamParser:
+    """Turns streamed response chunks into strategies as soon as each one is complete."""
+
+    def __init__(self):
+        self.scanner = JSONScanner()
+        self.strategies = []
+        self.done = False
+
+    def feed(self, chunk):
+        """Returns the strategies completed by `chunk`."""
+        if self.done:
+            return []
+        new = []
+        for kind, value in self.scanner.feed(chunk):
+            if kind == 'item':
+                if isinstance(value, dict):
+                    new.append(value)
+            elif kind == 'root':
+                if not self.strategies and not new:
+                    # Whole value arrived at once (or it was a single strategy object)
+                    new = strategies_from_value(value)
+                # Anything after the first useful value is commentary
+                self.done = bool(self.strategies or new)
+                if self.done:
+                    break
+        self.strategies.extend(new)
+        return new
+
+
+def extract_strategies(text):
+    """Returns every strategy dict that can be recovered from `text`."""
+    parser = StrategyStreamParser()
+    parser.feed(text or '')
+    return parser.strategies
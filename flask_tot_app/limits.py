@@ -0,0 +1,317 @@
+"""Shared in-process rate limits, circuit breakers and token accounting for LLM calls.
+
+* `TokenBucket` refills continuously at `rate` per second up to `capacity`.
+  `/analyze` takes one token per search from a bucket per user (or per client
+  address), so one client can't flood the shared provider keys.
+* Every provider key has a bucket of LLM tokens per minute. A call is allowed
+  while the balance is positive and is charged afterwards with the usage the
+  provider reported, so the balance can go negative. That debt is paid back by
+  the refill before the key is used again.
+* `CircuitBreaker` opens after `threshold` consecutive failures of a provider.
+  While it is open, callers skip the provider instead of waiting for it to fail.
+  After `cooldown` seconds, a single trial call is let through. Success closes
+  the circuit and failure reopens it. A trial that ends without a verdict
+  (cancelled, or its stream abandoned) is released for the next caller, and one
+  that never reports lets another trial through after a further `cooldown`.
+* Verdicts on keys (accepted or rejected by their provider) are cached per key
+  hash. Calls with a rejected key are skipped until the verdict expires, which
+  happens sooner than for an accepted key, in case the key was just activated.
+
+All state is per process, like the caches in cache.py.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import TTLCache
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount=1):
+        """Removes `amount` tokens if they are all available; returns whether it did."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True
+            return False
+
+    def charge(self, amount):
+        """Removes `amount` tokens unconditionally, possibly leaving the bucket in debt."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+    def has_balance(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens > 0
+
+    def retry_after(self, amount=1):
+        """Seconds until `amount` tokens will be available."""
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = amount - self.tokens
+            return max(0.0, missing / self.rate) if self.rate else float('inf')
+
+    def as_dict(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {'tokens': round(self.tokens, 1), 'capacity': self.capacity, 'rate_per_second': self.rate}
+
+
+class BucketMap:
+    """Buckets created on first use per key, keeping the `maxsize` most recently used."""
+
+    def __init__(self, rate, capacity, maxsize=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+                while len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(key)
+            return bucket
+
+    def take(self, key, amount=1):
+        allowed = self.get(key).take(amount)
+        if not allowed:
+            with self._lock:
+                self.rejected += 1
+        return allowed
+
+    def items(self):
+        with self._lock:
+            return list(self._buckets.items())
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self.times_opened = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go ahead. In the half-open state only the first caller gets through."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if (self.state == self.OPEN and now - self.opened_at >= self.cooldown) or \
+                    (self.state == self.HALF_OPEN and now - self.trial_started_at >= self.cooldown):
+                self.state = self.HALF_OPEN
+                self.trial_started_at = now
+                return True
+            self.skipped += 1
+            return False
+
+    def release(self):
+        """An allowed call ended without a verdict. A half-open circuit lets the next caller be the trial."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.trial_started_at -= self.cooldown
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.consecutive_failures >= self.threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+
+    def as_dict(self):
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = round(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)), 1)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened,
+                'skipped_calls': self.skipped,
+                'retry_in_seconds': retry_in,
+            }
+
+
+class TokenUsage:
+    """Input and output token totals reported by a provider."""
+
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, input_tokens, output_tokens):
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += input_tokens or 0
+            self.output_tokens += output_tokens or 0
+
+    def as_dict(self):
+        with self._lock:
+            return {'calls': self.calls, 'input_tokens': self.input_tokens, 'output_tokens': self.output_tokens}
+
+
+# Searches a user (or anonymous client) may start per minute, with room for a short burst
+ANALYZE_RATE_PER_MINUTE = float(os.getenv('ANALYZE_RATE_PER_MINUTE', '6'))
+ANALYZE_BURST = float(os.getenv('ANALYZE_BURST', '3'))
+# LLM tokens (input + output) each provider key may spend per minute; 0 disables the limit
+KEY_TOKENS_PER_MINUTE = float(os.getenv('LLM_KEY_TOKENS_PER_MINUTE', '200000'))
+# Consecutive failures that open a provider's circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv('CIRCUIT_COOLDOWN_SECONDS', '30'))
+# How long a provider's verdict on a key is trusted, for accepted and for rejected keys
+KEY_HEALTH_TTL_SECONDS = float(os.getenv('KEY_HEALTH_TTL_SECONDS', '3600'))
+KEY_REJECTED_TTL_SECONDS = float(os.getenv('KEY_REJECTED_TTL_SECONDS', '600'))
+
+user_buckets = BucketMap(ANALYZE_RATE_PER_MINUTE / 60, ANALYZE_BURST)
+key_buckets = BucketMap(KEY_TOKENS_PER_MINUTE / 60, KEY_TOKENS_PER_MINUTE, maxsize=1000)
+key_verdicts = TTLCache(10000, KEY_HEALTH_TTL_SECONDS)
+_breakers = {}
+_usage = {}
+_registry_lock = threading.Lock()
+
+
+def breaker(provider):
+    with _registry_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN_SECONDS)
+        return _breakers[provider]
+
+
+def usage(provider):
+    with _registry_lock:
+        if provider not in _usage:
+            _usage[provider] = TokenUsage()
+        return _usage[provider]
+
+
+def key_id(provider, api_key):
+    """Bucket key for a provider key; the key itself is never kept or reported."""
+    return f"{provider}:{hashlib.sha256(api_key.encode()).hexdigest()[:12]}"
+
+
+def key_health(provider, api_key):
+    """The cached verdict {'ok', 'message', 'checked_at'} on a key, or None if it hasn't been checked lately."""
+    return key_verdicts.get(key_id(provider, api_key))
+
+
+def record_key_health(provider, api_key, ok, message=None):
+    """Caches whether `provider` accepted `api_key`, and returns the verdict."""
+    verdict = {'ok': ok, 'message': message, 'checked_at': round(time.time())}
+    key_verdicts.set(key_id(provider, api_key), verdict, ttl=None if ok else KEY_REJECTED_TTL_SECONDS)
+    return verdict
+
+
+def acquire(provider, api_key):
+    """Returns None if a call to `provider` with `api_key` may go ahead, else the reason it may not."""
+    verdict = key_health(provider, api_key)
+    if verdict is not None and not verdict['ok']:
+        return 'key rejected'
+    if KEY_TOKENS_PER_MINUTE and not key_buckets.get(key_id(provider, api_key)).has_balance():
+        return 'key token budget spent'
+    if not breaker(provider).allow():
+        return 'circuit open'
+    return None
+
+
+def is_key_error(exc):
+    """Authentication and permission errors are the key's fault, not the provider's."""
+    status = getattr(exc, 'status_code', None) or getattr(exc, 'code', None)
+    return status in (401, 403) or type(exc).__name__ in (
+        'AuthenticationError', 'PermissionDeniedError', 'Unauthenticated', 'PermissionDenied',
+    )
+
+
+def record_result(provider, error=None, api_key=None):
+    """Feeds the outcome of an allowed call to the provider's circuit breaker.
+
+    `error` is the exception raised, or True when the call returned nothing usable.
+    With `api_key`, a key error also caches the key as rejected.
+    """
+    if error is None:
+        breaker(provider).record_success()
+    elif error is True or not is_key_error(error):
+        breaker(provider).record_failure()
+    else:
+        # The provider answered, just not for this key
+        breaker(provider).record_success()
+        if api_key:
+            record_key_health(provider, api_key, False, str(error)[:200])
+
+
+def release(provider):
+    """For an allowed call that ended without an outcome, e.g. cancelled before it started."""
+    breaker(provider).release()
+
+
+def record_usage(provider, api_key, input_tokens, output_tokens):
+    """Adds reported usage to the provider totals and charges the key's bucket."""
+    usage(provider).add(input_tokens, output_tokens)
+    if KEY_TOKENS_PER_MINUTE:
+        key_buckets.get(key_id(provider, api_key)).charge((input_tokens or 0) + (output_tokens or 0))
+
+
+def take_analysis(owner):
+    """Takes one search from `owner`'s bucket. Returns None if allowed, else seconds to wait."""
+    if user_buckets.take(owner):
+        return None
+    return user_buckets.get(owner).retry_after()
+
+
+def snapshot():
+    """JSON-serializable view of every limit, breaker and usage counter."""
+    with _registry_lock:
+        providers = sorted(set(_breakers) | set(_usage))
+    return {
+        'providers': {
+            name: {'circuit': breaker(name).as_dict(), 'usage': usage(name).as_dict()}
+            for name in providers
+        },
+        'keys': {key: bucket.as_dict() for key, bucket in key_buckets.items()},
+        'key_verdicts': key_verdicts.stats(),
+        'analyze': {
+            'rate_per_minute': ANALYZE_RATE_PER_MINUTE,
+            'burst': ANALYZE_BURST,
+            'clients_tracked': len(user_buckets),
+            'rejected': user_buckets.rejected,
+        },
+    }
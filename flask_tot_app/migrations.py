@@ -0,0 +1,157 @@
+"""Idempotent schema upgrades for databases created by an older version of the app.
+
+`db.create_all()` only creates missing tables, so columns and indexes added to
+existing models are applied here, along with data backfills for new tables. Run
+`python migrations.py`, or let `app.py` apply it at startup.
+"""
+from sqlalchemy import bindparam, inspect, text
+
+import geo
+import search_index
+from dbtypes import CompressedText
+
+
+def add_missing_columns(db):
+    """Adds columns declared on the models but missing from existing tables.
+
+    New columns are added as nullable, so this is safe on tables that already hold rows.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def add_missing_indexes(db):
+    """Creates indexes declared on the models but missing from existing tables."""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=conn)
+                    added.append(index.name)
+    return added
+
+
+def compress_legacy_text(db, batch_size=1000):
+    """Rewrites plain TEXT values left in CompressedText columns as compressed BLOBs.
+
+    SQLite only: its dynamic typing lets both forms live in one column while the
+    batches run. Returns the number of values rewritten.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return 0
+    existing_tables = set(inspect(db.engine).get_table_names())
+    total = 0
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        (pk,) = table.primary_key.columns
+        for column in table.columns:
+            if not isinstance(column.type, CompressedText):
+                continue
+            update = table.update().where(pk == bindparam('_pk')).values({column.name: bindparam('_value')})
+            while True:
+                with db.engine.begin() as conn:
+                    rows = conn.execute(
+                        text(f'SELECT "{pk.name}", "{column.name}" FROM "{table.name}" '
+                             f'WHERE typeof("{column.name}") = \'text\' LIMIT :limit'),
+                        {'limit': batch_size},
+                    ).fetchall()
+                    if not rows:
+                        break
+                    conn.execute(update, [{'_pk': row[0], '_value': row[1]} for row in rows])
+                total += len(rows)
+    return total
+
+
+def backfill_saved_strategies(db, model, batch_size=500):
+    """Builds the normalized rows for saved strategies that only have their JSON document.
+
+    Works through `model` (SavedStrategy) in batches, committing after each, so an
+    interrupted run can simply be restarted.
+    """
+    total = 0
+    while True:
+        rows = model.query.filter(model.num_days.is_(None)).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            break
+        for row in rows:
+            row.normalize_from_content()
+        db.session.commit()
+        total += len(rows)
+    if total:
+        print(f"Normalized {total} saved strategies")
+    return total
+
+
+def backfill_geohashes(db, batch_size=5000):
+    """Fills strategy_location.geohash and user_id for rows saved before those columns existed."""
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE strategy_location SET user_id = ("
+            " SELECT user_id FROM saved_strategy WHERE saved_strategy.id = strategy_location.strategy_id)"
+            " WHERE user_id IS NULL"
+        ))
+    select = text(
+        "SELECT id, lat, lon FROM strategy_location WHERE geohash IS NULL"
+        " AND lat BETWEEN -90 AND 90 AND lon BETWEEN -180 AND 180 LIMIT :limit"
+    )
+    update = text("UPDATE strategy_location SET geohash = :geohash WHERE id = :id")
+    total = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(select, {'limit': batch_size}).fetchall()
+            if not rows:
+                break
+            conn.execute(update, [{'id': row.id, 'geohash': geo.encode(row.lat, row.lon)} for row in rows])
+        total += len(rows)
+    return total
+
+
+def upgrade_schema(db):
+    """Brings the connected database up to date with the models."""
+    db.create_all()
+    for column in add_missing_columns(db):
+        print(f"Added column {column}")
+    for index in add_missing_indexes(db):
+        print(f"Added index {index}")
+    compressed = compress_legacy_text(db)
+    if compressed:
+        print(f"Compressed {compressed} stored payloads")
+    geohashes = backfill_geohashes(db)
+    if geohashes:
+        print(f"Geohashed {geohashes} strategy locations")
+    with db.engine.begin() as conn:
+        if search_index.create(conn):
+            print(f"Built full-text index over {search_index.rebuild(conn)} searches and strategies")
+        elif search_index.exists(conn) and not search_index.is_keyed(conn):
+            print(f"Re-keyed full-text index over {search_index.rebuild(conn)} searches and strategies")
+
+
+if __name__ == '__main__':
+    from factory import create_app
+    from models import SavedStrategy, db
+
+    app = create_app()
+    with app.app_context():
+        upgrade_schema(db)
+        backfill_saved_strategies(db, SavedStrategy)
+        print("Schema is up to date.")
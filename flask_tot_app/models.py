@@ -0,0 +1,199 @@
+"""Database models, shared by the web app (app.py), reset_db.py, migrations.py and the benchmarks.
+
+`db` is not bound to an app here; `factory.create_app()` calls `db.init_app()`, so
+scripts that only need the tables don't import the web app and its provider SDKs.
+"""
+import json
+from datetime import datetime, timedelta
+
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+
+import geo
+import search_index
+from dbtypes import CompressedText
+from strategy_rows import COST_CATEGORIES, parse_cost_amount, strategy_summary_fields, to_float
+
+db = SQLAlchemy()
+
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(150), unique=True, nullable=False)
+    email = db.Column(db.String(150), unique=True, nullable=False)
+    password = db.Column(db.String(150), nullable=False)
+    openai_key = db.Column(db.String(200), nullable=True)
+    anthropic_key = db.Column(db.String(200), nullable=True)
+    gemini_key = db.Column(db.String(200), nullable=True)
+    searches = db.relationship('SearchHistory', backref='author', lazy=True)
+    saved_strategies = db.relationship('SavedStrategy', backref='author', lazy=True)
+    trips = db.relationship('Trip', backref='author', lazy=True)
+
+class SearchHistory(db.Model):
+    # Profile history: newest first per user (SQLite index entries carry the id for tie-breaks)
+    __table_args__ = (db.Index('ix_search_history_user_timestamp', 'user_id', 'timestamp'),)
+    id = db.Column(db.Integer, primary_key=True)
+    search_query = db.Column(db.Text, nullable=False)
+    results = db.Column(CompressedText, nullable=True) # JSON string of search results, zlib-compressed at rest
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=True) # queued / running / done / failed; NULL for rows from before the job queue
+    progress = db.Column(db.String(200), nullable=True)
+    job_id = db.Column(db.String(32), nullable=True)
+    search_tree = db.Column(CompressedText, nullable=True) # JSON of the tree search behind the results (tot_search.py)
+
+def fail_orphaned_searches(older_than):
+    """Marks searches still queued or running `older_than` seconds after they started as failed.
+
+    Jobs live in the memory of the process that queued them, so a restart leaves their
+    rows behind. The age cutoff keeps other live processes' searches out of the sweep.
+    Returns the number of rows marked.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+    count = SearchHistory.query.filter(
+        SearchHistory.status.in_(('queued', 'running')), SearchHistory.timestamp < cutoff
+    ).update({'status': 'failed', 'progress': 'Interrupted by a restart'}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+class SavedStrategy(db.Model):
+    __table_args__ = (db.Index('ix_saved_strategy_user_id', 'user_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    content = db.Column(CompressedText, nullable=False) # Original JSON document, compressed; views read the rows below
+    critique = db.Column(db.Text, nullable=True)
+    score = db.Column(db.Float, nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Precomputed from the strategy so lists and trip planning don't need the child rows
+    summary = db.Column(db.Text, nullable=True)
+    total_cost = db.Column(db.Float, nullable=True)
+    currency = db.Column(db.String(10), nullable=True)
+    num_days = db.Column(db.Integer, nullable=True) # NULL until the row has been normalized
+    primary_location = db.Column(db.String(150), nullable=True)
+    trips = db.relationship('Trip', backref='strategy', lazy=True)
+    days = db.relationship('StrategyDay', backref='strategy', lazy=True, order_by='StrategyDay.position', cascade='all, delete-orphan')
+    locations = db.relationship('StrategyLocation', lazy=True, order_by='StrategyLocation.position', cascade='all, delete-orphan')
+    costs = db.relationship('StrategyCost', lazy=True, cascade='all, delete-orphan')
+
+    @property
+    def is_normalized(self):
+        return self.num_days is not None
+
+    def set_details(self, details):
+        """Replaces the strategy's day, activity, location and cost rows from a strategy dict."""
+        for column, value in strategy_summary_fields(details).items():
+            setattr(self, column, value)
+
+        self.days = []
+        for position, day in enumerate(details.get('itinerary') or []):
+            if not isinstance(day, dict):
+                continue
+            activities = [a for a in day.get('activities') or [] if isinstance(a, dict)]
+            self.days.append(StrategyDay(
+                position=position,
+                day=day.get('day') if isinstance(day.get('day'), int) else position + 1,
+                title=str(day.get('title') or '')[:200],
+                activities=[
+                    StrategyActivity(
+                        position=i,
+                        name=str(a.get('name') or '')[:200],
+                        type=str(a.get('type') or '')[:50] or None,
+                        description=a.get('description'),
+                    )
+                    for i, a in enumerate(activities)
+                ],
+            ))
+
+        self.locations = []
+        for position, loc in enumerate(details.get('locations') or []):
+            if isinstance(loc, dict) and loc.get('name'):
+                lat, lon = to_float(loc.get('lat')), to_float(loc.get('lon'))
+                self.locations.append(StrategyLocation(position=position, name=str(loc['name'])[:150], user_id=self.user_id,
+                                                       lat=lat, lon=lon, geohash=geo.encode(lat, lon)))
+
+        costs = details.get('cost_breakdown') if isinstance(details.get('cost_breakdown'), dict) else {}
+        self.costs = [
+            StrategyCost(category=category, raw=str(costs[category])[:100], amount=parse_cost_amount(costs[category]))
+            for category in COST_CATEGORIES
+            if costs.get(category) is not None
+        ]
+
+    def details(self):
+        """Rebuilds the strategy dict (summary, cost_breakdown, itinerary, locations) from the rows."""
+        cost_breakdown = {cost.category: cost.raw for cost in self.costs}
+        if self.currency:
+            cost_breakdown['currency'] = self.currency
+        return {
+            'summary': self.summary,
+            'cost_breakdown': cost_breakdown,
+            'itinerary': [
+                {
+                    'day': day.day,
+                    'title': day.title,
+                    'activities': [
+                        {'name': a.name, 'type': a.type, 'description': a.description} for a in day.activities
+                    ],
+                }
+                for day in self.days
+            ],
+            'locations': [{'name': loc.name, 'lat': loc.lat, 'lon': loc.lon} for loc in self.locations],
+        }
+
+    def normalize_from_content(self):
+        """Fills the rows from the stored JSON document, for strategies saved before the rows existed."""
+        try:
+            details = json.loads(self.content)
+        except (TypeError, ValueError):
+            details = {}
+        self.set_details(details if isinstance(details, dict) else {})
+
+class StrategyDay(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    strategy_id = db.Column(db.Integer, db.ForeignKey('saved_strategy.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    day = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    activities = db.relationship('StrategyActivity', lazy=True, order_by='StrategyActivity.position', cascade='all, delete-orphan')
+
+class StrategyActivity(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    day_id = db.Column(db.Integer, db.ForeignKey('strategy_day.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(200), nullable=False)
+    type = db.Column(db.String(50), nullable=True) # food / history / other
+    description = db.Column(db.Text, nullable=True)
+
+class StrategyLocation(db.Model):
+    __table_args__ = (
+        # Per-user prefix range scans for /nearby and the profile map; see geo.py
+        # Covers the columns /nearby and the map read, so they never touch the table itself
+        db.Index('ix_strategy_location_user_geohash', 'user_id', 'geohash', 'lat', 'lon', 'strategy_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    strategy_id = db.Column(db.Integer, db.ForeignKey('saved_strategy.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True) # Copied from the strategy for the geo index
+    position = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(150), nullable=False)
+    lat = db.Column(db.Float, nullable=True)
+    lon = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True) # NULL when lat/lon are missing or out of range
+
+class StrategyCost(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    strategy_id = db.Column(db.Integer, db.ForeignKey('saved_strategy.id'), nullable=False, index=True)
+    category = db.Column(db.String(50), nullable=False) # flights / lodging / food / transport / activities / total
+    raw = db.Column(db.String(100), nullable=False) # As the LLM wrote it, e.g. "$2,600"
+    amount = db.Column(db.Float, nullable=True)
+
+class Trip(db.Model):
+    __table_args__ = (
+        db.Index('ix_trip_user_start_date', 'user_id', 'start_date'),
+        db.Index('ix_trip_strategy_id', 'strategy_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    destination = db.Column(db.String(100), nullable=False)
+    start_date = db.Column(db.DateTime, nullable=False)
+    end_date = db.Column(db.DateTime, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    strategy_id = db.Column(db.Integer, db.ForeignKey('saved_strategy.id'), nullable=True)
+
+search_index.install_hooks(SearchHistory, SavedStrategy)
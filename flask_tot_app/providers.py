@@ -0,0 +1,620 @@
+"""LLM provider layer.
+
+Every provider wraps one SDK client behind the same `generate()` and `stream()` calls. Clients are
+cached per (provider, api key) in a bounded LRU map, so repeated requests reuse
+HTTP keep-alive connections and TLS sessions instead of building a new client
+(and, for Gemini, reconfiguring process-global state) on every call.
+
+The SDKs are imported when a provider is first used rather than with this
+module. Together they take seconds to import, which every worker and script
+would otherwise pay at startup even if it never calls a provider
+(benchmarks/bench_startup.py).
+
+Keys are checked with `check_keys()`: each provider's cheapest authenticated call
+(looking up the model it would use, no generation), all providers at once, with
+the verdict cached per key hash in limits.py. The fallback chain skips keys with a
+cached rejection, and a 401/403 during a real call caches one too.
+"""
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+import limits
+import tracing
+
+Completion = namedtuple('Completion', ['text', 'input_tokens', 'output_tokens'])
+
+# Provider names in fallback order. Add 'fake' (with FAKE_LLM_KEY set) to run offline.
+PROVIDER_ORDER = [p.strip() for p in os.getenv('LLM_PROVIDERS', 'gemini,openai,anthropic').split(',') if p.strip()]
+
+CLIENT_CACHE_SIZE = int(os.getenv('LLM_CLIENT_CACHE_SIZE', '64'))
+# Longest a key check may take before the key is reported as unverified
+KEY_VERIFY_TIMEOUT_SECONDS = float(os.getenv('KEY_VERIFY_TIMEOUT_SECONDS', '10'))
+
+_http_clients = {}
+_http_client_lock = threading.Lock()
+
+
+def shared_http_client(sdk):
+    """Returns the process-wide connection pool for an SDK module (openai or anthropic), or None.
+
+    The pool is built with the SDK's own DefaultHttpxClient, so it comes from the HTTP
+    package that SDK release is built on; newer releases reject a plain httpx.Client.
+    """
+    with _http_client_lock:
+        if sdk.__name__ not in _http_clients:
+            client_class = getattr(sdk, 'DefaultHttpxClient', None)
+            http_client = None
+            if client_class is not None:
+                # The class subclasses that package's Client (httpx or httpx2); its Limits and Timeout must match
+                http = importlib.import_module(client_class.__mro__[1].__module__.partition('.')[0])
+                http_client = client_class(
+                    limits=http.Limits(
+                        max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '50')),
+                        max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE', '20')),
+                    ),
+                    timeout=http.Timeout(float(os.getenv('LLM_TIMEOUT_SECONDS', '60')), connect=10.0),
+                )
+            _http_clients[sdk.__name__] = http_client
+        return _http_clients[sdk.__name__]
+
+
+def sdk_client(sdk, client_class, api_key):
+    """Builds an SDK client on the shared pool, or on the SDK's default one if it rejects the pool."""
+    http_client = shared_http_client(sdk)
+    if http_client is not None:
+        try:
+            return client_class(api_key=api_key, http_client=http_client)
+        except TypeError as e:
+            print(f"{sdk.__name__} rejected the shared HTTP client, using its own: {e}")
+            with _http_client_lock:
+                _http_clients[sdk.__name__] = None
+    return client_class(api_key=api_key)
+
+
+class GeminiProvider:
+    name = 'gemini'
+    display_name = 'Gemini'
+    model = 'gemini-2.5-flash'
+
+    def __init__(self, api_key):
+        from google.ai import generativelanguage as glm
+        from google.api_core import client_options as client_options_lib
+
+        # A dedicated client per key instead of genai.configure(), which is process-global
+        endpoint = os.getenv('GEMINI_API_ENDPOINT')
+        if endpoint:
+            # e.g. http://127.0.0.1:8765 for benchmarks/fake_llm_server.py; only the REST transport takes a URL
+            self._client_args = dict(
+                client_options=client_options_lib.ClientOptions(api_key=api_key, api_endpoint=endpoint),
+                transport='rest',
+            )
+        else:
+            self._client_args = dict(client_options=client_options_lib.ClientOptions(api_key=api_key))
+        self._client = glm.GenerativeServiceClient(**self._client_args)
+
+    def _model(self):
+        import google.generativeai as genai
+
+        model = genai.GenerativeModel(self.model)
+        model._client = self._client
+        return model
+
+    def _generation_config(self, max_tokens, temperature):
+        config = {"response_mime_type": "application/json"}
+        if max_tokens:
+            config["max_output_tokens"] = max_tokens
+        if temperature is not None:
+            config["temperature"] = temperature
+        return config
+
+    def generate(self, prompt, system=None, max_tokens=None, temperature=None):
+        response = self._model().generate_content(prompt, generation_config=self._generation_config(max_tokens, temperature))
+        usage = response.usage_metadata
+        return Completion(response.text, usage.prompt_token_count, usage.candidates_token_count)
+
+    def stream(self, prompt, system=None, max_tokens=None, temperature=None, on_usage=None):
+        response = self._model().generate_content(
+            prompt, generation_config=self._generation_config(max_tokens, temperature), stream=True
+        )
+        usage = None
+        for chunk in response:
+            # Every chunk carries the running totals; the last one has the final counts
+            usage = chunk.usage_metadata or usage
+            if chunk.parts:
+                yield chunk.text
+        if on_usage and usage:
+            on_usage(usage.prompt_token_count, usage.candidates_token_count)
+
+    def verify(self, timeout=None):
+        from google.ai import generativelanguage as glm
+
+        # Reading the model's metadata is authenticated but generates nothing
+        glm.ModelServiceClient(**self._client_args).get_model(name=f"models/{self.model}", timeout=timeout)
+
+
+class OpenAIProvider:
+    name = 'openai'
+    display_name = 'OpenAI'
+    model = 'gpt-4-turbo'
+
+    def __init__(self, api_key):
+        import openai
+
+        self._client = sdk_client(openai, openai.OpenAI, api_key)
+
+    def _request(self, prompt, system, max_tokens, temperature):
+        request = dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system or "You are a helpful assistant that outputs only valid JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            response_format={"type": "json_object"},
+        )
+        if max_tokens:
+            request['max_tokens'] = max_tokens
+        if temperature is not None:
+            request['temperature'] = temperature
+        return request
+
+    def generate(self, prompt, system=None, max_tokens=None, temperature=None):
+        response = self._client.chat.completions.create(**self._request(prompt, system, max_tokens, temperature))
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content,
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+        )
+
+    def stream(self, prompt, system=None, max_tokens=None, temperature=None, on_usage=None):
+        response = self._client.chat.completions.create(
+            **self._request(prompt, system, max_tokens, temperature),
+            stream=True,
+            # Adds a final chunk with no choices that carries the usage
+            stream_options={"include_usage": True},
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if on_usage and chunk.usage:
+                on_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+
+    def verify(self, timeout=None):
+        self._client.models.retrieve(self.model, timeout=timeout)
+
+
+class AnthropicProvider:
+    name = 'anthropic'
+    display_name = 'Anthropic'
+    model = 'claude-3-haiku-20240307'
+
+    def __init__(self, api_key):
+        import anthropic
+
+        self._client = sdk_client(anthropic, anthropic.Anthropic, api_key)
+
+    def _request(self, prompt, system, max_tokens, temperature):
+        return dict(
+            model=self.model,
+            max_tokens=max_tokens or 4000,
+            system=system or "You are a helpful assistant that outputs only valid JSON.",
+            temperature=0.7 if temperature is None else temperature,
+            messages=[
+                {"role": "user", "content": prompt}
+            ]
+        )
+
+    def generate(self, prompt, system=None, max_tokens=None, temperature=None):
+        message = self._client.messages.create(**self._request(prompt, system, max_tokens, temperature))
+        return Completion(message.content[0].text, message.usage.input_tokens, message.usage.output_tokens)
+
+    def stream(self, prompt, system=None, max_tokens=None, temperature=None, on_usage=None):
+        with self._client.messages.stream(**self._request(prompt, system, max_tokens, temperature)) as stream:
+            yield from stream.text_stream
+            if on_usage:
+                usage = stream.get_final_message().usage
+                on_usage(usage.input_tokens, usage.output_tokens)
+
+    def verify(self, timeout=None):
+        self._client.models.retrieve(self.model, timeout=timeout)
+
+
+class FakeAuthenticationError(Exception):
+    """What FakeProvider raises for the key 'invalid'; limits.is_key_error() takes it for an SDK's 401."""
+    status_code = 401
+
+
+class FakeProvider:
+    """Offline stand-in that answers like a real provider after a configurable delay.
+
+    `clients_created` counts constructions so client reuse can be checked without a network.
+    """
+    name = 'fake'
+    display_name = 'Fake LLM'
+    model = 'fake-llm'
+    clients_created = 0
+
+    def __init__(self, api_key):
+        FakeProvider.clients_created += 1
+        self.api_key = api_key
+        self.calls = 0
+        self.latency = float(os.getenv('FAKE_LLM_LATENCY', '0'))
+        # Simulated decode time, so long answers cost more than short ones
+        self.seconds_per_output_token = float(os.getenv('FAKE_LLM_MS_PER_OUTPUT_TOKEN', '0')) / 1000
+
+    def _respond(self, prompt, system):
+        self.calls += 1
+        if self.api_key == 'invalid':
+            raise FakeAuthenticationError("Invalid API key")
+        batch = re.search(r'array of exactly (\d+) objects', prompt)
+        if batch:
+            text = json.dumps({"critiques": [
+                {"index": i, "critique": "Feasibility: 7/10. Balance: 7/10. Budget: 7/10.", "score": 7}
+                for i in range(int(batch.group(1)))
+            ]})
+        # Generation and refinement prompts ask for a JSON list; a refinement also quotes the critic
+        elif 'json list' not in prompt.lower() and ('critic' in prompt.lower() or 'critic' in (system or '').lower()):
+            # Stable per strategy but varied, so rankings and refinements have something to choose between
+            score = 5 + zlib.crc32(prompt.encode()) % 50 / 10
+            text = json.dumps({"critique": f"Feasibility: 7/10. Balance: 7/10. Budget: 7/10. Overall Score: {score}/10",
+                               "score": score})
+        else:
+            text = json.dumps(fake_strategies(prompt))
+        return text
+
+    def generate(self, prompt, system=None, max_tokens=None, temperature=None):
+        text = self._respond(prompt, system)
+        output_tokens = len(text) // 4
+        delay = self.latency + output_tokens * self.seconds_per_output_token
+        if delay:
+            time.sleep(delay)
+        return Completion(text, len(prompt) // 4, output_tokens)
+
+    def stream(self, prompt, system=None, max_tokens=None, temperature=None, on_usage=None, chunk_size=64):
+        text = self._respond(prompt, system)
+        if self.latency:
+            time.sleep(self.latency)
+        for start in range(0, len(text), chunk_size):
+            chunk = text[start:start + chunk_size]
+            if self.seconds_per_output_token:
+                time.sleep(len(chunk) // 4 * self.seconds_per_output_token)
+            yield chunk
+        if on_usage:
+            on_usage(len(prompt) // 4, len(text) // 4)
+
+    def verify(self, timeout=None):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.api_key == 'invalid':
+            raise FakeAuthenticationError("Invalid API key")
+
+
+def fake_strategies(prompt):
+    """Builds three small but well-formed strategies for the fake provider."""
+    return [
+        {
+            "title": f"Fake Strategy {i}",
+            # The checksum tells answers to different prompts apart, e.g. refinements of different strategies
+            "summary": f"Offline strategy {i} for: {prompt.strip()[:80]} (#{zlib.crc32(prompt.encode()):08x})",
+            "cost_breakdown": {"flights": "$1000", "lodging": "$500", "food": "$300", "transport": "$100",
+                               "activities": "$100", "total": "$2000", "currency": "USD"},
+            "itinerary": [{"day": 1, "title": "Arrival", "activities": [{"name": "Walk", "type": "other", "description": "Explore."}]}],
+            "locations": [{"name": "Tokyo", "lat": 35.6762, "lon": 139.6503}],
+        }
+        for i in range(1, 4)
+    ]
+
+
+PROVIDERS = {cls.name: cls for cls in (GeminiProvider, OpenAIProvider, AnthropicProvider, FakeProvider)}
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_provider(name, api_key):
+    """Returns the cached provider client for (name, api_key), creating it on first use.
+
+    The map is keyed on a hash of the key and evicts the least recently used client
+    once it holds more than LLM_CLIENT_CACHE_SIZE entries.
+    """
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider: {name}")
+    cache_key = (name, hashlib.sha256(api_key.encode()).hexdigest())
+    with _clients_lock:
+        provider = _clients.get(cache_key)
+        if provider is not None:
+            _clients.move_to_end(cache_key)
+            return provider
+    # Build outside the lock; SDK client construction can be slow
+    provider = PROVIDERS[name](api_key)
+    with _clients_lock:
+        provider = _clients.setdefault(cache_key, provider)
+        _clients.move_to_end(cache_key)
+        while len(_clients) > CLIENT_CACHE_SIZE:
+            _clients.popitem(last=False)
+    return provider
+
+
+# Upper bounds (seconds) of the latency histogram kept per provider
+LATENCY_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, float('inf'))
+
+
+class ProviderStats:
+    """Thread-safe attempt, win and latency counters for one provider."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.wins = 0
+        self.failures = 0
+        self.hedges = 0
+        self.latency_total = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+
+    def record(self, latency, won=False, failed=False, hedge=False):
+        with self._lock:
+            self.attempts += 1
+            self.wins += int(won)
+            self.failures += int(failed)
+            self.hedges += int(hedge)
+            self.latency_total += latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    self.latency_buckets[i] += 1
+                    break
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'attempts': self.attempts,
+                'wins': self.wins,
+                'failures': self.failures,
+                'hedges': self.hedges,
+                'avg_latency': round(self.latency_total / self.attempts, 3) if self.attempts else None,
+                'latency_histogram': {
+                    ('+Inf' if bound == float('inf') else str(bound)): count
+                    for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)
+                },
+            }
+
+
+provider_stats = {name: ProviderStats() for name in PROVIDERS}
+
+
+def stats_snapshot():
+    """Returns the per-provider counters as a JSON-serializable dict."""
+    return {name: stats.as_dict() for name, stats in provider_stats.items()}
+
+
+def _available(name, api_key, purpose):
+    """Checks the provider's circuit breaker and the key's token budget, saying why a provider is skipped."""
+    reason = limits.acquire(name, api_key)
+    if reason:
+        print(f"Skipping {PROVIDERS[name].display_name} for {purpose}: {reason}.")
+        tracing.count('wanderly_llm_skipped_total', provider=name, reason=reason)
+    return reason is None
+
+
+def complete_with_fallback(prompt, api_keys, system=None, max_tokens=None, purpose='generation', on_usage=None):
+    """Tries each provider with a key in PROVIDER_ORDER and returns the first non-empty text, or None.
+
+    `on_usage(input_tokens, output_tokens)`, if given, is called with each answer's reported usage.
+    """
+    for name in PROVIDER_ORDER:
+        api_key = api_keys.get(name)
+        if not api_key or name not in PROVIDERS:
+            continue
+        if not _available(name, api_key, purpose):
+            continue
+        display_name = PROVIDERS[name].display_name
+        model = PROVIDERS[name].model
+        start = time.monotonic()
+        with tracing.span('llm_call', provider=name, model=model, purpose=purpose) as call:
+            try:
+                completion = get_provider(name, api_key).generate(prompt, system=system, max_tokens=max_tokens)
+                limits.record_usage(name, api_key, completion.input_tokens, completion.output_tokens)
+                if on_usage:
+                    on_usage(completion.input_tokens, completion.output_tokens)
+                limits.record_result(name, None if completion.text else True, api_key)
+                tracing.record_llm_call(name, model, purpose, 'ok' if completion.text else 'empty',
+                                        completion.input_tokens, completion.output_tokens, call)
+                if completion.text:
+                    provider_stats[name].record(time.monotonic() - start, won=True)
+                    print(f"{display_name} {purpose} response received.")
+                    return completion.text
+                provider_stats[name].record(time.monotonic() - start, failed=True)
+            except Exception as e:
+                limits.record_result(name, e, api_key)
+                tracing.record_llm_call(name, model, purpose, 'error', call_span=call)
+                provider_stats[name].record(time.monotonic() - start, failed=True)
+                print(f"{display_name} {purpose} error: {e}")
+    return None
+
+
+def stream_with_fallback(prompt, api_keys, parser_factory, system=None, max_tokens=None, purpose='generation',
+                         on_usage=None):
+    """Streams from each provider in PROVIDER_ORDER, yielding items as the parser completes them.
+
+    `parser_factory()` must return an object whose `feed(chunk)` returns the items
+    completed by that chunk. The next provider is only tried if the current one
+    yielded nothing. If a stream breaks after some items were yielded, those items
+    are kept and the generator stops. `on_usage` is as for `complete_with_fallback()`.
+    """
+    for name in PROVIDER_ORDER:
+        api_key = api_keys.get(name)
+        if not api_key or name not in PROVIDERS:
+            continue
+        if not _available(name, api_key, purpose):
+            continue
+        display_name = PROVIDERS[name].display_name
+        model = PROVIDERS[name].model
+        parser = parser_factory()
+        produced = 0
+        error = None
+        usage = [0, 0]
+        parse_seconds = 0.0
+        start = time.monotonic()
+
+        def record_usage(input_tokens, output_tokens, name=name, api_key=api_key):
+            usage[:] = [input_tokens or 0, output_tokens or 0]
+            limits.record_usage(name, api_key, input_tokens, output_tokens)
+            if on_usage:
+                on_usage(input_tokens, output_tokens)
+
+        # Spans can't stay open across a yield, so the stream is timed by hand
+        try:
+            for chunk in get_provider(name, api_key).stream(prompt, system=system, max_tokens=max_tokens, on_usage=record_usage):
+                parse_start = time.perf_counter()
+                items = parser.feed(chunk)
+                parse_seconds += time.perf_counter() - parse_start
+                for item in items:
+                    produced += 1
+                    yield item
+        except GeneratorExit:
+            # The consumer stopped reading (e.g. the SSE client went away) after items arrived, so the
+            # provider was answering; without this a half-open circuit would never hear back
+            limits.record_result(name, None, api_key)
+            raise
+        except Exception as e:
+            error = e
+            print(f"{display_name} {purpose} stream error after {produced} items: {e}")
+        limits.record_result(name, error or (None if produced else True), api_key)
+        outcome = 'error' if error else 'ok' if produced else 'empty'
+        tracing.observe('llm_call', time.monotonic() - start, provider=name, model=model, purpose=purpose,
+                        kind='stream', outcome=outcome, items=produced,
+                        input_tokens=usage[0], output_tokens=usage[1])
+        tracing.record_llm_call(name, model, purpose, outcome, *usage)
+        tracing.observe('parse', parse_seconds, kind='stream', purpose=purpose)
+        provider_stats[name].record(time.monotonic() - start, won=bool(produced), failed=not produced)
+        if produced:
+            print(f"{display_name} {purpose} stream finished with {produced} items.")
+            return
+
+
+race_executor = ThreadPoolExecutor(max_workers=int(os.getenv('LLM_RACE_MAX_WORKERS', '16')), thread_name_prefix='llm-race')
+
+
+def complete_with_race(prompt, api_keys, parse, hedge_delay, system=None, max_tokens=None, purpose='generation',
+                       on_usage=None):
+    """Races providers in PROVIDER_ORDER and returns the first truthy `parse(text)` result, or None.
+
+    The primary provider is fired first. If it has not produced a valid answer after
+    `hedge_delay` seconds, the next provider is started alongside it; a provider that
+    fails outright is replaced immediately. Once a winner is found, queued attempts are
+    cancelled and late answers from attempts already in flight are discarded.
+    `on_usage` is called for every attempt that answers, winner or not.
+    """
+    candidates = [name for name in PROVIDER_ORDER if api_keys.get(name) and name in PROVIDERS]
+    pending = {}
+
+    def attempt(name, hedge):
+        start = time.monotonic()
+        model = PROVIDERS[name].model
+        with tracing.span('llm_call', provider=name, model=model, purpose=purpose, hedge=hedge) as call:
+            try:
+                completion = get_provider(name, api_keys[name]).generate(prompt, system=system, max_tokens=max_tokens)
+                limits.record_usage(name, api_keys[name], completion.input_tokens, completion.output_tokens)
+                if on_usage:
+                    on_usage(completion.input_tokens, completion.output_tokens)
+                result = parse(completion.text) if completion.text else None
+                limits.record_result(name, None if result else True, api_keys[name])
+                tracing.record_llm_call(name, model, purpose, 'ok' if result else 'empty',
+                                        completion.input_tokens, completion.output_tokens, call)
+            except Exception as e:
+                limits.record_result(name, e, api_keys[name])
+                tracing.record_llm_call(name, model, purpose, 'error', call_span=call)
+                print(f"{PROVIDERS[name].display_name} {purpose} error: {e}")
+                result = None
+        return result, time.monotonic() - start
+
+    def launch(hedge=False):
+        # Availability is checked at launch time, since a breaker may open while the race runs
+        while candidates:
+            name = candidates.pop(0)
+            if _available(name, api_keys[name], purpose):
+                break
+        else:
+            return False
+        if hedge:
+            print(f"Hedging {purpose} with {PROVIDERS[name].display_name}...")
+        pending[race_executor.submit(tracing.bind(attempt), name, hedge)] = (name, hedge)
+        return True
+
+    if not candidates or not launch():
+        return None
+    while pending:
+        timeout = hedge_delay if candidates else None
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            launch(hedge=True)
+            continue
+        for future in done:
+            name, hedge = pending.pop(future)
+            result, latency = future.result()
+            if result:
+                provider_stats[name].record(latency, won=True, hedge=hedge)
+                print(f"{PROVIDERS[name].display_name} won the {purpose} race in {latency:.2f}s.")
+                for loser, (loser_name, loser_hedge) in pending.items():
+                    if loser.cancel():
+                        # Never started, so it won't report to the breaker that allowed it
+                        limits.release(loser_name)
+                    else:
+                        loser.add_done_callback(
+                            lambda f, n=loser_name, h=loser_hedge: provider_stats[n].record(f.result()[1], hedge=h)
+                        )
+                return result
+            provider_stats[name].record(latency, failed=True, hedge=hedge)
+            if candidates:
+                launch()
+    return None
+
+
+verify_executor = ThreadPoolExecutor(max_workers=int(os.getenv('KEY_VERIFY_MAX_WORKERS', '8')), thread_name_prefix='key-verify')
+
+
+def check_key(name, api_key, force=False):
+    """Verifies `api_key` with the provider's cheapest authenticated call, unless a verdict is cached.
+
+    Returns {'ok', 'message', 'cached'}. 'ok' is None when the provider couldn't give
+    a verdict (network error, outage, timeout); only accepted and rejected keys are cached.
+    """
+    if not force:
+        verdict = limits.key_health(name, api_key)
+        if verdict is not None:
+            return dict(verdict, cached=True)
+    with tracing.span('key_check', provider=name) as call:
+        try:
+            get_provider(name, api_key).verify(timeout=KEY_VERIFY_TIMEOUT_SECONDS)
+            ok, message = True, None
+        except Exception as e:
+            if not limits.is_key_error(e):
+                call.set(outcome='error')
+                return {'ok': None, 'message': f"{PROVIDERS[name].display_name} could not check the key: {e}", 'cached': False}
+            ok, message = False, str(e)
+        call.set(outcome='ok' if ok else 'rejected')
+    return dict(limits.record_key_health(name, api_key, ok, message), cached=False)
+
+
+def check_keys(api_keys, force=False):
+    """check_key() for every provider in `api_keys` at once. Returns {provider: result}."""
+    futures = {
+        name: verify_executor.submit(tracing.bind(check_key), name, api_key, force)
+        for name, api_key in api_keys.items()
+        if api_key and name in PROVIDERS
+    }
+    deadline = time.monotonic() + KEY_VERIFY_TIMEOUT_SECONDS
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except TimeoutError:
+            results[name] = {'ok': None, 'message': f"{PROVIDERS[name].display_name} did not answer in time", 'cached': False}
+    return results
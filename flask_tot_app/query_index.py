@@ -0,0 +1,333 @@
+"""MinHash/LSH index for finding near-duplicate search queries.
+
+A query becomes a set of shingles: its content words plus their character
+trigrams, so "cheap Japan food trip" and "food trip in Japan on a budget" share
+food, trip, japan and their pieces. A 64-value MinHash signature estimates the
+Jaccard similarity of two such sets. The signature is split into 16 bands of 4
+values, and each band is packed into a uint64 key. Two queries are candidates
+when any band key matches. Band keys are held in sorted NumPy arrays, so a lookup
+costs 16 binary searches plus one vectorized comparison over the candidates.
+
+New entries go to an unsorted tail. The tail is scanned linearly and merged into
+the sorted arrays once it reaches `merge_size`. Persistence follows the same
+split: the merged arrays are an .npz snapshot, and every insert is appended to a
+log of fixed-size records. The log is replayed on load and truncated after each
+merge; every later call reads whatever was appended past the last record it saw,
+so one process's inserts show up in the others' lookups without waiting for a
+merge. Worker processes share both files. A merge holds an exclusive lock while it
+re-reads the snapshot and the whole log (so other processes' appends are merged
+too), writes the new snapshot and truncates the log; appends and loads take a
+shared lock.
+"""
+import contextlib
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, so run a single worker process there
+    fcntl = None
+
+from cache import normalize_query
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Candidates taken from any one band; stops a very common band from turning a lookup into a scan
+MAX_BUCKET = 2000
+NO_USER = -1
+
+STOPWORDS = frozenset(
+    'a an and are at be for from i in into is it me my of on or our some starting '
+    'that the this to trip us want we with'.split()
+)
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+_rng = np.random.default_rng(20240601)
+# Multiply-shift hashing: odd multipliers, the top 16 bits of the 64-bit product are the hash
+_A = _rng.integers(1, 2**63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2**63, size=NUM_PERM, dtype=np.uint64)
+_SHIFT = np.uint64(48)
+
+LOG_RECORD = np.dtype([('id', '<i8'), ('user_id', '<i8'), ('signature', '<u2', (NUM_PERM,))])
+
+
+def shingles(query):
+    """Content words of `query` and the character trigrams of each, as a set of strings."""
+    words = _WORD.findall(normalize_query(query))
+    # A query made only of stopwords still needs something to compare
+    content = [word for word in words if word not in STOPWORDS] or words
+    result = set()
+    for word in content:
+        result.add(word)
+        padded = f" {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def signature(query):
+    """MinHash signature of `query` as a uint16 array of NUM_PERM values, or None for an empty query."""
+    items = shingles(query)
+    if not items:
+        return None
+    hashes = np.fromiter((zlib.crc32(item.encode()) for item in items), dtype=np.uint64, count=len(items))
+    return ((hashes[:, None] * _A + _B) >> _SHIFT).min(axis=0).astype(np.uint16)
+
+
+def band_keys(signatures):
+    """(N, NUM_PERM) signatures -> (N, BANDS) uint64 keys, four 16-bit values per key."""
+    bands = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+    for row in range(ROWS):
+        keys = (keys << np.uint64(16)) | bands[:, :, row]
+    return keys
+
+
+class QueryIndex:
+    """Persistent near-duplicate index over (search id, user id, query text).
+
+    Thread-safe. `path` is a prefix: the snapshot is `path + '.npz'` and the log
+    `path + '.log'`. Nothing is read from disk until the first call.
+    """
+
+    def __init__(self, path, merge_size=4096):
+        self.path = path
+        self.merge_size = merge_size
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Bytes of the log already in memory
+        self._log_offset = 0
+        # Identity of the snapshot file the merged arrays match, or False when they hold unsaved merges
+        self._disk_stamp = False
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    @property
+    def snapshot_path(self):
+        return self.path + '.npz'
+
+    @property
+    def log_path(self):
+        return self.path + '.log'
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive):
+        """Serializes snapshot and log changes across processes sharing `path`."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _snapshot_stamp(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _reset(self):
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._users = np.zeros(0, dtype=np.int64)
+        self._signatures = np.zeros((0, NUM_PERM), dtype=np.uint16)
+        self._sorted_keys = np.zeros((BANDS, 0), dtype=np.uint64)
+        self._order = np.zeros((BANDS, 0), dtype=np.int64)
+        self._tail = np.zeros(self.merge_size, dtype=LOG_RECORD)
+        self._tail_keys = np.zeros((self.merge_size, BANDS), dtype=np.uint64)
+        self._tail_size = 0
+
+    def _sync(self):
+        """Catches memory up with the files, loading them on the first call. Callers hold `self._lock`."""
+        with self._file_lock(exclusive=False):
+            if not self._loaded or self._snapshot_stamp() != self._disk_stamp:
+                # First call, or another process merged and wrote a new snapshot
+                self._read_disk()
+            else:
+                self._replay_log()
+        self._loaded = True
+        if self._disk_stamp is False:
+            # The log outgrew the tail during replay; fold it into a new snapshot
+            self._compact()
+
+    def _read_disk(self):
+        """Loads the snapshot (unless it is the one already in memory) and replays the log onto it."""
+        stamp = self._snapshot_stamp()
+        if stamp != self._disk_stamp:
+            self._reset()
+            if stamp is not None:
+                with np.load(self.snapshot_path) as snapshot:
+                    self._ids = snapshot['ids']
+                    self._users = snapshot['users']
+                    self._signatures = snapshot['signatures']
+                    self._order = snapshot['order']
+                keys = band_keys(self._signatures)
+                self._sorted_keys = np.take_along_axis(keys.T, self._order, axis=1)
+            self._disk_stamp = stamp
+        else:
+            self._tail_size = 0
+        self._log_offset = 0
+        self._replay_log()
+
+    def _replay_log(self):
+        """Fills the tail with the log records appended, by any process, since the last read."""
+        try:
+            size = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            size = 0
+        if size < self._log_offset:
+            # Truncated under us; start over from the snapshot
+            self._read_disk()
+            return
+        # A crash or an append still in progress can leave a partial record at the end; it is left for later
+        count = (size - self._log_offset) // LOG_RECORD.itemsize
+        if not count:
+            return
+        records = np.fromfile(self.log_path, dtype=LOG_RECORD, count=count, offset=self._log_offset)
+        self._log_offset += count * LOG_RECORD.itemsize
+        start = 0
+        while start < len(records):
+            end = start + self.merge_size - self._tail_size
+            self._fill(records[start:end])
+            start = end
+            if self._tail_size >= self.merge_size:
+                self._merge()
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self._ids) + self._tail_size
+
+    def add(self, search_id, user_id, query):
+        """Indexes one search. Returns False when the query has no words to index."""
+        sig = signature(query)
+        if sig is None:
+            return False
+        record = np.zeros(1, dtype=LOG_RECORD)
+        record['id'] = search_id
+        record['user_id'] = NO_USER if user_id is None else user_id
+        record['signature'] = sig
+        with self._lock:
+            with self._file_lock(exclusive=False):
+                with open(self.log_path, 'ab') as f:
+                    record.tofile(f)
+            # Reads the record back from the log, along with any other process's appends
+            self._sync()
+        return True
+
+    def _fill(self, records):
+        end = self._tail_size + len(records)
+        self._tail[self._tail_size:end] = records
+        self._tail_keys[self._tail_size:end] = band_keys(records['signature'])
+        self._tail_size = end
+
+    def _compact(self):
+        """Merges everything logged, by any process, into a new snapshot and truncates the log."""
+        with self._file_lock(exclusive=True):
+            # Re-read under the lock: the log holds other processes' appends, and one of them may
+            # have written a newer snapshot
+            self._read_disk()
+            if self._tail_size:
+                self._merge()
+            self._save()
+
+    def _merge(self):
+        """Moves the tail into the sorted arrays (in memory only; `_save()` writes them)."""
+        tail = self._tail[:self._tail_size]
+        base = len(self._ids)
+        new_order = np.argsort(self._tail_keys[:self._tail_size], axis=0, kind='stable').T
+        sorted_keys, order = [], []
+        for band in range(BANDS):
+            keys = self._tail_keys[new_order[band], band]
+            # np.insert keeps each band sorted without re-sorting the existing rows
+            positions = np.searchsorted(self._sorted_keys[band], keys, side='right')
+            sorted_keys.append(np.insert(self._sorted_keys[band], positions, keys))
+            order.append(np.insert(self._order[band], positions, new_order[band] + base))
+        self._sorted_keys = np.stack(sorted_keys)
+        self._order = np.stack(order)
+        self._ids = np.concatenate([self._ids, tail['id']])
+        self._users = np.concatenate([self._users, tail['user_id']])
+        self._signatures = np.concatenate([self._signatures, tail['signature']])
+        self._tail_size = 0
+        self._disk_stamp = False
+
+    def _save(self):
+        """Writes the snapshot and truncates the log. Callers hold the exclusive file lock."""
+        temp_path = self.path + '.tmp.npz'
+        np.savez(temp_path, ids=self._ids, users=self._users, signatures=self._signatures, order=self._order)
+        os.replace(temp_path, self.snapshot_path)
+        # Everything in the log is now in the snapshot
+        open(self.log_path, 'wb').close()
+        self._log_offset = 0
+        self._disk_stamp = self._snapshot_stamp()
+
+    def rebuild(self, rows):
+        """Replaces the whole index with `rows` of (search id, user id, query) and saves it."""
+        ids, users, signatures = [], [], []
+        for search_id, user_id, query in rows:
+            sig = signature(query)
+            if sig is not None:
+                ids.append(search_id)
+                users.append(NO_USER if user_id is None else user_id)
+                signatures.append(sig)
+        with self._lock:
+            self._reset()
+            self._loaded = True
+            self._ids = np.array(ids, dtype=np.int64)
+            self._users = np.array(users, dtype=np.int64)
+            self._signatures = np.array(signatures, dtype=np.uint16).reshape(-1, NUM_PERM)
+            keys = band_keys(self._signatures).T
+            self._order = np.argsort(keys, axis=1, kind='stable')
+            self._sorted_keys = np.take_along_axis(keys, self._order, axis=1)
+            with self._file_lock(exclusive=True):
+                self._save()
+        return len(ids)
+
+    def lookup(self, query, k=5, user_id=None, min_similarity=0.0):
+        """Returns up to `k` (search id, estimated Jaccard similarity) pairs, most similar first.
+
+        With `user_id`, only that user's searches are considered.
+        """
+        sig = signature(query)
+        if sig is None:
+            return []
+        keys = band_keys(sig[None, :])[0]
+        with self._lock:
+            self._sync()
+            buckets = []
+            for band in range(BANDS):
+                lo = np.searchsorted(self._sorted_keys[band], keys[band], side='left')
+                hi = np.searchsorted(self._sorted_keys[band], keys[band], side='right')
+                if hi > lo:
+                    buckets.append(self._order[band, lo:min(hi, lo + MAX_BUCKET)])
+            rows = np.unique(np.concatenate(buckets)) if buckets else np.zeros(0, dtype=np.int64)
+            ids, users, signatures = self._ids[rows], self._users[rows], self._signatures[rows]
+
+            tail = self._tail[:self._tail_size]
+            hits = (self._tail_keys[:self._tail_size] == keys).any(axis=1)
+            ids = np.concatenate([ids, tail['id'][hits]])
+            users = np.concatenate([users, tail['user_id'][hits]])
+            signatures = np.concatenate([signatures, tail['signature'][hits]])
+
+        if user_id is not None:
+            mine = users == user_id
+            ids, signatures = ids[mine], signatures[mine]
+        similarity = (signatures == sig).mean(axis=1)
+        keep = similarity >= min_similarity
+        ids, similarity = ids[keep], similarity[keep]
+        best = np.argsort(-similarity, kind='stable')
+        results, seen = [], set()
+        for i in best:
+            search_id = int(ids[i])
+            if search_id not in seen:
+                seen.add(search_id)
+                results.append((search_id, round(float(similarity[i]), 3)))
+                if len(results) == k:
+                    break
+        return results
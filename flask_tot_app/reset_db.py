@@ -1,20 +1,32 @@
-from app import app, db
+from factory import create_app
+from models import db
+import dbconfig
 import os
 
-print(f"Database URI: {app.config['SQLALCHEMY_DATABASE_URI']}")
-db_path = os.path.join(app.root_path, 'site.db')
-print(f"Expected DB Path: {db_path}")
+# Only the models are needed here, not the web app and the provider SDKs behind it
+app = create_app()
 
-if os.path.exists(db_path):
-    print("Removing existing database file...")
-    try:
-        os.remove(db_path)
-        print("File removed.")
-    except Exception as e:
-        print(f"Error removing file: {e}")
+print(f"Database URI: {app.config['SQLALCHEMY_DATABASE_URI']}")
 
-print("Creating new database...")
 with app.app_context():
+    db_path = db.engine.url.database if dbconfig.is_sqlite(app.config['SQLALCHEMY_DATABASE_URI']) else None
+    if db_path:
+        print(f"Database file: {db_path}")
+        db.engine.dispose()
+        # WAL mode keeps recent writes in side files; remove them with the database
+        for path in (db_path, db_path + '-wal', db_path + '-shm'):
+            if os.path.exists(path):
+                print(f"Removing {path}...")
+                try:
+                    os.remove(path)
+                except Exception as e:
+                    print(f"Error removing file: {e}")
+
+    print("Creating new database...")
     db.drop_all()
     db.create_all()
+    if db_path:
+        # New connections apply the pragmas; report what the file ended up with
+        journal_mode = db.session.execute(db.text("PRAGMA journal_mode")).scalar()
+        print(f"SQLite journal mode: {journal_mode}")
     print("Database created successfully with new schema.")
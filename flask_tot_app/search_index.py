@@ -0,0 +1,243 @@
+"""SQLite FTS5 full-text index over past searches and saved strategies.
+
+One FTS5 table holds a row per search, indexed on the query plus the titles and
+summaries of its results, and a row per saved strategy, indexed on its title plus
+its summary and activity names and descriptions. `install_hooks()` keeps it in
+step with the ORM on insert, update and delete, inside the same transaction as
+the change. `rebuild()` repopulates it from scratch after bulk edits. On
+databases without FTS5 every call is a no-op.
+
+Each row's rowid encodes its kind and id (`row_id()`). The kind and id columns are
+UNINDEXED, so filtering on them scans the whole table, while replacing or
+deleting one row by rowid is a direct lookup.
+"""
+import json
+import re
+import weakref
+
+from sqlalchemy import event, inspect as sa_inspect, text
+
+from dbtypes import unpack_text
+
+TABLE = 'search_index'
+KIND_SEARCH = 'search'
+KIND_STRATEGY = 'strategy'
+_KIND_CODES = {KIND_SEARCH: 0, KIND_STRATEGY: 1}
+
+# Title matches count five times as much as body matches
+_RANK = f"bm25({TABLE}, 5.0, 1.0)"
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+# Engines whose database is known to have the table, since the hooks ask on every write. Only a
+# positive answer is kept: the table may be created later (migrations.py after reset_db.py)
+_exists = weakref.WeakKeyDictionary()
+
+
+def is_supported(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def exists(connection):
+    if not is_supported(connection):
+        return False
+    if _exists.get(connection.engine):
+        return True
+    found = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': TABLE}
+    ).first() is not None
+    if found:
+        _exists[connection.engine] = True
+    return found
+
+
+def row_id(kind, ref_id):
+    return ref_id * len(_KIND_CODES) + _KIND_CODES[kind]
+
+
+def create(connection):
+    """Creates the FTS5 table; returns True if it did not exist before."""
+    if not is_supported(connection) or exists(connection):
+        return False
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+        " title, body, kind UNINDEXED, ref_id UNINDEXED, user_id UNINDEXED,"
+        " tokenize = 'porter unicode61 remove_diacritics 2')"
+    ))
+    _exists[connection.engine] = True
+    return True
+
+
+def is_keyed(connection, sample=100):
+    """False if the index was written before rows were keyed by `row_id()`, and needs a rebuild."""
+    rows = connection.execute(text(f"SELECT rowid, kind, ref_id FROM {TABLE} LIMIT :sample"), {'sample': sample})
+    return all(row.kind in _KIND_CODES and row.rowid == row_id(row.kind, row.ref_id) for row in rows)
+
+
+def search_body(results):
+    """Titles and summaries of a search's stored strategies (JSON text) as one string."""
+    try:
+        strategies = json.loads(results) if results else []
+    except ValueError:
+        return ''
+    if not isinstance(strategies, list):
+        return ''
+    parts = []
+    for strategy in strategies:
+        if isinstance(strategy, dict):
+            parts.extend(str(strategy.get(key) or '') for key in ('title', 'summary'))
+    return '\n'.join(part for part in parts if part)
+
+
+def put(connection, kind, ref_id, user_id, title, body):
+    remove(connection, kind, ref_id)
+    connection.execute(
+        text(f"INSERT INTO {TABLE} (rowid, title, body, kind, ref_id, user_id)"
+             " VALUES (:rowid, :title, :body, :kind, :ref_id, :user_id)"),
+        {'rowid': row_id(kind, ref_id), 'title': title or '', 'body': body or '', 'kind': kind, 'ref_id': ref_id,
+         'user_id': user_id},
+    )
+
+
+def remove(connection, kind, ref_id):
+    connection.execute(text(f"DELETE FROM {TABLE} WHERE rowid = :rowid"), {'rowid': row_id(kind, ref_id)})
+
+
+def match_expression(query, prefix=True):
+    """Turns free text into an FTS5 query that requires every word, the last one as a prefix.
+
+    Words are quoted so user input can never inject FTS5 syntax.
+    """
+    words = _WORD.findall(query or '')
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(connection, user_id, query, kind=None, limit=20, offset=0):
+    """Returns ranked hits for `user_id` as dicts with kind, id, title, snippet and rank."""
+    expression = match_expression(query)
+    if expression is None or not exists(connection):
+        return []
+    sql = (
+        f"SELECT kind, ref_id, title, snippet({TABLE}, 1, '[', ']', '…', 12) AS snippet, {_RANK} AS rank"
+        f" FROM {TABLE} WHERE {TABLE} MATCH :match AND user_id = :user_id"
+    )
+    params = {'match': expression, 'user_id': user_id, 'limit': limit, 'offset': offset}
+    if kind:
+        sql += " AND kind = :kind"
+        params['kind'] = kind
+    sql += " ORDER BY rank LIMIT :limit OFFSET :offset"
+    return [
+        {'kind': row.kind, 'id': row.ref_id, 'title': row.title, 'snippet': row.snippet, 'rank': round(row.rank, 3)}
+        for row in connection.execute(text(sql), params)
+    ]
+
+
+def words(value):
+    return {word.casefold() for word in _WORD.findall(value or '')}
+
+
+def find_similar_search(connection, user_id, query, min_overlap=0.8, candidates=5):
+    """Returns the id of the user's past search that best matches `query`, or None.
+
+    FTS narrows the candidates to searches containing every word. The best one must
+    then also have a word-set Jaccard overlap of at least `min_overlap`, so
+    "Kyoto in Spring" doesn't claim "Kyoto in Spring with kids and grandparents".
+    """
+    expression = match_expression(query, prefix=False)
+    if expression is None or not exists(connection):
+        return None
+    rows = connection.execute(
+        text(f"SELECT ref_id, title FROM {TABLE} WHERE {TABLE} MATCH :match AND user_id = :user_id"
+             f" AND kind = :kind ORDER BY {_RANK} LIMIT :limit"),
+        {'match': f'title : ({expression})', 'user_id': user_id, 'kind': KIND_SEARCH, 'limit': candidates},
+    ).fetchall()
+    target = words(query)
+    best, best_score = None, min_overlap
+    for row in rows:
+        found = words(row.title)
+        score = len(target & found) / len(target | found)
+        if score >= best_score:
+            best, best_score = row.ref_id, score
+    return best
+
+
+def rebuild(connection):
+    """Re-creates the index contents from the search_history and saved_strategy tables."""
+    if not is_supported(connection):
+        return 0
+    create(connection)
+    connection.execute(text(f"DELETE FROM {TABLE}"))
+    count = 0
+    for row in connection.execute(text("SELECT id, user_id, search_query, results FROM search_history")):
+        results = unpack_text(row.results) if row.results is not None else None
+        put(connection, KIND_SEARCH, row.id, row.user_id, row.search_query, search_body(results))
+        count += 1
+    activities = {}
+    for row in connection.execute(text(
+        "SELECT d.strategy_id, a.name, a.description FROM strategy_activity a"
+        " JOIN strategy_day d ON d.id = a.day_id ORDER BY d.strategy_id, d.position, a.position"
+    )):
+        activities.setdefault(row.strategy_id, []).extend([row.name or '', row.description or ''])
+    for row in connection.execute(text("SELECT id, user_id, title, summary FROM saved_strategy")):
+        body = '\n'.join([row.summary or ''] + activities.get(row.id, []))
+        put(connection, KIND_STRATEGY, row.id, row.user_id, row.title, body)
+        count += 1
+    return count
+
+
+def prune(connection):
+    """Fixes up the index after bulk SQL edits that bypass the ORM hooks (see compact_db.py)."""
+    if not exists(connection):
+        return
+    connection.execute(text(
+        f"DELETE FROM {TABLE} WHERE kind = :kind AND ref_id NOT IN (SELECT id FROM search_history)"
+    ), {'kind': KIND_SEARCH})
+    connection.execute(text(
+        f"UPDATE {TABLE} SET body = '' WHERE kind = :kind AND body != ''"
+        " AND ref_id IN (SELECT id FROM search_history WHERE results IS NULL)"
+    ), {'kind': KIND_SEARCH})
+
+
+def strategy_body(strategy):
+    parts = [strategy.summary or '']
+    for day in strategy.days:
+        for activity in day.activities:
+            parts.extend([activity.name or '', activity.description or ''])
+    return '\n'.join(part for part in parts if part)
+
+
+def install_hooks(search_model, strategy_model):
+    """Keeps the index in step with ORM writes to the two models."""
+
+    def index_search(mapper, connection, target):
+        if not exists(connection):
+            return
+        state = sa_inspect(target)
+        # Progress updates fire constantly while a job runs; only reindex when the text changed
+        if state.persistent and not (state.attrs.results.history.has_changes()
+                                     or state.attrs.search_query.history.has_changes()):
+            return
+        put(connection, KIND_SEARCH, target.id, target.user_id, target.search_query, search_body(target.results))
+
+    def index_strategy(mapper, connection, target):
+        if exists(connection):
+            put(connection, KIND_STRATEGY, target.id, target.user_id, target.title, strategy_body(target))
+
+    def remove_search(mapper, connection, target):
+        if exists(connection):
+            remove(connection, KIND_SEARCH, target.id)
+
+    def remove_strategy(mapper, connection, target):
+        if exists(connection):
+            remove(connection, KIND_STRATEGY, target.id)
+
+    event.listen(search_model, 'after_insert', index_search)
+    event.listen(search_model, 'after_update', index_search)
+    event.listen(search_model, 'after_delete', remove_search)
+    event.listen(strategy_model, 'after_insert', index_strategy)
+    event.listen(strategy_model, 'after_update', index_strategy)
+    event.listen(strategy_model, 'after_delete', remove_strategy)
@@ -0,0 +1,57 @@
+"""Flattening of strategy dicts (as produced by the LLM) into row values.
+
+Kept free of database code so the save path, the backfill migration and the
+analytics code all read strategies the same way.
+"""
+import re
+
+# cost_breakdown keys stored as one StrategyCost row each; 'currency' goes on the strategy
+COST_CATEGORIES = ('flights', 'lodging', 'food', 'transport', 'activities', 'total')
+
+_AMOUNT = re.compile(r'(\d[\d,]*(?:\.\d+)?)\s*([kK])?')
+
+
+def parse_cost_amount(value):
+    """Reads an LLM cost string such as "$2,600", "1.2k EUR" or "800-1000" as a float.
+
+    Ranges take their lower bound. Returns None when there is no number to read.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    match = _AMOUNT.search(value)
+    if not match:
+        return None
+    amount = float(match.group(1).replace(',', ''))
+    return amount * 1000 if match.group(2) else amount
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def strategy_summary_fields(details):
+    """Returns the precomputed SavedStrategy columns for a strategy dict."""
+    itinerary = details.get('itinerary') if isinstance(details.get('itinerary'), list) else []
+    locations = [loc for loc in details.get('locations') or [] if isinstance(loc, dict) and loc.get('name')]
+    costs = details.get('cost_breakdown') if isinstance(details.get('cost_breakdown'), dict) else {}
+
+    total = parse_cost_amount(costs.get('total'))
+    if total is None:
+        parts = [parse_cost_amount(costs.get(category)) for category in COST_CATEGORIES if category != 'total']
+        parts = [part for part in parts if part is not None]
+        total = sum(parts) if parts else None
+
+    return {
+        'summary': details.get('summary') if isinstance(details.get('summary'), str) else None,
+        'total_cost': total,
+        'currency': str(costs['currency'])[:10] if costs.get('currency') else None,
+        'num_days': len(itinerary),
+        'primary_location': str(locations[0]['name'])[:150] if locations else None,
+    }
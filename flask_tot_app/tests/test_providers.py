@@ -0,0 +1,42 @@
+"""Client and connection pool reuse in the provider layer."""
+from collections import OrderedDict
+
+import pytest
+
+import providers
+from providers import FakeProvider
+
+
+@pytest.fixture(autouse=True)
+def empty_client_cache(monkeypatch):
+    monkeypatch.setattr(providers, '_clients', OrderedDict())
+    monkeypatch.setattr(providers, 'CLIENT_CACHE_SIZE', 2)
+    monkeypatch.setattr(providers, 'PROVIDER_ORDER', ['fake'])
+
+
+def test_same_key_reuses_the_client():
+    created = FakeProvider.clients_created
+    for _ in range(2):
+        completion = providers.complete_with_fallback("Hello", {'fake': 'key-a'}, max_tokens=5, purpose='test')
+        assert completion
+    assert FakeProvider.clients_created == created + 1
+    assert providers.get_provider('fake', 'key-a').calls == 2
+
+
+def test_least_recently_used_client_is_evicted():
+    a = providers.get_provider('fake', 'key-a')
+    b = providers.get_provider('fake', 'key-b')
+    assert providers.get_provider('fake', 'key-a') is a
+    providers.get_provider('fake', 'key-c')
+    assert len(providers._clients) == 2
+    assert providers.get_provider('fake', 'key-a') is a
+    assert providers.get_provider('fake', 'key-b') is not b
+
+
+def test_sdk_clients_share_one_pool(monkeypatch):
+    openai = pytest.importorskip('openai')
+    monkeypatch.setattr(providers, '_http_clients', {})
+    first = providers.sdk_client(openai, openai.OpenAI, 'key-a')
+    second = providers.sdk_client(openai, openai.OpenAI, 'key-b')
+    assert first is not second
+    assert first._client is second._client is providers.shared_http_client(openai)
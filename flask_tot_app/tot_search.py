@@ -0,0 +1,288 @@
+"""Budgeted beam search over strategy refinements (the "tree" in Tree of Thoughts).
+
+The generated and critiqued strategies are the roots. At each level the best
+`beam_width` nodes of the previous level are expanded in parallel. Expanding a node
+asks the LLM for `branching` refined variants of it (a tighter budget, a swapped
+city, a reordered route), and critiques those variants. Expansion stops at `depth`
+levels, or earlier when the `Budget` of LLM calls, tokens or wall-clock time runs out.
+Once the time is up, nothing new is submitted or waited for, and expansions already
+running skip the calls they haven't made yet.
+
+Nodes that can't beat the best score found so far are pruned before they are
+expanded. A refinement is assumed to gain at most `prune_margin` points per level.
+That check runs again when an expansion leaves the queue, so a better child found
+meanwhile prunes its queued cousins. Identical strategies (by content fingerprint)
+are kept once, so the same subproblem is never expanded or critiqued twice.
+
+The engine only knows strategies as dicts and critiques as {'critique', 'score'}.
+The LLM calls are the `expand` and `score` callables passed in by app.py.
+"""
+import threading
+import time
+from concurrent.futures import TimeoutError, as_completed
+
+import tracing
+from cache import strategy_fingerprint
+
+MAX_SCORE = 10
+# Largest search shape a request may ask for; the budget bounds the cost within it
+MAX_DEPTH = 3
+MAX_BEAM_WIDTH = 4
+MAX_BRANCHING = 4
+
+# Node states recorded in the stored tree
+SCORED, EXPANDED, PRUNED, DUPLICATE = 'scored', 'expanded', 'pruned', 'duplicate'
+
+
+class Budget:
+    """LLM calls, tokens and wall-clock time one search may spend. None means unlimited.
+
+    Calls are reserved before they are made, so parallel expansions can't overspend.
+    Tokens are charged afterwards with what the providers reported.
+    """
+
+    def __init__(self, max_calls=None, max_tokens=None, deadline=None):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.deadline = deadline
+        self.calls = 0
+        self.tokens = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def charge(self, input_tokens, output_tokens):
+        """Usage callback for the provider layer (`on_usage`)."""
+        with self._lock:
+            self.tokens += (input_tokens or 0) + (output_tokens or 0)
+
+    def count_calls(self, calls):
+        """Records calls made outside a reservation (generation and the first critiques)."""
+        with self._lock:
+            self.calls += calls
+
+    def reserve(self, calls):
+        """Reserves `calls` LLM calls. Returns None if granted, else which limit is spent."""
+        with self._lock:
+            reason = self._exhausted(calls)
+            if reason is None:
+                self.calls += calls
+            return reason
+
+    def refund(self, calls):
+        with self._lock:
+            self.calls -= calls
+
+    def exhausted(self, calls=1):
+        with self._lock:
+            return self._exhausted(calls)
+
+    def _exhausted(self, calls):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return 'time'
+        if self.max_calls is not None and self.calls + calls > self.max_calls:
+            return 'calls'
+        if self.max_tokens is not None and self.calls:
+            # Don't start calls the remaining tokens are unlikely to cover
+            per_call = self.tokens / self.calls
+            if self.tokens + per_call * calls > self.max_tokens:
+                return 'tokens'
+        return None
+
+    def seconds_left(self):
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def out_of_time(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'max_calls': self.max_calls,
+                'tokens': self.tokens,
+                'max_tokens': self.max_tokens,
+                'seconds': round(time.monotonic() - self.started, 2),
+            }
+
+
+class Node:
+    __slots__ = ('id', 'parent', 'depth', 'strategy', 'fingerprint', 'status', 'note')
+
+    def __init__(self, id, parent, depth, strategy, fingerprint):
+        self.id = id
+        self.parent = parent
+        self.depth = depth
+        self.strategy = strategy
+        self.fingerprint = fingerprint
+        self.status = SCORED
+        self.note = None
+
+    @property
+    def score(self):
+        score = self.strategy.get('score')
+        return score if isinstance(score, (int, float)) else 0
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'parent': self.parent,
+            'depth': self.depth,
+            'status': self.status,
+            'note': self.note,
+            'score': self.score,
+            'strategy': self.strategy,
+        }
+
+
+class BeamSearch:
+    """One search over refinements of `roots`. Call `run()`, then read `ranked()` and `tree()`.
+
+    `expand(strategy, count)` returns up to `count` refined strategy dicts (one LLM
+    call). `score(strategies)` returns a critique dict per strategy (one call each,
+    run in parallel). Both must be safe to call from `executor` threads.
+    """
+
+    def __init__(self, roots, expand, score, budget, executor, depth=1, beam_width=2, branching=2, prune_margin=1.5):
+        self.expand = expand
+        self.score = score
+        self.budget = budget
+        self.executor = executor
+        self.depth = depth
+        self.beam_width = beam_width
+        self.branching = branching
+        self.prune_margin = prune_margin
+        self.nodes = []
+        self.stopped = None
+        self._seen = set()
+        self._lock = threading.Lock()
+        self.roots = [node for node in (self._add(strategy, None, 0) for strategy in roots) if node is not None]
+
+    def _add(self, strategy, parent, depth):
+        """Adds a scored strategy to the tree. Returns the node, or None for a duplicate (recorded as such)."""
+        fingerprint = strategy_fingerprint(strategy)
+        with self._lock:
+            node = Node(len(self.nodes), parent, depth, strategy, fingerprint)
+            self.nodes.append(node)
+            if fingerprint in self._seen:
+                node.status = DUPLICATE
+                return None
+            self._seen.add(fingerprint)
+            return node
+
+    def best_score(self):
+        with self._lock:
+            return max((node.score for node in self.nodes if node.status != DUPLICATE), default=0)
+
+    def _hopeless(self, node, levels_left):
+        """Whether even `levels_left` refinements of `node` can't beat the best score so far."""
+        best = self.best_score()
+        return node.score <= 0 or best >= MAX_SCORE or node.score + self.prune_margin * levels_left <= best
+
+    def run(self):
+        """Expands level by level. Yields ('status', message) and ('node', node) for every new child."""
+        frontier = self.roots
+        for level in range(1, self.depth + 1):
+            levels_left = self.depth - level + 1
+            beam = sorted(frontier, key=lambda node: node.score, reverse=True)[:self.beam_width]
+            for node in frontier:
+                if node not in beam:
+                    node.status, node.note = PRUNED, 'outside the beam'
+            beam = [node for node in beam if not self._prune(node, levels_left)]
+            if not beam:
+                self.stopped = self.stopped or 'no branch can beat the best score'
+                return
+            yield 'status', f"Refining the {len(beam)} most promising strategies (level {level} of {self.depth})..."
+
+            futures = {}
+            for node in beam:
+                # One call for the refinements, one critique per refinement
+                reason = self.budget.reserve(1 + self.branching)
+                if reason is not None:
+                    self.stopped = f"{reason} budget spent"
+                    node.status, node.note = PRUNED, self.stopped
+                    continue
+                futures[self.executor.submit(tracing.bind(self._expand), node, levels_left)] = node
+            if not futures:
+                return
+
+            frontier = []
+            try:
+                for future in as_completed(list(futures), timeout=self.budget.seconds_left()):
+                    node = futures.pop(future)
+                    try:
+                        children = future.result()
+                    except Exception as e:
+                        print(f"Refining strategy {node.id} failed: {e}")
+                        node.note = 'refinement failed'
+                        continue
+                    for child in children:
+                        yield 'node', child
+                        frontier.append(child)
+            except TimeoutError:
+                self.stopped = 'time budget spent'
+                for future, node in futures.items():
+                    if future.cancel():
+                        self.budget.refund(1 + self.branching)
+                    node.note = 'unfinished at the deadline'
+                return
+            if not frontier:
+                self.stopped = self.stopped or 'no new refinements'
+                return
+
+    def _prune(self, node, levels_left):
+        if self._hopeless(node, levels_left):
+            node.status, node.note = PRUNED, "can't beat the best score"
+            return True
+        return False
+
+    def _expand(self, node, levels_left):
+        """Worker: refines `node` and scores the refinements. Returns the new, non-duplicate children."""
+        # The best score may have risen, or the time run out, while this waited in the queue
+        if self.budget.out_of_time():
+            self.budget.refund(1 + self.branching)
+            node.note = 'unfinished at the deadline'
+            return []
+        if self._prune(node, levels_left):
+            self.budget.refund(1 + self.branching)
+            return []
+        node.status = EXPANDED
+        refined = [s for s in self.expand(node.strategy, self.branching) if isinstance(s, dict)][:self.branching]
+        if self.budget.out_of_time():
+            # Nobody is waiting for the critiques any more
+            self.budget.refund(self.branching)
+            node.note = 'unfinished at the deadline'
+            return []
+        self.budget.refund(self.branching - len(refined))
+        fresh = []
+        for strategy in refined:
+            strategy.pop('critique', None)
+            strategy.pop('score', None)
+            if strategy_fingerprint(strategy) in self._seen:
+                self.budget.refund(1)
+                self._add(strategy, node.id, node.depth + 1)
+                continue
+            fresh.append(strategy)
+        for strategy, critique in zip(fresh, self.score(fresh) if fresh else []):
+            strategy['critique'] = critique.get('critique', 'No critique available.')
+            strategy['score'] = critique.get('score', 0)
+        return [child for child in (self._add(s, node.id, node.depth + 1) for s in fresh) if child is not None]
+
+    def ranked(self, limit=None):
+        """Distinct scored nodes, best first."""
+        with self._lock:
+            nodes = [node for node in self.nodes if node.status != DUPLICATE]
+        nodes.sort(key=lambda node: node.score, reverse=True)
+        return nodes[:limit] if limit else nodes
+
+    def tree(self):
+        """The whole search as stored on SearchHistory.search_tree."""
+        with self._lock:
+            nodes = [node.as_dict() for node in self.nodes]
+        return {
+            'params': {'depth': self.depth, 'beam_width': self.beam_width, 'branching': self.branching,
+                       'prune_margin': self.prune_margin},
+            'budget': self.budget.as_dict(),
+            'stopped': self.stopped,
+            'best_score': self.best_score(),
+            'nodes': nodes,
+        }
@@ -0,0 +1,329 @@
+"""Tracing spans and Prometheus metrics for the search pipeline.
+
+`with tracing.span('critique', provider='gemini') as s:` times a stage. Spans nest
+through a context variable, so a provider call made inside a critique becomes its
+child. Each finished span is observed in a latency histogram labelled by its
+name and its low-cardinality attributes (METRIC_LABELS). Other attributes, such
+as the model, token counts and attempt number, are kept on the span itself. Each
+finished root span is stored with its whole tree in a small ring buffer
+(`recent_traces()`) and, with TRACE_LOG=1, printed as one JSON line.
+
+Thread pools don't carry context variables over, so work submitted to them is
+wrapped with `bind()` to stay in the submitter's trace.
+
+`render_metrics()` produces the Prometheus text format served at /metrics. A span
+costs a few microseconds (benchmarks/bench_tracing.py) and a search opens about 15,
+next to LLM calls that take seconds. Set TRACING=0 to turn spans into no-ops.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+ENABLED = os.getenv('TRACING', '1') != '0'
+TRACE_LOG = os.getenv('TRACE_LOG', '0') == '1'
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '100'))
+
+# Span attributes that become metric labels; anything else would explode the series count
+METRIC_LABELS = ('provider', 'purpose', 'outcome', 'endpoint', 'template', 'kind')
+# Upper bounds (seconds) of the span latency histogram
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+# Spans kept per trace, so a runaway loop can't grow one without bound
+MAX_SPANS_PER_TRACE = 500
+
+_current = contextvars.ContextVar('tracing_span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'trace', 'start', 'duration', 'children')
+
+    def __init__(self, name, attrs, trace):
+        self.name = name
+        self.attrs = attrs
+        self.trace = trace
+        self.start = time.perf_counter()
+        self.duration = None
+        self.children = []
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'duration_ms': None if self.duration is None else round(self.duration * 1000, 3),
+            'attrs': self.attrs,
+            'children': [child.as_dict() for child in self.children],
+        }
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    __slots__ = ('id', 'started_at', 'span_count')
+
+    def __init__(self):
+        self.id = os.urandom(8).hex()
+        self.started_at = time.time()
+        self.span_count = 0
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+_lock = threading.Lock()
+_durations = {}   # (span name, label pairs) -> Histogram
+_counters = {}    # (metric name, label pairs) -> value
+_recent = deque(maxlen=TRACE_BUFFER_SIZE)
+
+COUNTER_HELP = {
+    'wanderly_llm_tokens_total': 'LLM tokens reported by providers.',
+    'wanderly_llm_calls_total': 'LLM calls by provider, model, purpose and outcome.',
+    'wanderly_llm_skipped_total': 'Provider calls skipped by an open circuit or a spent key budget.',
+    'wanderly_job_retries_total': 'Analysis job attempts after the first.',
+    'wanderly_page_cache_total': 'Results and strategy page views by outcome: hit, miss or not_modified (304).',
+}
+
+
+def _labels(name, attrs):
+    return (('span', name),) + tuple((key, str(attrs[key])) for key in METRIC_LABELS if key in attrs)
+
+
+def start_span(name, **attrs):
+    """Opens a span and makes it current. Returns a handle for `end_span()`, or None when disabled."""
+    if not ENABLED:
+        return None
+    parent = _current.get()
+    current = Span(name, attrs, parent.trace if parent is not None else Trace())
+    return current, parent, _current.set(current)
+
+
+def end_span(handle, error=None):
+    if handle is None:
+        return
+    current, parent, token = handle
+    if error is not None:
+        current.attrs.setdefault('outcome', 'error')
+        current.attrs.setdefault('error', type(error).__name__)
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Ended from another context (e.g. a response body closed elsewhere); ours is untouched
+        pass
+    _finish(current, parent)
+
+
+class _SpanBlock:
+    __slots__ = ('name', 'attrs', 'handle')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.handle = start_span(self.name, **self.attrs)
+        return NOOP_SPAN if self.handle is None else self.handle[0]
+
+    def __exit__(self, exc_type, exc, traceback):
+        end_span(self.handle, exc)
+        return False
+
+
+def span(name, **attrs):
+    """Times a `with` block as a span named `name`. Exceptions set outcome='error' and propagate."""
+    return _SpanBlock(name, attrs)
+
+
+def _finish(current, parent):
+    current.duration = time.perf_counter() - current.start
+    key = _labels(current.name, current.attrs)
+    with _lock:
+        histogram = _durations.get(key)
+        if histogram is None:
+            histogram = _durations[key] = Histogram(DURATION_BUCKETS)
+        histogram.observe(current.duration)
+        if parent is not None:
+            if current.trace.span_count < MAX_SPANS_PER_TRACE:
+                current.trace.span_count += 1
+                parent.children.append(current)
+            return
+        # Kept as the Span itself; it is only turned into a dict when someone reads it
+        _recent.append(current)
+    if TRACE_LOG:
+        print(json.dumps({'trace': _trace_record(current)}, default=str))
+
+
+def _trace_record(root):
+    return {'trace_id': root.trace.id, 'started_at': root.trace.started_at, **root.as_dict()}
+
+
+def traced(name, **attrs):
+    """Decorator form of `span()` for a whole function."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **attrs):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name, seconds, **attrs):
+    """Records a stage that was timed by hand (e.g. parse time spread over a stream) as a finished span."""
+    if not ENABLED:
+        return
+    parent = _current.get()
+    finished = Span(name, attrs, parent.trace if parent is not None else Trace())
+    finished.start -= seconds
+    _finish(finished, parent)
+
+
+def annotate(**attrs):
+    """Adds attributes to the innermost open span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def bind(fn):
+    """Wraps `fn` so its spans join the caller's trace, for submitting to thread pools."""
+    if not ENABLED:
+        return fn
+    parent = _current.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return wrapper
+
+
+def count(metric, amount=1, **labels):
+    if not ENABLED or not amount:
+        return
+    key = (metric, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def record_llm_call(provider, model, purpose, outcome, input_tokens=0, output_tokens=0, call_span=None):
+    """Counts one provider call and its reported tokens, and notes them on `call_span` if given."""
+    if call_span is not None:
+        call_span.set(outcome=outcome, input_tokens=input_tokens, output_tokens=output_tokens)
+    count('wanderly_llm_calls_total', provider=provider, model=model, purpose=purpose, outcome=outcome)
+    count('wanderly_llm_tokens_total', input_tokens, provider=provider, model=model, direction='input')
+    count('wanderly_llm_tokens_total', output_tokens, provider=provider, model=model, direction='output')
+
+
+def recent_traces(limit=20):
+    with _lock:
+        return [_trace_record(root) for root in list(_recent)[-limit:][::-1]]
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def render_metrics():
+    """All histograms and counters in the Prometheus text exposition format."""
+    with _lock:
+        durations = [(key, list(h.counts), h.sum, h.count) for key, h in sorted(_durations.items())]
+        counters = sorted(_counters.items())
+    lines = [
+        '# HELP wanderly_span_duration_seconds Time spent in each pipeline stage.',
+        '# TYPE wanderly_span_duration_seconds histogram',
+    ]
+    for pairs, counts, total, observations in durations:
+        cumulative = 0
+        for bound, bucket_count in zip(DURATION_BUCKETS, counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"wanderly_span_duration_seconds_bucket{_format_labels(pairs + (('le', le),))} {cumulative}")
+        lines.append(f"wanderly_span_duration_seconds_sum{_format_labels(pairs)} {total:.6f}")
+        lines.append(f"wanderly_span_duration_seconds_count{_format_labels(pairs)} {observations}")
+    seen = set()
+    for (metric, pairs), value in counters:
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# HELP {metric} {COUNTER_HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_format_labels(pairs)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def install(app):
+    """Traces every request, and every template render inside it, on `app`."""
+    if not ENABLED:
+        return
+    from flask import before_render_template, g, request, template_rendered
+
+    def traced_body(body, handle):
+        try:
+            yield from body
+        except GeneratorExit:
+            handle[0].attrs['outcome'] = 'disconnected'
+            raise
+        finally:
+            end_span(handle)
+
+    @app.before_request
+    def start_request_span():
+        g._trace_request = start_span('request', endpoint=request.endpoint or 'unknown', method=request.method)
+
+    @app.after_request
+    def defer_streamed_request_span(response):
+        # A streamed body is produced after teardown, so its span ends with the body
+        handle = g.pop('_trace_request', None)
+        if handle is not None:
+            if response.is_streamed:
+                response.response = traced_body(response.response, handle)
+            else:
+                g._trace_request = handle
+        return response
+
+    @app.teardown_request
+    def finish_request_span(exc):
+        end_span(g.pop('_trace_request', None), exc)
+
+    def start_render(sender, template, context, **extra):
+        g.setdefault('_trace_renders', []).append(start_span('render', template=template.name))
+
+    def finish_render(sender, template, context, **extra):
+        renders = g.get('_trace_renders')
+        if renders:
+            end_span(renders.pop())
+
+    # Receivers are weakly referenced by default and these are locals
+    before_render_template.connect(start_render, app, weak=False)
+    template_rendered.connect(finish_render, app, weak=False)